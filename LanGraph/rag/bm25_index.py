@@ -0,0 +1,389 @@
+# ================================================================
+# INDICE INVERTITO BM25  –  retrieval sparso persistente
+# ================================================================
+# Gli embedding llama3 "sfumano" i token esatti: una domanda che
+# nomina "nanotech1.pdf" o un codice prodotto può mancare il chunk
+# giusto. L'indice BM25 trova le corrispondenze lessicali esatte.
+#
+#   segmento base   postings in formato CSR (termine -> doc, tf),
+#                   array .npy aperti in mmap
+#   delta           documenti aggiunti dopo l'ultimo save(), in RAM
+#   tombstone       documenti cancellati, esclusi in ricerca
+#
+# save() compatta base + delta in una nuova generazione di file e
+# sostituisce bm25.json per ultimo (scrittura atomica).
+#
+# Ricerca: i termini della domanda vengono ordinati per document
+# frequency e le postings intersecate dal termine più raro finché
+# restano almeno k candidati; solo quei candidati vengono pesati
+# con BM25 su tutti i termini.
+#
+# Il punteggio BM25 è relativo al corpus: anche una domanda fuori
+# tema ha un primo risultato se condivide una parola poco comune.
+# lexical_matches() dice quali chunk corrispondono davvero alla
+# domanda: contengono un identificatore citato (nome di file, codice
+# come "ZX-4471", "nanotech1") oppure tutti i suoi termini selettivi,
+# contando come mancanti i termini assenti dal corpus.
+#
+# Benchmark (da LanGraph/rag):  python bm25_index.py --docs 200000
+# ================================================================
+
+import argparse
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+META_FILE = "bm25.json"
+_TOKEN_RE = re.compile(r"\w+(?:[.\-]\w+)*")
+_SPLIT_RE = re.compile(r"[.\-]")
+MIN_TERM_LEN = 3     # termini più corti (articoli, preposizioni) non richiesti da lexical_matches
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Token minuscoli; gli identificatori composti ("nanotech1.pdf",
+    "ISO-9001") restano interi e vengono indicizzati anche a pezzi.
+    """
+    tokens = []
+    for match in _TOKEN_RE.finditer(text.lower()):
+        token = match.group()
+        tokens.append(token)
+        if "." in token or "-" in token:
+            tokens.extend(p for p in _SPLIT_RE.split(token) if p)
+    return tokens
+
+
+def is_identifier(token: str) -> bool:
+    """Nome di file o codice: token composto ("iso-9001") o con lettere e cifre ("nanotech1")."""
+    if "." in token or "-" in token:
+        return True
+    return any(c.isdigit() for c in token) and not token.isdigit()
+
+
+class BM25Index:
+    """
+    Indice BM25 incrementale, indicizzato per ID di chunk.
+    Oltre al testo indicizza il nome del file sorgente, così una domanda
+    che cita il file trova i suoi chunk anche se il testo non lo nomina.
+    """
+
+    def __init__(self, directory: Optional[str] = None, k1: float = 1.2, b: float = 0.75):
+        self.directory = directory
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._generation = 0
+        self.clear()
+        self._dirty = False
+        if directory and os.path.exists(os.path.join(directory, META_FILE)):
+            self._open()
+
+    def __len__(self) -> int:
+        return self._alive_count
+
+    def clear(self) -> None:
+        """Svuota l'indice; il prossimo save() sostituisce quello su disco."""
+        # Segmento base (CSR)
+        self._terms: Dict[str, int] = {}
+        self._term_offsets = np.zeros(1, dtype=np.int64)
+        self._post_docs = np.zeros(0, dtype=np.int32)
+        self._post_tfs = np.zeros(0, dtype=np.uint16)
+        self._n_base = 0
+
+        # Tutti i documenti (base + delta), per doc-int
+        self._ids: List[str] = []
+        self._lengths: List[int] = []
+        self._alive = bytearray()
+        self._row: Dict[str, int] = {}
+        self._alive_count = 0
+        self._alive_length = 0
+
+        # Delta in RAM: termine -> {doc-int: tf}
+        self._delta: Dict[str, Dict[int, int]] = {}
+        self._dirty = True
+
+    # --- Persistenza ---
+
+    def _path(self, name: str, generation: int) -> str:
+        stem, ext = os.path.splitext(name)
+        return os.path.join(self.directory, f"{stem}.{generation}{ext}")
+
+    def _open(self) -> None:
+        with open(os.path.join(self.directory, META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        gen = meta["generation"]
+        self._generation = gen
+        with open(self._path("terms.json", gen), "r", encoding="utf-8") as f:
+            self._terms = {term: i for i, term in enumerate(json.load(f))}
+        with open(self._path("ids.json", gen), "r", encoding="utf-8") as f:
+            self._ids = json.load(f)
+        self._term_offsets = np.load(self._path("offsets.npy", gen))
+        self._post_docs = np.load(self._path("docs.npy", gen), mmap_mode="r")
+        self._post_tfs = np.load(self._path("tfs.npy", gen), mmap_mode="r")
+        self._lengths = np.load(self._path("lengths.npy", gen)).tolist()
+        self._n_base = len(self._ids)
+        self._alive = bytearray(b"\x01") * self._n_base
+        self._row = {doc_id: i for i, doc_id in enumerate(self._ids)}
+        self._alive_count = self._n_base
+        self._alive_length = int(sum(self._lengths))
+        self._delta = {}
+        self._dirty = False
+
+    def save(self) -> None:
+        """Compatta base + delta (senza i documenti cancellati) in una nuova generazione."""
+        with self._lock:
+            if not self.directory or not self._dirty:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+
+            # Tutte le postings come triple (termine, doc, tf)
+            terms = list(self._terms) + [t for t in self._delta if t not in self._terms]
+            term_ids = {t: i for i, t in enumerate(terms)}
+            base_terms = np.repeat(np.arange(len(self._terms), dtype=np.int64), np.diff(self._term_offsets))
+            delta_items = [(term_ids[t], d, tf) for t, posting in self._delta.items() for d, tf in posting.items()]
+            delta_arr = np.array(delta_items, dtype=np.int64).reshape(-1, 3)
+            all_terms = np.concatenate([base_terms, delta_arr[:, 0]])
+            all_docs = np.concatenate([np.asarray(self._post_docs, dtype=np.int64), delta_arr[:, 1]])
+            all_tfs = np.concatenate([np.asarray(self._post_tfs, dtype=np.int64), delta_arr[:, 2]])
+
+            alive = np.frombuffer(bytes(self._alive), dtype=np.uint8).astype(bool)
+            keep = alive[all_docs] if len(all_docs) else np.zeros(0, dtype=bool)
+            remap = np.cumsum(alive) - 1
+            all_terms, all_docs, all_tfs = all_terms[keep], remap[all_docs[keep]], all_tfs[keep]
+            order = np.lexsort((all_docs, all_terms))
+            all_terms, all_docs, all_tfs = all_terms[order], all_docs[order], all_tfs[order]
+
+            used = np.unique(all_terms)
+            counts = np.bincount(np.searchsorted(used, all_terms), minlength=len(used))
+            offsets = np.zeros(len(used) + 1, dtype=np.int64)
+            np.cumsum(counts, out=offsets[1:])
+            ids = [doc_id for doc_id, a in zip(self._ids, alive) if a]
+            lengths = np.array([n for n, a in zip(self._lengths, alive) if a], dtype=np.int32)
+
+            old, gen = self._generation, self._generation + 1
+            with open(self._path("terms.json", gen), "w", encoding="utf-8") as f:
+                json.dump([terms[i] for i in used], f, ensure_ascii=False)
+            with open(self._path("ids.json", gen), "w", encoding="utf-8") as f:
+                json.dump(ids, f)
+            np.save(self._path("offsets.npy", gen), offsets)
+            np.save(self._path("docs.npy", gen), all_docs.astype(np.int32))
+            np.save(self._path("tfs.npy", gen), np.minimum(all_tfs, 65535).astype(np.uint16))
+            np.save(self._path("lengths.npy", gen), lengths)
+            tmp = os.path.join(self.directory, META_FILE + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"generation": gen, "documents": len(ids), "terms": len(used)}, f)
+            os.replace(tmp, os.path.join(self.directory, META_FILE))
+
+            self._open()
+            if old:
+                for name in ("terms.json", "ids.json", "offsets.npy", "docs.npy", "tfs.npy", "lengths.npy"):
+                    try:
+                        os.remove(self._path(name, old))
+                    except OSError:
+                        pass
+
+    # --- Aggiornamento ---
+
+    def add(self, ids: Sequence[str], texts: Sequence[str],
+            metadatas: Optional[Sequence[Optional[dict]]] = None) -> None:
+        with self._lock:
+            for i, (doc_id, text) in enumerate(zip(ids, texts)):
+                if doc_id in self._row:
+                    self.remove([doc_id])
+                source = (metadatas[i] or {}).get("source_file", "") if metadatas else ""
+                tf = Counter(tokenize(text) + tokenize(source))
+                length = sum(tf.values())
+                row = len(self._ids)
+                self._ids.append(doc_id)
+                self._lengths.append(length)
+                self._alive.append(1)
+                self._row[doc_id] = row
+                self._alive_count += 1
+                self._alive_length += length
+                for term, count in tf.items():
+                    self._delta.setdefault(term, {})[row] = count
+            self._dirty = True
+
+    def remove(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            for doc_id in ids:
+                row = self._row.pop(doc_id, None)
+                if row is None or not self._alive[row]:
+                    continue
+                self._alive[row] = 0
+                self._alive_count -= 1
+                self._alive_length -= self._lengths[row]
+                self._dirty = True
+
+    # --- Ricerca ---
+
+    def _postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Doc (ordinati) e tf del termine, solo documenti vivi."""
+        parts_docs, parts_tfs = [], []
+        index = self._terms.get(term)
+        if index is not None:
+            start, end = self._term_offsets[index], self._term_offsets[index + 1]
+            parts_docs.append(np.asarray(self._post_docs[start:end], dtype=np.int64))
+            parts_tfs.append(np.asarray(self._post_tfs[start:end], dtype=np.float32))
+        delta = self._delta.get(term)
+        if delta:
+            parts_docs.append(np.fromiter(delta.keys(), dtype=np.int64, count=len(delta)))
+            parts_tfs.append(np.fromiter(delta.values(), dtype=np.float32, count=len(delta)))
+        if not parts_docs:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        docs, tfs = np.concatenate(parts_docs), np.concatenate(parts_tfs)
+        if self._alive_count == len(self._ids):
+            return docs, tfs                # nessun tombstone
+        alive = np.frombuffer(self._alive, dtype=np.uint8)[docs].astype(bool)
+        return docs[alive], tfs[alive]
+
+    def search(self, query: str, k: int = 20,
+               allowed: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """
+        Top-k BM25 (ID, punteggio). Candidati = intersezione progressiva
+        delle postings dal termine più raro, finché restano >= k documenti
+        (se anche il termine più raro ne ha meno di k, unione dei più rari).
+        Nessun risultato se la domanda contiene solo termini comunissimi.
+        allowed limita la ricerca a questi ID (filtri sui metadati).
+        """
+        with self._lock:
+            if not self._alive_count:
+                return []
+            postings = [(term, *self._postings(term)) for term in set(tokenize(query))]
+            postings = [p for p in postings if len(p[1])]
+            if not postings:
+                return []
+            n = self._alive_count
+            # I termini presenti in più di metà dei documenti (articoli,
+            # preposizioni) contano nel punteggio ma non generano candidati
+            selective = [p for p in postings if 2 * len(p[1]) <= n]
+            if allowed is not None:
+                rows = np.unique(np.fromiter((self._row[i] for i in allowed if i in self._row),
+                                             dtype=np.int64))
+                masks = [np.isin(d, rows, assume_unique=True) for _, d, _ in selective]
+                selective = [(t, d[m], tf[m]) for (t, d, tf), m in zip(selective, masks)]
+                selective = [p for p in selective if len(p[1])]
+            selective.sort(key=lambda p: len(p[1]))
+            if not selective:
+                return []
+
+            candidates = selective[0][1]
+            for _, docs, _ in selective[1:]:
+                narrowed = np.intersect1d(candidates, docs, assume_unique=True)
+                if len(narrowed) < k:
+                    break
+                candidates = narrowed
+            for _, docs, _ in selective[1:]:
+                if len(candidates) >= k:
+                    break
+                candidates = np.union1d(candidates, docs)
+
+            avgdl = self._alive_length / n
+            lengths = np.fromiter((self._lengths[i] for i in candidates), dtype=np.float32,
+                                  count=len(candidates))
+            norm = self.k1 * (1.0 - self.b + self.b * lengths / avgdl)
+            scores = np.zeros(len(candidates), dtype=np.float32)
+            for _, docs, tfs in postings:
+                _, in_cand, in_term = np.intersect1d(candidates, docs, assume_unique=True,
+                                                     return_indices=True)
+                if not len(in_cand):
+                    continue
+                df = len(docs)
+                idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+                tf = tfs[in_term]
+                scores[in_cand] += idf * tf * (self.k1 + 1.0) / (tf + norm[in_cand])
+
+            k = min(k, len(candidates))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(self._ids[candidates[i]], float(scores[i])) for i in top]
+
+
+    def lexical_matches(self, query: str, ids: Iterable[str]) -> Set[str]:
+        """
+        Tra gli ids, i chunk che contengono un identificatore citato nella
+        domanda oppure tutti i suoi termini selettivi (almeno MIN_TERM_LEN
+        caratteri, in non più di metà dei documenti; un termine assente dal
+        corpus è selettivo e non corrisponde a nessun chunk).
+        """
+        with self._lock:
+            rows = np.fromiter((self._row[i] for i in ids if i in self._row), dtype=np.int64)
+            if not len(rows) or not self._alive_count:
+                return set()
+            identifier = np.zeros(len(rows), dtype=bool)
+            covered = np.ones(len(rows), dtype=bool)
+            required = 0
+            for term in set(tokenize(query)):
+                docs, _ = self._postings(term)
+                present = np.isin(rows, docs)
+                if is_identifier(term):
+                    identifier |= present
+                if len(term) >= MIN_TERM_LEN and 2 * len(docs) <= self._alive_count:
+                    covered &= present
+                    required += 1
+            if not required:
+                covered[:] = False
+            return {self._ids[row] for row in rows[identifier | covered]}
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """
+    RRF: punteggio(d) = somma su ogni lista di 1 / (k + rango). Non
+    richiede punteggi confrontabili tra retriever diversi.
+    """
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] = fused.get(doc_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latenza della ricerca BM25")
+    parser.add_argument("--docs", type=int, default=200000)
+    parser.add_argument("--words", type=int, default=150, help="Parole per documento")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=20)
+    args = parser.parse_args()
+
+    import tempfile
+
+    rng = np.random.default_rng(0)
+    # Distribuzione di Zipf: poche parole frequentissime, coda lunga di termini rari
+    vocab = np.array([f"t{i}" for i in range(50000)])
+    weights = 1.0 / np.arange(1, len(vocab) + 1)
+    weights /= weights.sum()
+    texts = [" ".join(rng.choice(vocab, args.words, p=weights)) for _ in range(args.docs)]
+    metas = [{"source_file": f"doc{i % 500}.pdf"} for i in range(args.docs)]
+    ids = [f"c{i}" for i in range(args.docs)]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        index = BM25Index(workdir)
+        start = time.perf_counter()
+        index.add(ids, texts, metas)
+        index.save()
+        build = time.perf_counter() - start
+        start = time.perf_counter()
+        index = BM25Index(workdir)
+        opened = time.perf_counter() - start
+
+        queries = [" ".join(rng.choice(vocab[:5000], 4)) + f" doc{rng.integers(500)}.pdf"
+                   for _ in range(args.queries)]
+        latencies = []
+        for q in queries:
+            start = time.perf_counter()
+            index.search(q, args.k)
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies.sort()
+
+    print(f"\n[BENCH] {args.docs} documenti x {args.words} parole, {args.queries} query, k={args.k}")
+    print(f"  indicizzazione + save: {build:.1f}s   apertura: {opened * 1000:.0f} ms")
+    print(f"  ricerca: p50={latencies[len(latencies) // 2]:.2f} ms  "
+          f"p95={latencies[int(0.95 * len(latencies))]:.2f} ms")
@@ -0,0 +1,128 @@
+# ================================================================
+# CONTENT-DEFINED CHUNKING  –  confini stabili alle modifiche locali
+# ================================================================
+# TokenTextSplitter taglia a offset fissi: inserire un paragrafo in
+# cima sposta tutti i confini successivi e ogni chunk diventa "nuovo".
+# Qui il confine è deciso dal contenuto: un rolling hash (gear hash)
+# scorre sulle unità di testo (parole o frasi) e si taglia quando i
+# bit alti dell'hash sono tutti a zero, rispettando min/max.
+#
+# Dopo una modifica i confini si riallineano entro poche unità,
+# quindi i chunk successivi restano identici (stesso ID -> niente
+# nuovo embedding in sync_vectorstore).
+#
+# Demo di stabilità:  python cdc_splitter.py
+# ================================================================
+
+import math
+import re
+import zlib
+from typing import List
+
+from langchain_text_splitters import TextSplitter
+
+_WORD_RE = re.compile(r"\S+\s*")
+_SENTENCE_RE = re.compile(r"[^.!?;\n]+(?:[.!?;]+|\n+|$)\s*|[.!?;\n]+\s*")
+_WORDS_PER_SENTENCE = 20          # stima fissa: il taglio non deve dipendere dal documento intero
+
+
+def _unit_hash(unit: str) -> int:
+    return zlib.crc32(unit.strip().encode("utf-8"))
+
+
+class ContentDefinedSplitter(TextSplitter):
+    """
+    Splitter content-defined con dimensioni espresse in parole:
+      min_size <= chunk <= max_size, media attesa ~avg_size.
+    unit="word" valuta un possibile taglio dopo ogni parola,
+    unit="sentence" solo a fine frase (chunk più leggibili).
+    """
+
+    def __init__(self, min_size: int = 150, avg_size: int = 400, max_size: int = 600,
+                 unit: str = "word", **kwargs):
+        kwargs.setdefault("chunk_overlap", 0)
+        super().__init__(chunk_size=max_size, **kwargs)
+        if not 0 < min_size < avg_size <= max_size:
+            raise ValueError("Serve 0 < min_size < avg_size <= max_size")
+        if unit not in ("word", "sentence"):
+            raise ValueError("unit deve essere 'word' o 'sentence'")
+        self.min_size = min_size
+        self.avg_size = avg_size
+        self.max_size = max_size
+        self.unit = unit
+        # Distanza attesa tra due tagli (oltre il minimo) = 2^bits unità
+        per_unit = _WORDS_PER_SENTENCE if unit == "sentence" else 1
+        bits = max(1, round(math.log2(max(2, (avg_size - min_size) / per_unit))))
+        self._mask = ((1 << bits) - 1) << (32 - bits)     # bit alti: finestra ~32 unità
+
+    def _units(self, text: str) -> List[str]:
+        pattern = _SENTENCE_RE if self.unit == "sentence" else _WORD_RE
+        return [u for u in pattern.findall(text) if u.strip()]
+
+    def split_text(self, text: str) -> List[str]:
+        chunks: List[str] = []
+        current: List[str] = []
+        words = 0
+        rolling = 0
+
+        for unit in self._units(text):
+            unit_words = len(unit.split()) if self.unit == "sentence" else 1
+            # Una frase più lunga del massimo viene spezzata a parole
+            if self.unit == "sentence" and unit_words > self.max_size:
+                pieces = _WORD_RE.findall(unit)
+                unit_groups = ["".join(pieces[i:i + self.max_size])
+                               for i in range(0, len(pieces), self.max_size)]
+            else:
+                unit_groups = [unit]
+
+            for piece in unit_groups:
+                piece_words = len(piece.split()) if len(unit_groups) > 1 else unit_words
+                if current and words + piece_words > self.max_size:
+                    chunks.append("".join(current).strip())
+                    current, words = [], 0
+                current.append(piece)
+                words += piece_words
+                rolling = ((rolling << 1) + _unit_hash(piece)) & 0xFFFFFFFF
+                if words >= self.min_size and (rolling & self._mask) == 0:
+                    chunks.append("".join(current).strip())
+                    current, words = [], 0
+
+        if current:
+            chunks.append("".join(current).strip())
+        return [c for c in chunks if c]
+
+
+def _changed_chunks(before: List[str], after: List[str]) -> int:
+    """Chunk di 'after' che non esistevano in 'before' (= da ri-embeddare)."""
+    return len(set(after) - set(before))
+
+
+if __name__ == "__main__":
+    import random
+
+    rng = random.Random(0)
+    vocab = [f"parola{i}" for i in range(2000)]
+
+    def sentence() -> str:
+        return " ".join(rng.choice(vocab) for _ in range(rng.randint(8, 30))) + ". "
+
+    document = "".join(sentence() for _ in range(2000))
+    edited = sentence() * 3 + document                     # paragrafo inserito in testa
+    middle = len(document) // 2
+    middle = document.index(". ", middle) + 2
+    edited_mid = document[:middle] + sentence() + document[middle:]
+
+    def fixed_windows(text: str, size: int = 400) -> List[str]:
+        words = _WORD_RE.findall(text)
+        return ["".join(words[i:i + size]).strip() for i in range(0, len(words), size)]
+
+    print(f"\n[DEMO] documento da {len(document.split())} parole")
+    for name, split in [
+        ("finestre fisse 400", fixed_windows),
+        ("CDC parole", ContentDefinedSplitter(unit="word").split_text),
+        ("CDC frasi", ContentDefinedSplitter(unit="sentence").split_text),
+    ]:
+        base = split(document)
+        print(f"  {name:<20} chunk={len(base):<4} "
+              f"nuovi dopo inserimento in testa={_changed_chunks(base, split(edited)):<4} "
+              f"a metà={_changed_chunks(base, split(edited_mid))}")
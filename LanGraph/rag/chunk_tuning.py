@@ -0,0 +1,224 @@
+# ================================================================
+# AUTOTUNING DI CHUNK_SIZE / CHUNK_OVERLAP
+# ================================================================
+# CHUNK_SIZE=800 / CHUNK_OVERLAP=100 (rag.py) e 500/50 (rag_graph)
+# sono scelte a occhio. Questo benchmark prova una griglia di
+# configurazioni sul corpus di ./data e su un set di domande con i
+# passaggi rilevanti etichettati, e per ognuna misura:
+#   chunk, dimensione dell'indice, tempo di ingestion, latenza di
+#   retrieval (p50/p95), recall@k, token di contesto per risposta.
+# Poi raccomanda la configurazione migliore entro un budget di
+# latenza e/o di memoria.
+#
+# Formato del set di domande (JSON):
+#   [
+#     {"question": "Che cosa sono i nanotubi?",
+#      "relevant": ["I nanotubi di carbonio sono ...", "..."]},
+#     ...
+#   ]
+# Un passaggio è "trovato" se almeno un chunk del top-k ne contiene
+# la maggior parte delle parole (PASSAGE_COVERAGE).
+#
+# Uso (da LanGraph/rag):
+#   python chunk_tuning.py --questions domande.json \
+#       --sizes 200 400 800 1200 --overlaps 0 50 100 --max-latency-ms 50
+#   python chunk_tuning.py --questions domande.json --splitter chars   # come rag_graph
+# ================================================================
+
+import argparse
+import json
+import os
+import re
+import shutil
+import statistics
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+from langchain_chroma import Chroma
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter, TextSplitter
+
+import rag
+from token_chunking import TokenCountingSplitter, TokenAwareSplitter
+
+PASSAGE_COVERAGE = 0.8     # frazione di parole del passaggio che il chunk deve contenere
+_WORD_RE = re.compile(r"\w+")
+
+
+@dataclass
+class TuningResult:
+    """Misure di una configurazione (chunk_size, chunk_overlap)"""
+    chunk_size: int
+    chunk_overlap: int
+    chunks: int
+    index_mb: float
+    ingest_seconds: float
+    latency_p50_ms: float
+    latency_p95_ms: float
+    recall: float
+    context_tokens: float
+
+
+def load_questions(path: str) -> List[Dict]:
+    with open(path, "r", encoding="utf-8") as f:
+        questions = json.load(f)
+    for item in questions:
+        if not item.get("question") or not item.get("relevant"):
+            raise ValueError(f"Domanda senza testo o passaggi rilevanti: {item}")
+    return questions
+
+
+def _words(text: str) -> List[str]:
+    return _WORD_RE.findall(text.lower())
+
+
+def passage_found(passage: str, chunks: Sequence[Document]) -> bool:
+    """
+    True se un chunk contiene almeno PASSAGE_COVERAGE delle parole del
+    passaggio: tollera tagli diversi, spazi e maiuscole.
+    """
+    wanted = _words(passage)
+    if not wanted:
+        return False
+    for chunk in chunks:
+        present = set(_words(chunk.page_content))
+        if sum(w in present for w in wanted) / len(wanted) >= PASSAGE_COVERAGE:
+            return True
+    return False
+
+
+def make_splitter(kind: str, chunk_size: int, chunk_overlap: int) -> TextSplitter:
+    """
+    "token": lo splitter di rag.py (token del tokenizer target);
+    "chars": RecursiveCharacterTextSplitter come in rag_graph.
+    In entrambi i casi i chunk hanno metadata["token_count"].
+    """
+    if kind == "chars":
+        inner = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        return TokenCountingSplitter(inner, rag.TOKENIZER)
+    return TokenAwareSplitter(rag.TOKENIZER, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+
+
+def _dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+
+def evaluate_config(documents: List[Document], questions: List[Dict],
+                    query_vectors: List[List[float]], embeddings,
+                    splitter_kind: str, chunk_size: int, chunk_overlap: int,
+                    k: int) -> TuningResult:
+    """
+    Ingestion completa in un Chroma temporaneo su disco, poi le domande
+    vengono interrogate con i vettori già calcolati: la latenza misurata
+    è quella della ricerca, non dell'embedding della domanda.
+    """
+    workdir = tempfile.mkdtemp(prefix="chunk_tuning_")
+    try:
+        start = time.perf_counter()
+        chunks = make_splitter(splitter_kind, chunk_size, chunk_overlap).split_documents(documents)
+        vectorstore = Chroma(collection_name="tuning", embedding_function=embeddings,
+                             persist_directory=workdir)
+        for batch in rag._batched(chunks, rag.EMBED_BATCH_SIZE):
+            vectorstore.add_documents(list(batch))
+        ingest_seconds = time.perf_counter() - start
+
+        latencies, found, total, context = [], 0, 0, []
+        for item, vector in zip(questions, query_vectors):
+            start = time.perf_counter()
+            retrieved = vectorstore.similarity_search_by_vector(vector, k=k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            found += sum(passage_found(p, retrieved) for p in item["relevant"])
+            total += len(item["relevant"])
+            context.append(sum(d.metadata.get("token_count", 0) for d in retrieved))
+
+        index_mb = _dir_size(workdir) / 2**20
+        latencies.sort()
+        return TuningResult(
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
+            chunks=len(chunks),
+            index_mb=index_mb,
+            ingest_seconds=ingest_seconds,
+            latency_p50_ms=statistics.median(latencies),
+            latency_p95_ms=latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))],
+            recall=found / total if total else 0.0,
+            context_tokens=statistics.mean(context) if context else 0.0,
+        )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def recommend(results: List[TuningResult], max_latency_ms: Optional[float] = None,
+              max_index_mb: Optional[float] = None) -> Optional[TuningResult]:
+    """
+    Migliore recall@k tra le configurazioni entro il budget; a parità
+    di recall vince quella con meno token di contesto (prompt più corti).
+    """
+    eligible = [
+        r for r in results
+        if (max_latency_ms is None or r.latency_p95_ms <= max_latency_ms)
+        and (max_index_mb is None or r.index_mb <= max_index_mb)
+    ]
+    if not eligible:
+        return None
+    return max(eligible, key=lambda r: (round(r.recall, 3), -r.context_tokens))
+
+
+def print_table(results: List[TuningResult], k: int) -> None:
+    print(f"\n  {'size':>5} {'overlap':>7} {'chunk':>6} {'indice MB':>9} {'ingest s':>8} "
+          f"{'p50 ms':>7} {'p95 ms':>7} {f'recall@{k}':>9} {'tok/risposta':>12}")
+    for r in results:
+        print(f"  {r.chunk_size:>5} {r.chunk_overlap:>7} {r.chunks:>6} {r.index_mb:>9.1f} "
+              f"{r.ingest_seconds:>8.2f} {r.latency_p50_ms:>7.2f} {r.latency_p95_ms:>7.2f} "
+              f"{r.recall:>9.2%} {r.context_tokens:>12.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep di chunk size / overlap sul corpus di ./data")
+    parser.add_argument("--questions", required=True, help="JSON con domande e passaggi rilevanti")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[200, 400, 800, 1200])
+    parser.add_argument("--overlaps", type=int, nargs="+", default=[0, 50, 100, 200])
+    parser.add_argument("--splitter", choices=["token", "chars"], default="token",
+                        help="token = rag.py (token), chars = rag_graph (caratteri)")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--max-latency-ms", type=float, help="Budget di latenza p95 della ricerca")
+    parser.add_argument("--max-index-mb", type=float, help="Budget di dimensione dell'indice")
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions)
+    documents = rag.load_all_documents()
+    if not documents:
+        raise SystemExit("[ERRORE] Nessun documento: inserisci dei file in ./data")
+
+    # La cache su disco evita di ri-embeddare i chunk identici tra configurazioni
+    embeddings = rag.build_embeddings()
+    query_vectors = [embeddings.embed_query(item["question"]) for item in questions]
+
+    results = []
+    for size in args.sizes:
+        for overlap in args.overlaps:
+            if overlap >= size:
+                continue
+            print(f"[INFO] Configurazione size={size} overlap={overlap}...")
+            results.append(evaluate_config(documents, questions, query_vectors, embeddings,
+                                           args.splitter, size, overlap, args.k))
+
+    print(f"\n[BENCH] {len(documents)} documenti, {len(questions)} domande, "
+          f"splitter={args.splitter}, embedding={rag.EMBEDDING_MODEL}")
+    print_table(results, args.k)
+    print(f"\n[INFO] Cache embedding: {embeddings}")
+
+    best = recommend(results, args.max_latency_ms, args.max_index_mb)
+    budget = ", ".join(filter(None, [
+        f"p95 <= {args.max_latency_ms} ms" if args.max_latency_ms is not None else "",
+        f"indice <= {args.max_index_mb} MB" if args.max_index_mb is not None else "",
+    ])) or "nessun budget"
+    if best is None:
+        print(f"\n[WARN] Nessuna configurazione rispetta il budget ({budget})")
+    else:
+        print(f"\n[RACCOMANDAZIONE] ({budget}) CHUNK_SIZE={best.chunk_size}  "
+              f"CHUNK_OVERLAP={best.chunk_overlap}  recall@{args.k}={best.recall:.2%}  "
+              f"p95={best.latency_p95_ms:.2f} ms  indice={best.index_mb:.1f} MB")
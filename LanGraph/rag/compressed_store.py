@@ -0,0 +1,590 @@
+# ================================================================
+# VETTORI COMPRESSI FUORI DALL'HNSW  –  righe in append su disco
+# ================================================================
+# Con VECTOR_COMPRESSION i vettori non entrano nell'HNSW di Chroma:
+# la collection riceve testi, metadati e un embedding segnaposto di
+# una dimensione, mentre in <base>_compressed/ ci sono
+#
+#   full.<gen>.f32        vettori full-precision (mmap, solo rescoring)
+#   ids.<gen>.txt         ID dei chunk, uno per riga (riga -> ID)
+#   dead.<gen>.npy        righe cancellate (tombstone)
+#   <colonna>.<gen>.bin   codici dell'indice, una riga per vettore
+#                         (piatto: codes/norms/scales; IVF-PQ: pq/list)
+#   model.<gen>.npz       modello (PCA, o centroidi e codebook IVF-PQ)
+#   vectors.json          spec, righe valide, generazioni (scritto per ultimo)
+#
+# Scritture incrementali: un chunk nuovo è una riga in coda a tutti i
+# file, codificata con il modello già addestrato (per IVF-PQ: lista
+# più vicina + codici PQ del residuo); un chunk cancellato diventa una
+# tombstone. Le righe restano in RAM fino a FLUSH_ROWS o a save().
+#
+#   - l'addestramento usa un campione di righe letto dalla mmap (al
+#     più train_rows, mai l'intero corpus in RAM);
+#   - finché il corpus è più piccolo del campione il modello viene
+#     riaddestrato quando le righe vive raddoppiano (costo ammortizzato),
+#     poi resta fisso;
+#   - oltre COMPACT_RATIO di tombstone (o, per IVF, di righe aggiunte
+#     fuori ordine di lista) una compattazione riscrive i file a blocchi
+#     in una nuova generazione.
+#
+# CompressedVectorStore avvolge il vectorstore (Chroma, numpy o
+# sharded) con lo stesso sottoinsieme di Chroma usato nel progetto
+# (get/delete/upsert/count/_collection): get(include=["embeddings"])
+# restituisce i vettori completi, quindi validazione e snapshot non
+# cambiano. Cambiare spec richiede una nuova versione (rebuild_index).
+# ================================================================
+
+import json
+import os
+import threading
+import uuid
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from ivfpq_index import IVFPQIndex, is_ivf_spec
+from vector_compression import CompressedIndex, chroma_space, pairwise_distance
+
+META_FILE = "vectors.json"
+FLUSH_ROWS = 4096           # righe tenute in RAM prima di essere aggiunte ai file
+BLOCK_ROWS = 2048           # vettori full-precision letti per blocco (rescoring, compattazione)
+COMPACT_RATIO = 0.25        # quota di tombstone / righe IVF fuori ordine oltre cui si compatta
+
+
+def make_index(spec: str, space: str, nprobe: int = 16):
+    """Modello non addestrato per la spec: IVF-PQ o indice piatto."""
+    if is_ivf_spec(spec):
+        return IVFPQIndex(spec, space, nprobe=nprobe)
+    return CompressedIndex(spec, space)
+
+
+class _RowFile:
+    """File binario di righe a larghezza fissa: scrittura in coda, lettura in mmap."""
+
+    def __init__(self, path: str, dtype, width: int):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.width = width
+        self._map: Optional[np.ndarray] = None
+
+    def rows(self, count: int) -> np.ndarray:
+        if count == 0:
+            return np.zeros((0, self.width), dtype=self.dtype)
+        if self._map is None or len(self._map) != count:
+            self._map = np.memmap(self.path, dtype=self.dtype, mode="r", shape=(count, self.width))
+        return self._map
+
+    def append(self, rows: np.ndarray) -> None:
+        with open(self.path, "ab") as f:
+            f.write(np.ascontiguousarray(rows, dtype=self.dtype).reshape(-1, self.width).tobytes())
+
+    def truncate(self, count: int) -> None:
+        """Scarta le righe scritte dopo l'ultimo vectors.json (sync interrotta)."""
+        size = count * self.dtype.itemsize * self.width
+        if not os.path.exists(self.path):
+            open(self.path, "wb").close()
+        elif os.path.getsize(self.path) > size:
+            self._map = None
+            os.truncate(self.path, size)
+
+
+class CompressedVectors:
+    """
+    Vettori full-precision e codici dell'indice compresso, riga per riga
+    nello stesso ordine, con ID e tombstone. Thread-safe.
+    """
+
+    def __init__(self, directory: str, spec: str, space: str = "l2", nprobe: int = 16):
+        self.directory = directory
+        self.spec = spec
+        self.space = space
+        self.nprobe = nprobe
+        self.dim = 0
+        self.count = 0                      # righe nei file (vive + tombstone)
+        self.trained_on = 0                 # righe del campione dell'ultimo addestramento
+        self.sorted_rows = 0                # righe già in ordine di lista (IVF)
+        self._rows_gen = self._codes_gen = 0
+        self._ids: List[str] = []
+        self._row_of: Dict[str, int] = {}
+        self._dead = np.zeros(0, dtype=bool)
+        self._pending: Dict[str, np.ndarray] = {}
+        self._full: Optional[_RowFile] = None
+        self._columns: Dict[str, _RowFile] = {}
+        self._dirty = False
+        self._lock = threading.RLock()
+        self.index = make_index(spec, space, nprobe)
+        if os.path.exists(os.path.join(directory, META_FILE)):
+            self._open()
+
+    @staticmethod
+    def stored_spec(directory: str) -> Optional[str]:
+        """Spec della versione su disco (None se la directory non ha vettori compressi)."""
+        try:
+            with open(os.path.join(directory, META_FILE), "r", encoding="utf-8") as f:
+                return json.load(f)["spec"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    # --- File ---
+
+    def _path(self, name: str, generation: int) -> str:
+        stem, ext = os.path.splitext(name)
+        return os.path.join(self.directory, f"{stem}.{generation}{ext}")
+
+    def _row_files(self, rows_gen: int, codes_gen: int) -> Tuple[_RowFile, Dict[str, _RowFile]]:
+        full = _RowFile(self._path("full.f32", rows_gen), np.float32, self.dim)
+        columns = {}
+        if self.index.trained:
+            columns = {name: _RowFile(self._path(name + ".bin", codes_gen), dtype, width)
+                       for name, (dtype, width) in self.index.columns(self.dim).items()}
+        return full, columns
+
+    def _open(self) -> None:
+        with open(os.path.join(self.directory, META_FILE), "r", encoding="utf-8") as f:
+            state = json.load(f)
+        self.spec, self.space = state["spec"], state["space"]
+        self.dim, self.count = state["dim"], state["count"]
+        self.trained_on, self.sorted_rows = state["trained_on"], state["sorted_rows"]
+        self._rows_gen, self._codes_gen = state["rows_gen"], state["codes_gen"]
+        self.index = make_index(self.spec, self.space, self.nprobe)
+        if self.trained_on:
+            self.index.load_model(np.load(self._path("model.npz", self._codes_gen)))
+        if not self.dim:
+            return          # salvato vuoto: i file nascono con la prima riga
+        self._full, self._columns = self._row_files(self._rows_gen, self._codes_gen)
+        for row_file in [self._full, *self._columns.values()]:
+            row_file.truncate(self.count)
+
+        ids_path = self._path("ids.txt", self._rows_gen)
+        with open(ids_path, "a+", encoding="utf-8") as f:
+            f.seek(0)
+            self._ids = f.read().split("\n")[:self.count]
+        if os.path.getsize(ids_path) > sum(len(i.encode("utf-8")) + 1 for i in self._ids):
+            with open(ids_path, "w", encoding="utf-8") as f:
+                f.write("".join(i + "\n" for i in self._ids))
+        self._dead = np.zeros(self.count, dtype=bool)
+        dead_path = self._path("dead.npy", self._rows_gen)
+        if os.path.exists(dead_path):
+            self._dead[np.load(dead_path)] = True
+        self._row_of = {doc_id: row for row, doc_id in enumerate(self._ids) if not self._dead[row]}
+
+    def _write_state(self) -> None:
+        """Tombstone e vectors.json (per ultimo, con os.replace)."""
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = os.path.join(self.directory, "dead.tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, np.flatnonzero(self._dead))
+        os.replace(tmp, self._path("dead.npy", self._rows_gen))
+        tmp = os.path.join(self.directory, META_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"spec": self.spec, "space": self.space, "dim": self.dim, "count": self.count,
+                       "trained_on": self.trained_on, "sorted_rows": self.sorted_rows,
+                       "rows_gen": self._rows_gen, "codes_gen": self._codes_gen}, f)
+        os.replace(tmp, os.path.join(self.directory, META_FILE))
+
+    def _remove_generation(self, rows_gen: Optional[int], codes_gen: Optional[int]) -> None:
+        names = []
+        if rows_gen is not None:
+            names += [self._path(n, rows_gen) for n in ("full.f32", "ids.txt", "dead.npy")]
+        if codes_gen is not None:
+            names.append(self._path("model.npz", codes_gen))
+            names += [self._path(n + ".bin", codes_gen) for n in self.index.columns(self.dim)]
+        for path in names:
+            try:
+                os.remove(path)
+            except OSError:
+                pass    # es. Windows con la mappa ancora aperta: verrà sovrascritto
+
+    # --- Scritture ---
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._row_of) + len(self._pending)
+
+    def __contains__(self, doc_id: str) -> bool:
+        with self._lock:
+            return doc_id in self._pending or doc_id in self._row_of
+
+    def _drop(self, doc_id: str) -> None:
+        self._pending.pop(doc_id, None)
+        row = self._row_of.pop(doc_id, None)
+        if row is not None:
+            self._dead[row] = True
+
+    def add(self, ids: Sequence[str], vectors) -> None:
+        """Aggiunge (o sostituisce) vettori: la riga vecchia di un ID diventa una tombstone."""
+        x = np.asarray(vectors, dtype=np.float32)
+        if x.ndim == 1:
+            x = x[None, :]
+        with self._lock:
+            if not self.dim:
+                self.dim = x.shape[1]
+            elif x.shape[1] != self.dim:
+                raise ValueError(f"Vettori di dimensione {x.shape[1]}, l'indice compresso "
+                                 f"in '{self.directory}' ha dimensione {self.dim}")
+            for doc_id, vector in zip(ids, x):
+                self._drop(doc_id)
+                self._pending[doc_id] = vector
+            self._dirty = True
+            if len(self._pending) >= FLUSH_ROWS:
+                self._flush()
+
+    def remove(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            for doc_id in ids:
+                self._drop(doc_id)
+            self._dirty = True
+
+    def _flush(self) -> None:
+        """Righe in RAM in coda ai file, codificate se il modello è già addestrato."""
+        if not self._pending:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        if self._full is None:
+            self._full, self._columns = self._row_files(self._rows_gen, self._codes_gen)
+        ids = list(self._pending)
+        x = np.stack(list(self._pending.values()))
+        self._full.append(x)
+        with open(self._path("ids.txt", self._rows_gen), "a", encoding="utf-8") as f:
+            f.write("".join(i + "\n" for i in ids))
+        if self.index.trained:
+            for name, values in self.index.encode(x).items():
+                self._columns[name].append(values)
+        for offset, doc_id in enumerate(ids):
+            self._row_of[doc_id] = self.count + offset
+        self._ids.extend(ids)
+        self._dead = np.concatenate([self._dead, np.zeros(len(ids), dtype=bool)])
+        self.count += len(ids)
+        self._pending = {}
+        if not self.index.trained and self.count >= self.index.train_rows:
+            self._train()
+        self._write_state()
+
+    def _gather(self, rows: np.ndarray) -> np.ndarray:
+        return np.asarray(self._full.rows(self.count)[rows], dtype=np.float32)
+
+    def _train(self) -> None:
+        """
+        Addestra il modello su un campione di righe vive letto dalla mmap
+        (righe in ordine crescente: letture sequenziali) e ricodifica tutto.
+        """
+        alive = np.flatnonzero(~self._dead)
+        rng = np.random.default_rng(0)
+        picked = np.sort(rng.choice(alive, min(len(alive), self.index.train_rows), replace=False))
+        sample = np.vstack([self._gather(picked[s:s + BLOCK_ROWS])
+                            for s in range(0, len(picked), BLOCK_ROWS)])
+        self.index = make_index(self.spec, self.space, self.nprobe)
+        self.index.train(sample, len(alive))
+        self.trained_on = len(picked)
+        self._rewrite(reencode=True)
+
+    def _rewrite(self, reencode: bool) -> None:
+        """
+        Nuova generazione dei file con le sole righe vive (per IVF in
+        ordine di lista: ogni lista diventa contigua), a blocchi di
+        BLOCK_ROWS vettori. reencode=True ricalcola i codici con il modello
+        appena addestrato, altrimenti vengono copiati.
+        """
+        alive = np.flatnonzero(~self._dead)
+        if reencode:
+            widths = self.index.columns(self.dim)
+            encoded = {name: np.empty((len(alive), width), dtype=dtype)
+                       for name, (dtype, width) in widths.items()}
+            for s in range(0, len(alive), BLOCK_ROWS):
+                block = self._gather(alive[s:s + BLOCK_ROWS])
+                for name, values in self.index.encode(block).items():
+                    encoded[name][s:s + len(block)] = values.reshape(len(block), -1)
+
+            def codes_of(positions: np.ndarray) -> Dict[str, np.ndarray]:
+                return {name: values[positions] for name, values in encoded.items()}
+        else:
+            current = {name: f.rows(self.count) for name, f in self._columns.items()}
+
+            def codes_of(positions: np.ndarray) -> Dict[str, np.ndarray]:
+                return {name: np.asarray(values[alive[positions]]) for name, values in current.items()}
+
+        order = np.arange(len(alive))
+        if self.index.order_key and len(alive):
+            order = np.argsort(codes_of(order)[self.index.order_key].reshape(-1), kind="stable")
+
+        old_rows, old_codes = self._rows_gen, self._codes_gen
+        self._rows_gen, self._codes_gen = old_rows + 1, old_codes + 1
+        full, columns = self._row_files(self._rows_gen, self._codes_gen)
+        for row_file in [full, *columns.values()]:
+            open(row_file.path, "wb").close()
+        with open(self._path("ids.txt", self._rows_gen), "w", encoding="utf-8") as ids_file:
+            for s in range(0, len(order), BLOCK_ROWS):
+                positions = order[s:s + BLOCK_ROWS]
+                rows = alive[positions]
+                full.append(self._gather(rows))
+                ids_file.write("".join(self._ids[r] + "\n" for r in rows))
+                for name, values in codes_of(positions).items():
+                    columns[name].append(values)
+        np.savez(self._path("model.npz", self._codes_gen), **self.index.model_arrays())
+
+        self._ids = [self._ids[r] for r in alive[order]]
+        self._row_of = {doc_id: row for row, doc_id in enumerate(self._ids)}
+        self._dead = np.zeros(len(self._ids), dtype=bool)
+        self.count = self.sorted_rows = len(self._ids)
+        had_codes = bool(self._columns)
+        self._full, self._columns = full, columns
+        self._write_state()
+        self._remove_generation(old_rows, old_codes if had_codes else None)
+
+    def _needs_training(self) -> bool:
+        alive = len(self._row_of)
+        if not self.index.trained:
+            return alive > 0
+        return self.trained_on < self.index.train_rows and alive >= 2 * self.trained_on
+
+    def save(self) -> None:
+        """
+        Scrive le righe in RAM; addestra il modello se serve, compatta se
+        le tombstone (o le righe IVF fuori ordine) superano COMPACT_RATIO.
+        """
+        with self._lock:
+            if not self._dirty and os.path.exists(os.path.join(self.directory, META_FILE)):
+                return
+            self._flush()
+            unsorted = self.count - self.sorted_rows if self.index.order_key else 0
+            if self._needs_training():
+                self._train()
+            elif self.count and max(int(self._dead.sum()), unsorted) > COMPACT_RATIO * self.count:
+                self._rewrite(reencode=False)
+            self._write_state()
+            self._dirty = False
+
+    # --- Lettura e ricerca ---
+
+    def vectors(self, ids: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Vettori full-precision degli ID (None per gli ID assenti)."""
+        with self._lock:
+            out: List[Optional[np.ndarray]] = []
+            for doc_id in ids:
+                if doc_id in self._pending:
+                    out.append(self._pending[doc_id])
+                elif doc_id in self._row_of:
+                    out.append(self._gather(self._row_of[doc_id]))
+                else:
+                    out.append(None)
+            return out
+
+    def _exact(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Distanze esatte dalle righe (ordinate: letture in avanti sulla mmap), a blocchi."""
+        return np.concatenate([pairwise_distance(query, self._gather(rows[s:s + BLOCK_ROWS]), self.space)
+                               for s in range(0, len(rows), BLOCK_ROWS)] or [np.zeros(0, np.float32)])
+
+    def search(self, query_vector, k: int, rescore: int,
+               allowed: Optional[Iterable[str]] = None) -> List[Tuple[str, float]]:
+        """
+        Top-k con rescoring esatto: 'rescore' candidati dai codici (solo
+        tra gli ID in allowed, se indicato), distanze ricalcolate sui
+        vettori full-precision. Le righe non ancora codificate (in RAM o
+        prima dell'addestramento) vengono confrontate direttamente.
+        """
+        query = np.asarray(query_vector, dtype=np.float32)
+        with self._lock:
+            if allowed is None:
+                alive = ~self._dead
+                pending = list(self._pending)
+            else:
+                allowed = set(allowed)
+                alive = np.zeros(self.count, dtype=bool)
+                alive[[self._row_of[i] for i in allowed if i in self._row_of]] = True
+                pending = [i for i in self._pending if i in allowed]
+
+            n = max(k, rescore)
+            if not self.index.trained or int(alive.sum()) <= n:
+                rows = np.flatnonzero(alive)
+            else:
+                columns = {name: f.rows(self.count) for name, f in self._columns.items()}
+                rows = self.index.candidates(query, n, columns, alive)
+                if allowed is not None and len(rows) < k:
+                    # Sottoinsieme sparso: le nprobe liste non bastano, si visitano tutte
+                    rows = self.index.candidates(query, n, columns, alive, exhaustive=True)
+            rows = np.sort(rows)
+            ids = [self._ids[r] for r in rows] + pending
+            dist = self._exact(query, rows)
+            if pending:
+                dist = np.concatenate([dist, pairwise_distance(
+                    query, np.stack([self._pending[i] for i in pending]), self.space)])
+            order = np.argsort(dist)[:k]
+            return [(ids[i], float(dist[i])) for i in order]
+
+    # --- Dimensione ---
+
+    @property
+    def codes_nbytes(self) -> int:
+        """Codici su disco (letti in mmap dalla scansione) + modello in RAM."""
+        size = self.index.nbytes
+        if self.index.trained:
+            size += sum(np.dtype(dtype).itemsize * width * self.count
+                        for dtype, width in self.index.columns(self.dim).values())
+        return size
+
+    @property
+    def full_nbytes(self) -> int:
+        return self.count * self.dim * 4
+
+    def __str__(self) -> str:
+        codes, full = self.codes_nbytes / 2**20, self.full_nbytes / 2**20
+        return (f"{self.spec}: {len(self)} vettori, codici {codes:.1f} MB + full-precision "
+                f"{full:.1f} MB (mmap, solo rescoring) = {codes + full:.1f} MB")
+
+
+def _placeholder(doc_id: str) -> List[float]:
+    # Una dimensione, diversa per ID: l'HNSW della collection resta minuscolo
+    # (niente punti tutti coincidenti) e non viene mai interrogato
+    return [zlib.crc32(doc_id.encode("utf-8")) / 2**32]
+
+
+class CompressedVectorStore(VectorStore):
+    """
+    Vectorstore (Chroma, NumpyVectorStore o ShardedVectorStore) per testi
+    e metadati, con i vettori in CompressedVectors. La ricerca passa dai
+    codici compressi e dal rescoring; i filtri sui metadati li risolve
+    il vectorstore (solo ID, include=[]).
+    """
+
+    def __init__(self, store: VectorStore, vectors: CompressedVectors, rescore: int = 50):
+        self.store = store
+        self.vectors = vectors
+        self.rescore = rescore
+
+    # --- Interfaccia stile Chroma ---
+
+    @property
+    def _collection(self) -> "CompressedVectorStore":
+        return self
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        """Metrica (chroma_space): quella della collection, usata anche dai vettori compressi."""
+        return self.store._collection.metadata or {}
+
+    @property
+    def configuration(self) -> Dict[str, Any]:
+        return getattr(self.store._collection, "configuration", None) or {}
+
+    def count(self) -> int:
+        return self.store._collection.count()
+
+    def upsert(self, ids: Sequence[str], embeddings: Sequence[Sequence[float]],
+               metadatas: Optional[Sequence[Optional[Dict[str, Any]]]] = None,
+               documents: Optional[Sequence[str]] = None) -> None:
+        self.vectors.add(ids, embeddings)
+        self.store._collection.upsert(ids=list(ids), embeddings=[_placeholder(i) for i in ids],
+                                      metadatas=metadatas, documents=documents)
+
+    def get(self, ids: Optional[Sequence[str]] = None, where: Optional[Dict[str, Any]] = None,
+            limit: Optional[int] = None, offset: Optional[int] = None,
+            include: Sequence[str] = ("documents", "metadatas"), **kwargs) -> Dict[str, Any]:
+        """
+        Come Chroma; "embeddings" sono i vettori full-precision. Con ids
+        esiste solo un chunk presente anche tra i vettori (una sync
+        interrotta prima di save() lo reinserisce).
+        """
+        include = list(include)
+        got = self.store.get(ids=list(ids) if ids is not None else None, where=where, limit=limit,
+                             offset=offset, include=[f for f in include if f != "embeddings"])
+        fields = [f for f in ("documents", "metadatas") if f in include]
+        result: Dict[str, Any] = {"ids": list(got["ids"]), "documents": None, "metadatas": None,
+                                  "embeddings": None}
+        for f in fields:
+            result[f] = list(got[f])
+        if ids is not None:
+            keep = [p for p, doc_id in enumerate(result["ids"]) if doc_id in self.vectors]
+            for f in ["ids", *fields]:
+                result[f] = [result[f][p] for p in keep]
+        if "embeddings" in include:
+            result["embeddings"] = self.vectors.vectors(result["ids"])
+        return result
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> None:
+        ids = list(ids or [])
+        if ids:
+            self.store.delete(ids=ids)
+            self.vectors.remove(ids)
+
+    def persist(self) -> None:
+        if hasattr(self.store, "persist"):
+            self.store.persist()
+        self.vectors.save()
+
+    def rebuild_shard(self, shard: int, ids: Sequence[str], embeddings: Sequence[Sequence[float]],
+                      metadatas: Sequence[Dict[str, Any]], documents: Sequence[str]) -> int:
+        """ShardedVectorStore.rebuild_shard con i vettori nel file compresso."""
+        from sharded_store import shard_of
+        n_shards = len(self.store.shards)
+        old = self.store.shards[shard]._collection.get(include=[])["ids"]
+        self.vectors.remove(old)
+        mine = [p for p, doc_id in enumerate(ids) if shard_of(doc_id, n_shards) == shard]
+        self.vectors.add([ids[p] for p in mine], [embeddings[p] for p in mine])
+        added = self.store.rebuild_shard(shard, ids, [_placeholder(i) for i in ids], metadatas, documents)
+        self.vectors.save()
+        return added
+
+    # --- Interfaccia VectorStore ---
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self.store.embeddings
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        if ids is None or any(i is None for i in ids):
+            ids = [i or uuid.uuid4().hex for i in (ids or [None] * len(texts))]
+        self.upsert(ids, self.embeddings.embed_documents(texts),
+                    metadatas or [{} for _ in texts], texts)
+        return list(ids)
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding: Sequence[float], k: int = 4,
+                                                          filter: Optional[Dict[str, Any]] = None,
+                                                          **kwargs: Any) -> List[Tuple[Document, float]]:
+        """Come Chroma: (documento, distanza), più bassa = più simile."""
+        allowed = self.store.get(where=filter, include=[])["ids"] if filter else None
+        hits = self.vectors.search(embedding, k, self.rescore, allowed)
+        if not hits:
+            return []
+        got = self.store.get(ids=[doc_id for doc_id, _ in hits], include=["documents", "metadatas"])
+        docs = {doc_id: Document(page_content=text or "", metadata=meta or {}, id=doc_id)
+                for doc_id, text, meta in zip(got["ids"], got["documents"], got["metadatas"])}
+        return [(docs[doc_id], dist) for doc_id, dist in hits if doc_id in docs]
+
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     filter: Optional[Dict[str, Any]] = None,
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_relevance_scores(
+            self.embeddings.embed_query(query), k, filter)
+
+    def similarity_search(self, query: str, k: int = 4,
+                          filter: Optional[Dict[str, Any]] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[Dict[str, Any]] = None,
+                                    **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_relevance_scores(embedding, k, filter)]
+
+    def _select_relevance_score_fn(self):
+        return self.store._select_relevance_score_fn()
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings,
+                   metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None,
+                   store: Optional[VectorStore] = None, directory: Optional[str] = None,
+                   spec: str = "pca256-int8", **kwargs: Any) -> "CompressedVectorStore":
+        """store = vectorstore per testi e metadati, directory = file dei vettori compressi."""
+        if store is None or directory is None:
+            raise ValueError("CompressedVectorStore.from_texts richiede store e directory")
+        compressed = cls(store, CompressedVectors(directory, spec, chroma_space(store)))
+        compressed.add_texts(texts, metadatas=metadatas, ids=ids)
+        compressed.persist()
+        return compressed
@@ -0,0 +1,158 @@
+# ================================================================
+# BACKEND DI EMBEDDING  –  selezione tramite stringa di modello
+# ================================================================
+#   "llama3" / "ollama:llama3"          -> Ollama via client batch
+#   "st:all-MiniLM-L6-v2"               -> sentence-transformers locale
+#   "sentence-transformers:<modello>"   -> idem
+#
+# Il backend locale gira in-process su CPU: nessuna chiamata HTTP,
+# encoding a batch e, oltre una certa quantità di testi, su più
+# processi. Tutti i backend passano dalla cache su disco condivisa
+# (e le domande, se indicata, dalla cache in memoria di query_cache.py).
+#
+# Benchmark sullo stesso corpus di rag.py (da lanciare in LanGraph/rag):
+#   python embedding_backends.py --backends llama3 st:all-MiniLM-L6-v2
+# ================================================================
+
+import argparse
+import atexit
+import threading
+import time
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from embedding_cache import CachedEmbeddings, DEFAULT_MAX_ENTRIES
+from query_cache import QueryEmbeddingCache
+from embedding_client import BatchedOllamaEmbeddings
+
+ST_PREFIXES = ("st:", "sentence-transformers:")
+
+# I modelli vengono caricati una sola volta per processo (anche tra i rerun di Streamlit)
+_ST_MODELS: Dict[str, object] = {}
+_ST_LOCK = threading.Lock()
+
+
+def _load_sentence_transformer(model_name: str, device: str):
+    try:
+        from sentence_transformers import SentenceTransformer
+    except ImportError as e:
+        raise ImportError(
+            "Il backend locale richiede sentence-transformers: pip install sentence-transformers"
+        ) from e
+    with _ST_LOCK:
+        key = f"{model_name}@{device}"
+        if key not in _ST_MODELS:
+            _ST_MODELS[key] = SentenceTransformer(model_name, device=device)
+        return _ST_MODELS[key]
+
+
+class SentenceTransformerEmbeddings(Embeddings):
+    """
+    Embeddings locali con sentence-transformers.
+    Sotto multi_process_threshold testi si usa encode() a batch nel processo
+    corrente; sopra, un pool di 'processes' processi (creato alla prima
+    occorrenza e riusato fino a close()).
+    """
+
+    def __init__(self, model_name: str = "all-MiniLM-L6-v2", device: str = "cpu",
+                 batch_size: int = 64, processes: int = 1,
+                 multi_process_threshold: int = 2000, normalize: bool = True):
+        self.model = model_name
+        self.device = device
+        self.batch_size = batch_size
+        self.processes = processes
+        self.multi_process_threshold = multi_process_threshold
+        self.normalize = normalize
+        self._st = _load_sentence_transformer(model_name, device)
+        self._pool = None
+
+    def _encode(self, texts: List[str]) -> List[List[float]]:
+        if self.processes > 1 and len(texts) >= self.multi_process_threshold:
+            if self._pool is None:
+                self._pool = self._st.start_multi_process_pool(
+                    target_devices=[self.device] * self.processes)
+                atexit.register(self.close)
+            vectors = self._st.encode_multi_process(
+                texts, self._pool, batch_size=self.batch_size,
+                normalize_embeddings=self.normalize,
+            )
+        else:
+            vectors = self._st.encode(
+                texts, batch_size=self.batch_size, show_progress_bar=False,
+                convert_to_numpy=True, normalize_embeddings=self.normalize,
+            )
+        return vectors.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._encode(list(texts)) if texts else []
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode([text])[0]
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._st.stop_multi_process_pool(self._pool)
+            self._pool = None
+
+
+def create_backend(spec: str, base_url: str = "http://localhost:11434",
+                   max_in_flight: int = 4, processes: int = 1) -> Embeddings:
+    """
+    Crea il backend (senza cache) a partire dalla stringa di modello.
+    """
+    for prefix in ST_PREFIXES:
+        if spec.startswith(prefix):
+            return SentenceTransformerEmbeddings(spec[len(prefix):], processes=processes)
+    model = spec[len("ollama:"):] if spec.startswith("ollama:") else spec
+    return BatchedOllamaEmbeddings(model=model, base_url=base_url, max_in_flight=max_in_flight)
+
+
+def build_embeddings(spec: str, base_url: str = "http://localhost:11434",
+                     max_in_flight: int = 4, processes: int = 1,
+                     max_entries: int = DEFAULT_MAX_ENTRIES,
+                     cache_path: Optional[str] = None,
+                     query_cache: Optional[QueryEmbeddingCache] = None) -> CachedEmbeddings:
+    """
+    Backend scelto da 'spec' avvolto dalla cache persistente condivisa
+    (la chiave di cache include la spec, quindi i modelli non si mescolano).
+    query_cache (es. shared_query_cache()) evita di ri-embeddare le domande.
+    """
+    backend = create_backend(spec, base_url, max_in_flight, processes)
+    kwargs = {"path": cache_path} if cache_path else {}
+    return CachedEmbeddings(backend, model_name=spec, max_entries=max_entries,
+                            query_cache=query_cache, **kwargs)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark dei backend di embedding sul corpus di rag.py")
+    parser.add_argument("--backends", nargs="+", default=["llama3", "st:all-MiniLM-L6-v2"])
+    parser.add_argument("--limit", type=int, default=0, help="Numero massimo di chunk (0 = tutti)")
+    parser.add_argument("--processes", type=int, default=1, help="Processi per sentence-transformers")
+    args = parser.parse_args()
+
+    import rag   # stesso loader e stesso chunking dell'aggregatore
+
+    chunks = rag.chunk_documents(rag.load_all_documents())
+    texts = [c.page_content for c in chunks]
+    if args.limit:
+        texts = texts[:args.limit]
+    if not texts:
+        raise SystemExit("[ERRORE] Nessun chunk: inserisci dei file in ./data")
+
+    print(f"\n[BENCH] {len(texts)} chunk, backend senza cache")
+    for spec in args.backends:
+        try:
+            backend = create_backend(spec, processes=args.processes)
+            backend.embed_query("riscaldamento")          # caricamento modello / connessione
+            start = time.perf_counter()
+            vectors = backend.embed_documents(texts)
+            elapsed = time.perf_counter() - start
+        except Exception as e:
+            print(f"  {spec:<28} [ERRORE] {type(e).__name__}: {e}")
+            continue
+        dim = len(vectors[0])
+        print(f"  {spec:<28} {len(texts) / elapsed:9.1f} chunk/s  {elapsed:7.2f}s  "
+              f"dim={dim:<5} {dim * 4 / 1024:6.1f} KB/vettore")
+        if hasattr(backend, "close"):
+            backend.close()
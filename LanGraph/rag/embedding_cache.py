@@ -0,0 +1,176 @@
+# ================================================================
+# CACHE DEGLI EMBEDDING  –  persistente, content-addressed
+# ================================================================
+# Avvolge qualsiasi Embeddings di LangChain (OllamaEmbeddings, ...)
+# e memorizza su SQLite i vettori indicizzati per (modello, hash testo).
+#
+#   embed_documents(testi)
+#     ├── lookup in batch dei digest già presenti   -> hit
+#     ├── embedding in blocco dei soli testi mancanti -> miss
+#     └── insert + eviction LRU oltre max_entries
+#
+# Il file di default sta accanto a questo modulo, così rag.py e i
+# rag_graph delle app Streamlit condividono la stessa cache.
+# Le domande (embed_query) passano invece dalla cache in memoria
+# di query_cache.py, se indicata.
+# ================================================================
+
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from query_cache import QueryEmbeddingCache
+
+DEFAULT_CACHE_PATH = str(Path(__file__).resolve().parent / "embedding_cache.sqlite3")
+DEFAULT_MAX_ENTRIES = 500_000
+_SQL_BATCH = 500          # parametri per singola query IN (...)
+
+
+def text_digest(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _pack(vector: List[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _unpack(blob: bytes) -> List[float]:
+    values = array("f")
+    values.frombytes(blob)
+    return values.tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings con cache su disco condivisa tra processi (SQLite in WAL).
+    embed_query non passa dal DB: le domande usano query_cache (LRU in
+    memoria con TTL), oppure nessuna cache se non indicata.
+    """
+
+    def __init__(self, base: Embeddings, path: str = DEFAULT_CACHE_PATH,
+                 model_name: Optional[str] = None,
+                 max_entries: int = DEFAULT_MAX_ENTRIES,
+                 query_cache: Optional[QueryEmbeddingCache] = None):
+        self.base = base
+        self.query_cache = query_cache
+        self.path = path
+        self.model_name = model_name or getattr(base, "model", None) or type(base).__name__
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, digest TEXT NOT NULL, vector BLOB NOT NULL,"
+            " last_access REAL NOT NULL, PRIMARY KEY (model, digest))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_lru ON embeddings (last_access)"
+        )
+        self._conn.commit()
+
+    # --- Accesso al DB (sempre sotto lock: i thread della pipeline la condividono) ---
+
+    def _lookup(self, digests: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        now = time.time()
+        with self._lock:
+            for start in range(0, len(digests), _SQL_BATCH):
+                batch = digests[start:start + _SQL_BATCH]
+                marks = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT digest, vector FROM embeddings WHERE model = ? AND digest IN ({marks})",
+                    [self.model_name, *batch],
+                ).fetchall()
+                for digest, blob in rows:
+                    found[digest] = _unpack(blob)
+                if rows:
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_access = ? WHERE model = ? "
+                        f"AND digest IN ({','.join('?' * len(rows))})",
+                        [now, self.model_name, *(d for d, _ in rows)],
+                    )
+            self._conn.commit()
+        return found
+
+    def _store(self, vectors: Dict[str, List[float]]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, digest, vector, last_access) "
+                "VALUES (?, ?, ?, ?)",
+                [(self.model_name, d, _pack(v), now) for d, v in vectors.items()],
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """
+        Eviction LRU: oltre max_entries scende al 90% del limite,
+        così non si paga una DELETE a ogni inserimento.
+        """
+        count = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        if count <= self.max_entries:
+            return
+        excess = count - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE rowid IN "
+            "(SELECT rowid FROM embeddings ORDER BY last_access LIMIT ?)",
+            (excess,),
+        )
+
+    # --- Interfaccia Embeddings ---
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        digests = [text_digest(t) for t in texts]
+        cached = self._lookup(list(set(digests)))
+
+        # Testi mancanti, deduplicati: ogni testo viene embeddato una sola volta
+        missing: Dict[str, str] = {}
+        for digest, text in zip(digests, texts):
+            if digest not in cached and digest not in missing:
+                missing[digest] = text
+
+        if missing:
+            fresh = self.base.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), fresh))
+            self._store(computed)
+            cached.update(computed)
+
+        with self._lock:
+            self.misses += len(missing)
+            self.hits += len(texts) - len(missing)
+        return [cached[d] for d in digests]
+
+    def embed_query(self, text: str) -> List[float]:
+        if self.query_cache is None:
+            return self.base.embed_query(text)
+        return self.query_cache.get_or_embed(self.model_name, text, self.base.embed_query)
+
+    # --- Metriche ---
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        with self._lock:
+            entries = self._conn.execute(
+                "SELECT COUNT(*) FROM embeddings WHERE model = ?", (self.model_name,)
+            ).fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": entries,
+        }
+
+    def __str__(self) -> str:
+        s = self.stats()
+        return (f"hit={s['hits']}  miss={s['misses']}  hit_rate={s['hit_rate']:.1%}  "
+                f"voci={s['entries']}")
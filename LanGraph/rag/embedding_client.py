@@ -0,0 +1,329 @@
+# ================================================================
+# CLIENT DI EMBEDDING BATCH  –  concorrente, batch adattivi
+# ================================================================
+# Alternativa a OllamaEmbeddings per l'ingestion:
+#   - pool di connessioni HTTP keep-alive verso /api/embed
+#   - max_in_flight richieste contemporanee
+#   - batch size adattiva (AIMD): cresce finché la latenza resta
+#     sotto target_latency, si riduce se sale o se arrivano errori
+#   - retry con backoff esponenziale + jitter
+#
+# Include un server stub locale per misurare i chunk/secondo:
+#   python embedding_client.py --chunks 5000 --in-flight 1 4 8
+# ================================================================
+
+import argparse
+import hashlib
+import http.client
+import json
+import math
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from langchain_core.embeddings import Embeddings
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class EmbeddingRequestError(RuntimeError):
+    """Errore di una richiesta di embedding (dopo aver esaurito i retry)."""
+
+
+class _ConnectionPool:
+    """
+    Pool di connessioni HTTP keep-alive: ogni richiesta ne prende una
+    e la restituisce; una connessione che ha dato errore viene scartata.
+    """
+
+    def __init__(self, base_url: str, size: int, timeout: float):
+        parsed = urlparse(base_url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or (443 if parsed.scheme == "https" else 80)
+        self.conn_cls = http.client.HTTPSConnection if parsed.scheme == "https" else http.client.HTTPConnection
+        self.timeout = timeout
+        self._idle: "queue.LifoQueue[http.client.HTTPConnection]" = queue.LifoQueue(maxsize=size)
+
+    def acquire(self) -> http.client.HTTPConnection:
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            return self.conn_cls(self.host, self.port, timeout=self.timeout)
+
+    def release(self, conn: http.client.HTTPConnection, healthy: bool = True) -> None:
+        if not healthy:
+            conn.close()
+            return
+        try:
+            self._idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class AdaptiveBatchSize:
+    """
+    Controllo AIMD della dimensione dei batch:
+      latenza < target  -> +step (crescita additiva)
+      latenza > target  -> x0.75
+      errore            -> dimezzamento
+    """
+
+    def __init__(self, initial: int = 32, minimum: int = 1, maximum: int = 512,
+                 target_latency: float = 2.0, step: int = 8):
+        self.value = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.step = step
+        self._lock = threading.Lock()
+
+    def observe(self, batch: int, latency: float) -> None:
+        with self._lock:
+            if latency > self.target_latency:
+                self.value = max(self.minimum, int(self.value * 0.75))
+            elif batch >= self.value:
+                # Si cresce solo se il batch era "pieno": misura rappresentativa
+                self.value = min(self.maximum, self.value + self.step)
+
+    def on_error(self) -> None:
+        with self._lock:
+            self.value = max(self.minimum, self.value // 2)
+
+
+class BatchedOllamaEmbeddings(Embeddings):
+    """
+    Embeddings via API /api/embed di Ollama, con batch concorrenti e adattivi.
+    Compatibile con Chroma / CachedEmbeddings come OllamaEmbeddings.
+    """
+
+    def __init__(self, model: str = "llama3", base_url: str = "http://localhost:11434",
+                 max_in_flight: int = 4, initial_batch: int = 32, max_batch: int = 512,
+                 target_latency: float = 2.0, max_retries: int = 5,
+                 backoff: float = 0.5, timeout: float = 120.0):
+        self.model = model
+        self.base_url = base_url
+        self.max_in_flight = max(1, max_in_flight)
+        self.batch_size = AdaptiveBatchSize(initial_batch, 1, max_batch, target_latency)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._pool = _ConnectionPool(base_url, self.max_in_flight, timeout)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight,
+                                            thread_name_prefix="embed")
+        self._stats_lock = threading.Lock()
+        self.stats: Dict[str, float] = {
+            "requests": 0, "retries": 0, "errors": 0, "texts": 0, "seconds": 0.0,
+        }
+
+    # --- HTTP ---
+
+    def _post_embed(self, texts: List[str]) -> List[List[float]]:
+        body = json.dumps({"model": self.model, "input": texts})
+        conn = self._pool.acquire()
+        try:
+            conn.request("POST", "/api/embed", body=body,
+                         headers={"Content-Type": "application/json"})
+            response = conn.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException):
+            self._pool.release(conn, healthy=False)
+            raise
+        self._pool.release(conn, healthy=not response.will_close)
+
+        if response.status in RETRYABLE_STATUS:
+            raise ConnectionError(f"HTTP {response.status} (ritentabile)")
+        if response.status != 200:
+            raise EmbeddingRequestError(
+                f"HTTP {response.status}: {payload[:200].decode('utf-8', 'replace')}")
+        vectors = json.loads(payload)["embeddings"]
+        if len(vectors) != len(texts):
+            raise EmbeddingRequestError(f"Attesi {len(texts)} vettori, ricevuti {len(vectors)}")
+        return vectors
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """
+        Una richiesta con retry: backoff esponenziale con jitter sugli
+        errori di rete e sugli status ritentabili (429/5xx).
+        """
+        for attempt in range(self.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                vectors = self._post_embed(texts)
+            except (OSError, http.client.HTTPException) as e:
+                self.batch_size.on_error()
+                with self._stats_lock:
+                    self.stats["errors"] += 1
+                if attempt == self.max_retries:
+                    raise EmbeddingRequestError(
+                        f"Embedding fallito dopo {attempt + 1} tentativi: {e}") from e
+                with self._stats_lock:
+                    self.stats["retries"] += 1
+                time.sleep(self.backoff * (2 ** attempt) * (0.5 + random.random()))
+                continue
+
+            latency = time.perf_counter() - start
+            self.batch_size.observe(len(texts), latency)
+            with self._stats_lock:
+                self.stats["requests"] += 1
+                self.stats["texts"] += len(texts)
+                self.stats["seconds"] += latency
+            return vectors
+        raise EmbeddingRequestError("Numero di tentativi esaurito")
+
+    # --- Interfaccia Embeddings ---
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Suddivide i testi in batch della dimensione corrente (che si adatta
+        man mano che arrivano le risposte) e tiene al più max_in_flight
+        richieste in volo. L'ordine dei vettori è quello dei testi.
+        """
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        in_flight: Dict = {}
+        offset = 0
+
+        while offset < len(texts) or in_flight:
+            while offset < len(texts) and len(in_flight) < self.max_in_flight:
+                size = self.batch_size.value
+                batch = texts[offset:offset + size]
+                in_flight[self._executor.submit(self._embed_batch, batch)] = offset
+                offset += len(batch)
+
+            done, _ = wait(list(in_flight), return_when=FIRST_COMPLETED)
+            for future in done:
+                start = in_flight.pop(future)
+                vectors = future.result()
+                results[start:start + len(vectors)] = vectors
+
+        return results  # type: ignore[return-value]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_batch([text])[0]
+
+    def throughput(self) -> float:
+        """Testi embeddati al secondo di latenza cumulata (per richiesta)."""
+        return self.stats["texts"] / self.stats["seconds"] if self.stats["seconds"] else 0.0
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+        self._pool.close()
+
+
+# ================================================================
+# SERVER STUB PER BENCHMARK
+# ================================================================
+
+class StubEmbeddingServer:
+    """
+    Finto server Ollama (/api/embed) su localhost con porta libera.
+    Latenza = base_latency + per_item_latency * len(input); con
+    fail_rate risponde 503 a una frazione delle richieste.
+    """
+
+    def __init__(self, dim: int = 4096, base_latency: float = 0.02,
+                 per_item_latency: float = 0.001, fail_rate: float = 0.0):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length))
+                inputs = request.get("input", [])
+                if isinstance(inputs, str):
+                    inputs = [inputs]
+                time.sleep(stub.base_latency + stub.per_item_latency * len(inputs))
+                if random.random() < stub.fail_rate:
+                    self._reply(503, {"error": "busy"})
+                    return
+                self._reply(200, {"model": request.get("model"),
+                                  "embeddings": [stub.vector(t) for t in inputs]})
+
+            def _reply(self, status: int, data: dict) -> None:
+                body = json.dumps(data).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.dim = dim
+        self.base_latency = base_latency
+        self.per_item_latency = per_item_latency
+        self.fail_rate = fail_rate
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    def vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        rng = random.Random(seed)
+        values = [rng.uniform(-1.0, 1.0) for _ in range(self.dim)]
+        norm = math.sqrt(sum(v * v for v in values)) or 1.0
+        return [v / norm for v in values]
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self) -> "StubEmbeddingServer":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def benchmark(url: str, model: str, n_chunks: int,
+              in_flight: int, initial_batch: int) -> Tuple[float, BatchedOllamaEmbeddings]:
+    """Restituisce i chunk/secondo (wall clock) per una configurazione."""
+    texts = [f"chunk di prova numero {i} " * 20 for i in range(n_chunks)]
+    client = BatchedOllamaEmbeddings(model=model, base_url=url, max_in_flight=in_flight,
+                                     initial_batch=initial_batch, backoff=0.05)
+    start = time.perf_counter()
+    client.embed_documents(texts)
+    elapsed = time.perf_counter() - start
+    client.close()
+    return n_chunks / elapsed, client
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark del client di embedding batch")
+    parser.add_argument("--url", help="Server Ollama reale (default: stub locale)")
+    parser.add_argument("--model", default="llama3")
+    parser.add_argument("--chunks", type=int, default=2000)
+    parser.add_argument("--dim", type=int, default=256, help="Dimensione vettori dello stub")
+    parser.add_argument("--in-flight", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--initial-batch", type=int, default=16)
+    parser.add_argument("--fail-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    def run(url: str) -> None:
+        print(f"[BENCH] {args.chunks} chunk verso {url}")
+        for n in args.in_flight:
+            rate, client = benchmark(url, args.model, args.chunks, n, args.initial_batch)
+            print(f"  in_flight={n:<3} {rate:9.1f} chunk/s  batch finale={client.batch_size.value:<4} "
+                  f"richieste={client.stats['requests']:<5} retry={client.stats['retries']}")
+
+    if args.url:
+        run(args.url)
+    else:
+        with StubEmbeddingServer(dim=args.dim, fail_rate=args.fail_rate) as server:
+            run(server.url)
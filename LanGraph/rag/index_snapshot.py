@@ -0,0 +1,369 @@
+# ================================================================
+# SNAPSHOT DELL'INDICE  –  export/import binario per cold start
+# ================================================================
+# Un worker nuovo deve re-ingerire ./data (embedding di tutto) o
+# copiare chroma_db (SQLite + file HNSW) e pagarne l'apertura.
+# Lo snapshot è un unico file compatto, mappabile in memoria:
+#
+#   RAGSNAP\0  versione  offset/lunghezza dell'header
+#   vectors        matrice righe x dim (float32 o float16), allineata
+#   ids            ID UTF-8 concatenati       + ids_offsets (int64)
+#   texts          testi UTF-8 concatenati    + texts_offsets
+#   metas          metadati JSON concatenati  + metas_offsets
+#   header (JSON)  sezioni, dimensioni, metrica, metadati della
+#                  versione (modello di embedding), manifest e
+#                  tabella dei file sorgente
+#
+# Le righe sono raggruppate per file sorgente: ogni file è un
+# intervallo contiguo con il proprio CRC32 (vettori + ID + testi +
+# metadati). Il restore parziale legge e verifica solo le pagine dei
+# file richiesti; il restore completo verifica tutto.
+#
+# Uso (da LanGraph/rag, sulla versione attiva dell'indice):
+#   python index_snapshot.py export indice.snap
+#   python index_snapshot.py verify indice.snap
+#   python index_snapshot.py restore indice.snap [--sources a.pdf b.docx]
+#   python index_snapshot.py bench --chunks 50000 --dim 768
+# ================================================================
+
+import argparse
+import json
+import os
+import struct
+import time
+import zlib
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from vector_compression import chroma_space
+
+MAGIC = b"RAGSNAP\0"
+FORMAT_VERSION = 1
+ALIGN = 64                       # allineamento delle sezioni (righe dei vettori in cache line)
+_PREFIX = struct.Struct("<8sIIQQ")      # magic, versione, riservato, offset header, lunghezza header
+_DTYPES = {"f32": np.float32, "f16": np.float16}
+
+
+@dataclass
+class SnapshotInfo:
+    """Riepilogo di uno snapshot scritto o letto"""
+    path: str
+    count: int
+    dim: int
+    dtype: str
+    sources: int
+    nbytes: int
+    elapsed_s: float = 0.0
+
+    def __str__(self) -> str:
+        return (f"{self.count} chunk x {self.dim} dim ({self.dtype}), {self.sources} file, "
+                f"{self.nbytes / 2**20:.1f} MB in {self.elapsed_s:.2f}s")
+
+
+def _pack(items: Sequence[bytes]) -> Tuple[bytes, np.ndarray]:
+    offsets = np.zeros(len(items) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in items], out=offsets[1:])
+    return b"".join(items), offsets
+
+
+def _read_collection(collection, page_size: int) -> Tuple[List[str], List[str], List[Dict[str, Any]]]:
+    ids: List[str] = []
+    texts: List[str] = []
+    metas: List[Dict[str, Any]] = []
+    total = collection.count()
+    for offset in range(0, total, page_size):
+        page = collection.get(include=["documents", "metadatas"], limit=page_size, offset=offset)
+        ids.extend(page["ids"])
+        texts.extend(page["documents"])
+        metas.extend(m or {} for m in page["metadatas"])
+    return ids, texts, metas
+
+
+def _fetch_vectors(collection, ids: Sequence[str]) -> np.ndarray:
+    got = collection.get(ids=list(ids), include=["embeddings"])
+    by_id = dict(zip(got["ids"], got["embeddings"]))
+    return np.asarray([by_id[i] for i in ids], dtype=np.float32)
+
+
+def export_snapshot(vectorstore, path: str, meta: Optional[Dict[str, Any]] = None,
+                    manifest: Optional[Dict[str, Any]] = None, dtype: str = "f32",
+                    page_size: int = 5000, text_store=None) -> SnapshotInfo:
+    """
+    Scrive la collection in un file snapshot. Testi e metadati passano
+    in RAM; i vettori vengono letti e scritti un file sorgente alla
+    volta (a pagine). meta/manifest vengono riportati nell'header.
+    Con text_store (ChunkTextStore) i testi vuoti nella collection
+    vengono presi dallo store compresso.
+    """
+    if dtype not in _DTYPES:
+        raise ValueError(f"dtype deve essere uno tra {list(_DTYPES)}")
+    start = time.perf_counter()
+    collection = vectorstore._collection
+    ids, texts, metas = _read_collection(collection, page_size)
+    if text_store is not None:
+        texts = [t if t is not None else (d or "") for t, d in zip(text_store.get(ids), texts)]
+    order = sorted(range(len(ids)), key=lambda i: str(metas[i].get("source_file", "")))
+    ids = [ids[i] for i in order]
+    texts = [texts[i] for i in order]
+    metas = [metas[i] for i in order]
+
+    # Intervalli contigui per file sorgente
+    ranges: List[Tuple[str, int, int]] = []
+    for row, m in enumerate(metas):
+        name = str(m.get("source_file", ""))
+        if ranges and ranges[-1][0] == name:
+            ranges[-1] = (name, ranges[-1][1], row + 1)
+        else:
+            ranges.append((name, row, row + 1))
+
+    blobs = {}
+    for name, values in (("ids", [i.encode("utf-8") for i in ids]),
+                         ("texts", [t.encode("utf-8") for t in texts]),
+                         ("metas", [json.dumps(m, ensure_ascii=False).encode("utf-8") for m in metas])):
+        blobs[name], blobs[name + "_offsets"] = _pack(values)
+
+    sections: Dict[str, List[int]] = {}
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(b"\0" * _PREFIX.size)
+
+        def begin(name: str) -> None:
+            f.write(b"\0" * (-f.tell() % ALIGN))
+            sections[name] = [f.tell(), 0]
+
+        def end(name: str) -> None:
+            sections[name][1] = f.tell() - sections[name][0]
+
+        # Vettori: un file sorgente alla volta; il CRC parte dai suoi vettori
+        dim = 0
+        crcs: List[int] = []
+        begin("vectors")
+        for _, first, last in ranges:
+            crc = 0
+            for s in range(first, last, page_size):
+                block = _fetch_vectors(collection, ids[s:min(last, s + page_size)])
+                dim = dim or block.shape[1]
+                data = block.astype(_DTYPES[dtype]).tobytes()
+                crc = zlib.crc32(data, crc)
+                f.write(data)
+            crcs.append(crc)
+        end("vectors")
+
+        for name in ("ids", "texts", "metas"):
+            offsets = blobs[name + "_offsets"]
+            for i, (_, first, last) in enumerate(ranges):
+                crcs[i] = zlib.crc32(blobs[name][offsets[first]:offsets[last]], crcs[i])
+            for part in (name, name + "_offsets"):
+                begin(part)
+                f.write(blobs[part] if isinstance(blobs[part], bytes) else blobs[part].tobytes())
+                end(part)
+
+        header = json.dumps({
+            "count": len(ids), "dim": int(dim), "dtype": dtype,
+            "space": chroma_space(vectorstore), "created": time.time(),
+            "meta": meta or {}, "manifest": manifest,
+            "sections": sections,
+            "sources": [[name, first, last, crc] for (name, first, last), crc in zip(ranges, crcs)],
+        }, ensure_ascii=False).encode("utf-8")
+        header_offset = f.tell()
+        f.write(header)
+        f.seek(0)
+        f.write(_PREFIX.pack(MAGIC, FORMAT_VERSION, 0, header_offset, len(header)))
+    os.replace(tmp_path, path)
+    return SnapshotInfo(path, len(ids), int(dim), dtype, len(ranges), os.path.getsize(path),
+                        time.perf_counter() - start)
+
+
+class SnapshotReader:
+    """
+    Snapshot aperto in sola lettura con np.memmap: le sezioni sono
+    viste sul file, il sistema operativo carica solo le pagine lette.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            magic, version, _, header_offset, header_len = _PREFIX.unpack(f.read(_PREFIX.size))
+            if magic != MAGIC:
+                raise ValueError(f"'{path}' non è uno snapshot dell'indice")
+            if version != FORMAT_VERSION:
+                raise ValueError(f"Snapshot di formato {version}, supportato {FORMAT_VERSION}")
+            f.seek(header_offset)
+            header = json.loads(f.read(header_len))
+        self.count: int = header["count"]
+        self.dim: int = header["dim"]
+        self.dtype: str = header["dtype"]
+        self.space: str = header["space"]
+        self.meta: Dict[str, Any] = header["meta"]
+        self.manifest: Optional[Dict[str, Any]] = header["manifest"]
+        self.sources: Dict[str, Tuple[int, int, int]] = {
+            name: (first, last, crc) for name, first, last, crc in header["sources"]}
+        self._sections = header["sections"]
+        self._data = np.memmap(path, dtype=np.uint8, mode="r")
+        self.vectors = self._section("vectors").view(_DTYPES[self.dtype]).reshape(self.count, self.dim)
+        self._offsets = {name: self._section(name + "_offsets").view(np.int64)
+                         for name in ("ids", "texts", "metas")}
+
+    def _section(self, name: str) -> np.ndarray:
+        offset, length = self._sections[name]
+        return self._data[offset:offset + length]
+
+    def info(self) -> SnapshotInfo:
+        return SnapshotInfo(self.path, self.count, self.dim, self.dtype, len(self.sources),
+                            os.path.getsize(self.path))
+
+    def ranges(self, sources: Optional[Sequence[str]] = None) -> List[Tuple[str, int, int]]:
+        """Intervalli di righe dei file richiesti (tutti se sources è None)."""
+        names = list(self.sources) if sources is None else list(sources)
+        missing = [n for n in names if n not in self.sources]
+        if missing:
+            raise ValueError(f"File non presenti nello snapshot: {', '.join(missing)}")
+        return [(n, self.sources[n][0], self.sources[n][1]) for n in names]
+
+    def _bytes(self, name: str, first: int, last: int) -> np.ndarray:
+        offsets = self._offsets[name]
+        start = int(self._sections[name][0])
+        return self._data[start + offsets[first]:start + offsets[last]]
+
+    def _strings(self, name: str, first: int, last: int) -> List[bytes]:
+        offsets = self._offsets[name]
+        blob = bytes(self._bytes(name, first, last))
+        base = int(offsets[first])
+        return [blob[offsets[i] - base:offsets[i + 1] - base] for i in range(first, last)]
+
+    def verify(self, sources: Optional[Sequence[str]] = None) -> List[str]:
+        """File sorgente con CRC errato (lista vuota = snapshot integro)."""
+        corrupt = []
+        for name, first, last in self.ranges(sources):
+            crc = zlib.crc32(self.vectors[first:last])
+            for section in ("ids", "texts", "metas"):
+                crc = zlib.crc32(self._bytes(section, first, last), crc)
+            if crc != self.sources[name][2]:
+                corrupt.append(name)
+        return corrupt
+
+    def read(self, first: int, last: int
+             ) -> Tuple[List[str], np.ndarray, List[str], List[Dict[str, Any]]]:
+        """Righe [first, last): ID, vettori (float32), testi, metadati."""
+        return ([b.decode("utf-8") for b in self._strings("ids", first, last)],
+                np.asarray(self.vectors[first:last], dtype=np.float32),
+                [b.decode("utf-8") for b in self._strings("texts", first, last)],
+                [json.loads(b) for b in self._strings("metas", first, last)])
+
+    def batches(self, sources: Optional[Sequence[str]] = None,
+                batch_size: int = 5000) -> Iterator[Tuple[List[str], np.ndarray, List[str], List[Dict[str, Any]]]]:
+        for _, first, last in self.ranges(sources):
+            for s in range(first, last, batch_size):
+                yield self.read(s, min(last, s + batch_size))
+
+
+def import_snapshot(reader: SnapshotReader, vectorstore, sources: Optional[Sequence[str]] = None,
+                    verify: bool = True, batch_size: int = 5000, text_store=None) -> int:
+    """
+    Carica nel vectorstore i chunk dello snapshot (solo quelli dei file
+    in sources, se indicato). Con verify i CRC dei file da caricare
+    vengono controllati prima di scrivere qualunque cosa. Con text_store
+    i testi vanno nello store compresso (il chiamante fa save()).
+    """
+    if verify:
+        corrupt = reader.verify(sources)
+        if corrupt:
+            raise ValueError(f"Checksum errato nello snapshot per: {', '.join(corrupt)}")
+    loaded = 0
+    for ids, vectors, texts, metas in reader.batches(sources, batch_size):
+        if text_store is not None:
+            text_store.add(ids, texts)
+            texts = [""] * len(ids)
+        vectorstore._collection.upsert(ids=ids, embeddings=vectors, metadatas=metas, documents=texts)
+        loaded += len(ids)
+    return loaded
+
+
+def _directory_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Snapshot binario dell'indice (export/import)")
+    sub = parser.add_subparsers(dest="command", required=True)
+    for command in ("export", "verify", "restore"):
+        p = sub.add_parser(command)
+        p.add_argument("path")
+        p.add_argument("--sources", nargs="*", help="solo questi file sorgente (restore/verify parziale)")
+    bench = sub.add_parser("bench")
+    bench.add_argument("--chunks", type=int, default=50000)
+    bench.add_argument("--dim", type=int, default=768)
+    bench.add_argument("--files", type=int, default=200)
+    args = parser.parse_args()
+
+    if args.command == "export":
+        import rag
+        print(f"[INFO] Snapshot: {rag.export_index_snapshot(args.path)}")
+    elif args.command == "verify":
+        reader = SnapshotReader(args.path)
+        start = time.perf_counter()
+        corrupt = reader.verify(args.sources)
+        print(f"[INFO] {reader.info()}, modello: {reader.meta.get('embedding_model', '?')}")
+        if corrupt:
+            print(f"[ERRORE] Checksum errato: {', '.join(corrupt)}")
+        else:
+            print(f"[INFO] Checksum OK in {time.perf_counter() - start:.2f}s")
+    elif args.command == "restore":
+        import rag
+        rag.restore_index_snapshot(args.path, args.sources)
+    else:
+        import tempfile
+
+        from langchain_chroma import Chroma
+
+        from numpy_store import NumpyVectorStore
+
+        rng = np.random.default_rng(0)
+        vectors = rng.standard_normal((args.chunks, args.dim)).astype(np.float32)
+        ids = [f"c{i}" for i in range(args.chunks)]
+        texts = [" ".join(f"parola{j}" for j in rng.integers(0, 5000, 120)) for _ in range(args.chunks)]
+        metas = [{"source_file": f"doc{i % args.files}.pdf", "page": i % 30} for i in range(args.chunks)]
+
+        print(f"\n[BENCH] {args.chunks} chunk x {args.dim} dim, {args.files} file")
+        with tempfile.TemporaryDirectory() as workdir:
+            chroma_dir = os.path.join(workdir, "chroma")
+            chroma = Chroma("bench", persist_directory=chroma_dir,
+                            collection_metadata={"hnsw:space": "cosine"})
+            start = time.perf_counter()
+            for s in range(0, args.chunks, 5000):
+                chroma._collection.upsert(ids=ids[s:s + 5000], embeddings=vectors[s:s + 5000],
+                                          metadatas=metas[s:s + 5000], documents=texts[s:s + 5000])
+            upsert_s = time.perf_counter() - start
+            print(f"  chroma_db: {_directory_size(chroma_dir) / 2**20:.1f} MB, "
+                  f"upsert dei vettori già calcolati {upsert_s:.2f}s (re-ingest = questo + embedding)")
+
+            for dtype in ("f32", "f16"):
+                path = os.path.join(workdir, f"bench.{dtype}.snap")
+                print(f"  export {dtype}: {export_snapshot(chroma, path, dtype=dtype)}")
+            path = os.path.join(workdir, "bench.f32.snap")
+
+            start = time.perf_counter()
+            reader = SnapshotReader(path)
+            opened_ms = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            reader.verify()
+            print(f"  apertura (mmap) {opened_ms:.1f} ms, verifica completa {time.perf_counter() - start:.2f}s")
+
+            partial = [f"doc{i}.pdf" for i in range(max(1, args.files // 10))]
+            print(f"  {'restore':<26} {'chunk':>7} {'secondi':>8} {'vs upsert':>10}")
+            for backend in ("numpy", "chroma"):
+                for label, sources in (("completo", None), ("parziale 10%", partial)):
+                    target = os.path.join(workdir, f"restore_{backend}_{len(sources or ())}")
+                    start = time.perf_counter()
+                    store = (NumpyVectorStore("bench", persist_directory=target) if backend == "numpy"
+                             else Chroma("bench", persist_directory=target,
+                                         collection_metadata={"hnsw:space": reader.space}))
+                    loaded = import_snapshot(reader, store, sources)
+                    if backend == "numpy":
+                        store.persist()
+                    elapsed = time.perf_counter() - start
+                    print(f"  {backend + ' ' + label:<26} {loaded:>7} {elapsed:>8.2f} "
+                          f"{upsert_s / elapsed:>9.1f}x")
@@ -0,0 +1,227 @@
+# ================================================================
+# VERSIONI DELL'INDICE  –  rebuild blue/green con swap atomico
+# ================================================================
+# Un reset con rmtree lascia le query senza indice finché la
+# ricostruzione non finisce (es. al cambio di EMBEDDING_MODEL).
+# Qui ogni versione dell'indice ha i suoi file, tutti derivati da
+# un percorso base:
+#
+#   <base>                 vectorstore (Chroma / numpy / shard)
+#   <base>_manifest.json   manifest di ingestion
+#   <base>_bm25            indice BM25
+#   <base>_minhash.npz     indice near-duplicate
+#   <base>_compressed      vettori compressi + full-precision (compressed_store.py)
+#   <base>_texts           testi dei chunk compressi (text_store.py)
+#   <base>_version.json    modello di embedding, chunk, data
+#
+# Il puntatore <radice>_current.json dice quale versione è attiva:
+# una nuova versione si costruisce accanto, viene validata e poi
+# attivata riscrivendo il puntatore con os.replace (atomico). I
+# lettori vedono la versione vecchia o la nuova, mai una a metà.
+# La versione precedente resta su disco per il rollback.
+# Senza puntatore la versione attiva è la radice stessa (layout
+# storico, nessuna migrazione necessaria).
+#
+# Uso (da LanGraph/rag):
+#   python index_versions.py status
+#   python index_versions.py rebuild      # nuova versione + swap
+#   python index_versions.py rollback     # torna alla precedente
+# ================================================================
+
+import argparse
+import json
+import os
+import re
+import shutil
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Sequence, Tuple
+
+
+@dataclass(frozen=True)
+class IndexPaths:
+    """Percorsi di tutti i file di una versione dell'indice"""
+    base: str
+    shard_roots: Tuple[str, ...] = ()      # directory esterne per gli shard (es. dischi diversi)
+
+    @property
+    def store(self) -> str:
+        return self.base
+
+    @property
+    def manifest(self) -> str:
+        return self.base + "_manifest.json"
+
+    @property
+    def bm25(self) -> str:
+        return self.base + "_bm25"
+
+    @property
+    def dedup(self) -> str:
+        return self.base + "_minhash.npz"
+
+    @property
+    def compressed(self) -> str:
+        return self.base + "_compressed"
+
+    @property
+    def texts(self) -> str:
+        return self.base + "_texts"
+
+    @property
+    def meta(self) -> str:
+        return self.base + "_version.json"
+
+    @property
+    def name(self) -> str:
+        return os.path.basename(os.path.normpath(self.base))
+
+    def shard_dir(self, shard: int) -> str:
+        if self.shard_roots:
+            return os.path.join(self.shard_roots[shard], self.name)
+        return os.path.join(self.store, f"shard_{shard}")
+
+    def artifacts(self) -> List[str]:
+        return ([self.store, self.manifest, self.bm25, self.dedup, self.compressed, self.texts, self.meta]
+                + [os.path.join(root, self.name) for root in self.shard_roots])
+
+    def exists(self) -> bool:
+        return os.path.exists(self.store)
+
+    def read_meta(self) -> Dict[str, Any]:
+        try:
+            with open(self.meta, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def write_meta(self, meta: Dict[str, Any]) -> None:
+        _write_json(self.meta, meta)
+
+    def remove(self) -> None:
+        for path in self.artifacts():
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+
+
+def _write_json(path: str, data: Dict[str, Any]) -> None:
+    """Scrittura atomica: file temporaneo + os.replace."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+class IndexVersions:
+    """
+    Versioni dell'indice sotto una radice (PERSIST_DIRECTORY):
+    <radice> (storica), <radice>_v1, <radice>_v2, ...
+    keep = versioni conservate su disco, attiva compresa.
+    """
+
+    def __init__(self, root: str, shard_roots: Sequence[str] = (), keep: int = 2):
+        self.root = os.path.normpath(root)
+        self.shard_roots = tuple(shard_roots)
+        self.keep = max(1, keep)
+        self.pointer = self.root + "_current.json"
+        self._cache: Tuple[int, Dict[str, Any]] = (-1, {})
+        self._issued = 0        # numeri mai riusati nel processo (client Chroma in cache per percorso)
+
+    def paths(self, base: str) -> IndexPaths:
+        return IndexPaths(base, self.shard_roots)
+
+    def _state(self) -> Dict[str, Any]:
+        """Contenuto del puntatore, riletto solo quando cambia."""
+        try:
+            mtime = os.stat(self.pointer).st_mtime_ns
+        except OSError:
+            return {"active": self.root, "previous": []}
+        if mtime != self._cache[0]:
+            with open(self.pointer, "r", encoding="utf-8") as f:
+                self._cache = (mtime, json.load(f))
+        return self._cache[1]
+
+    def active(self) -> IndexPaths:
+        return self.paths(self._state()["active"])
+
+    def previous(self) -> List[IndexPaths]:
+        return [self.paths(base) for base in self._state().get("previous", [])]
+
+    def new_version(self) -> IndexPaths:
+        """
+        Percorso libero per una nuova versione. Le versioni non
+        referenziate dal puntatore (build interrotte) vengono rimosse.
+        """
+        referenced = {self.active().base} | {p.base for p in self.previous()}
+        pattern = re.compile(re.escape(os.path.basename(self.root)) + r"_v(\d+)$")
+        parent = os.path.dirname(self.root)
+        numbers = [0]
+        for entry in os.listdir(parent or "."):
+            match = pattern.match(entry)
+            if not match:
+                continue
+            numbers.append(int(match.group(1)))
+            base = os.path.join(parent, entry)
+            if base not in referenced:
+                self.paths(base).remove()
+        self._issued = max(numbers + [self._issued]) + 1
+        return self.paths(f"{self.root}_v{self._issued}")
+
+    def activate(self, paths: IndexPaths, meta: Dict[str, Any]) -> List[IndexPaths]:
+        """
+        Swap atomico: registra i metadati della versione, poi riscrive il
+        puntatore. Le versioni oltre 'keep' vengono cancellate e restituite.
+        """
+        paths.write_meta(dict(meta, activated=time.time()))
+        state = self._state()
+        history = [b for b in [state["active"]] + state.get("previous", []) if b != paths.base]
+        kept, dropped = history[:self.keep - 1], [self.paths(b) for b in history[self.keep - 1:]]
+        _write_json(self.pointer, {"active": paths.base, "previous": kept})
+        for old in dropped:
+            old.remove()
+        return dropped
+
+    def rollback(self) -> IndexPaths:
+        """Riattiva la versione precedente (quella corrente diventa la precedente)."""
+        state = self._state()
+        previous = [b for b in state.get("previous", []) if self.paths(b).exists()]
+        if not previous:
+            raise ValueError("Nessuna versione precedente su disco")
+        _write_json(self.pointer, {"active": previous[0],
+                                   "previous": [state["active"]] + previous[1:]})
+        return self.paths(previous[0])
+
+    def remove_all(self) -> None:
+        for paths in [self.active()] + self.previous():
+            paths.remove()
+        self.paths(self.root).remove()
+        if os.path.exists(self.pointer):
+            os.remove(self.pointer)
+        self._cache = (-1, {})
+
+
+# Una sola ricostruzione alla volta per processo
+REBUILD_LOCK = threading.Lock()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Versioni dell'indice (blue/green)")
+    parser.add_argument("command", choices=["status", "rebuild", "rollback"])
+    args = parser.parse_args()
+
+    import rag
+
+    versions = rag.index_versions()
+    if args.command == "rebuild":
+        rag.rebuild_index()
+    elif args.command == "rollback":
+        paths = versions.rollback()
+        print(f"[INFO] Versione attiva: {paths.base}")
+
+    active = versions.active()
+    print(f"\n[INFO] Attiva:  {active.base}  {active.read_meta()}")
+    for paths in versions.previous():
+        print(f"[INFO] Rollback: {paths.base}  {paths.read_meta()}")
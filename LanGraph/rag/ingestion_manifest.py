@@ -0,0 +1,218 @@
+# ================================================================
+# MANIFEST DI INGESTION  –  ingestion incrementale
+# ================================================================
+# Per ogni file di DOCUMENTS_PATH registra:
+#   path, size, mtime, hash del contenuto, ID dei chunk prodotti,
+#   chunk scartati come near-duplicate (-> chunk originale),
+#   data di ingestion (filtri di retrieval per data)
+#
+# Un file con size+mtime invariati viene saltato senza nemmeno
+# leggerlo; se cambia solo l'mtime si ricalcola l'hash e, se il
+# contenuto è identico, il file resta comunque "invariato".
+# Un file con lo stesso hash di un altro (stesso file con due nomi)
+# non viene caricato: si registra solo di chi è la copia.
+# ================================================================
+
+import hashlib
+import json
+import os
+import time
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+MANIFEST_VERSION = 1
+
+
+def file_sha256(file_path: str, block_size: int = 1 << 20) -> str:
+    """
+    Calcola lo SHA-256 del file leggendolo a blocchi (memoria costante).
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+@dataclass
+class FileEntry:
+    """Impronta di un file già indicizzato"""
+    path: str
+    size: int
+    mtime_ns: int
+    sha256: str
+    chunk_ids: List[str] = field(default_factory=list)
+    duplicate_of: str = ""                                     # file identico già indicizzato
+    duplicates: Dict[str, str] = field(default_factory=dict)   # chunk scartato -> chunk originale
+    ingested_at: float = 0.0                                   # epoch dell'ultima indicizzazione
+
+
+@dataclass
+class IngestionPlan:
+    """Esito del confronto tra DOCUMENTS_PATH e il manifest"""
+    to_load: List[str] = field(default_factory=list)     # path nuovi o modificati
+    unchanged: List[str] = field(default_factory=list)   # path da saltare
+    removed: List[str] = field(default_factory=list)     # source_file spariti dal disco
+    duplicates: Dict[str, str] = field(default_factory=dict)   # path -> file identico
+
+
+class IngestionManifest:
+    """
+    Manifest persistente in JSON, indicizzato per nome file
+    (lo stesso valore del metadata 'source_file' dei chunk).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files: Dict[str, FileEntry] = {}
+        self._pending: Dict[str, FileEntry] = {}
+        self._removed: List[str] = []
+
+    @classmethod
+    def load(cls, path: str) -> "IngestionManifest":
+        manifest = cls(path)
+        if not os.path.exists(path):
+            return manifest
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") != MANIFEST_VERSION:
+                print(f"[WARN] Manifest '{path}' di versione diversa: verrà ricostruito.")
+                return manifest
+            manifest.files = {
+                name: FileEntry(**entry) for name, entry in data.get("files", {}).items()
+            }
+        except (OSError, ValueError, TypeError) as e:
+            print(f"[WARN] Manifest illeggibile ({e}): verrà ricostruito.")
+        return manifest
+
+    def save(self) -> None:
+        """
+        Scrittura atomica: file temporaneo + os.replace.
+        """
+        data = {
+            "version": MANIFEST_VERSION,
+            "files": {name: asdict(entry) for name, entry in sorted(self.files.items())},
+        }
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def plan(self, file_paths: List[str], skip_identical: bool = False) -> IngestionPlan:
+        """
+        Classifica i file in nuovi/modificati, invariati e rimossi.
+        L'hash viene calcolato solo se size o mtime sono cambiati.
+        Un file invariato i cui duplicati puntano a file modificati o
+        rimossi viene ricaricato (l'originale potrebbe non esistere più).
+        Con skip_identical i file con lo stesso hash di un altro vanno in
+        plan.duplicates invece che in plan.to_load.
+        """
+        plan = IngestionPlan()
+        self._pending = {}
+        seen = set()
+        stats = {}
+
+        for file_path in file_paths:
+            name = Path(file_path).name
+            seen.add(name)
+            stat = os.stat(file_path)
+            stats[name] = stat
+            entry = self.files.get(name)
+
+            if entry and entry.size == stat.st_size and entry.mtime_ns == stat.st_mtime_ns:
+                plan.unchanged.append(file_path)
+                continue
+
+            sha256 = file_sha256(file_path)
+            if entry and entry.size == stat.st_size and entry.sha256 == sha256:
+                # Solo l'mtime è cambiato (es. copia o touch): contenuto identico
+                entry.mtime_ns = stat.st_mtime_ns
+                entry.path = str(file_path)
+                plan.unchanged.append(file_path)
+                continue
+
+            self._pending[name] = self._new_entry(file_path, stat, sha256)
+            plan.to_load.append(file_path)
+
+        plan.removed = sorted(name for name in self.files if name not in seen)
+        self._removed = plan.removed
+
+        # --- Invariati che dipendono da file modificati o rimossi ---
+        changed = set(self._pending).union(plan.removed)
+        owner = {cid: name for name, entry in self.files.items() for cid in entry.chunk_ids}
+        for file_path in list(plan.unchanged):
+            name = Path(file_path).name
+            entry = self.files[name]
+            originals = {owner.get(cid) for cid in entry.duplicates.values()}
+            if entry.duplicate_of:
+                originals.add(entry.duplicate_of)
+            if originals & changed or None in originals:
+                plan.unchanged.remove(file_path)
+                plan.to_load.append(file_path)
+                self._pending[name] = self._new_entry(file_path, stats[name], entry.sha256)
+
+        # --- Stesso contenuto sotto due nomi ---
+        if skip_identical:
+            by_hash = {}
+            for file_path in plan.unchanged:
+                entry = self.files[Path(file_path).name]
+                if not entry.duplicate_of:
+                    by_hash.setdefault(entry.sha256, Path(file_path).name)
+            for file_path in list(plan.to_load):
+                name = Path(file_path).name
+                original = by_hash.setdefault(self._pending[name].sha256, name)
+                if original != name:
+                    self._pending[name].duplicate_of = original
+                    plan.to_load.remove(file_path)
+                    plan.duplicates[file_path] = original
+        return plan
+
+    @staticmethod
+    def _new_entry(file_path: str, stat: os.stat_result, sha256: str) -> FileEntry:
+        return FileEntry(
+            path=str(file_path),
+            size=stat.st_size,
+            mtime_ns=stat.st_mtime_ns,
+            sha256=sha256,
+        )
+
+    @property
+    def pending(self) -> List[str]:
+        """File da indicizzare secondo l'ultimo plan() (esclusi gli identici saltati)."""
+        return [name for name, entry in self._pending.items() if not entry.duplicate_of]
+
+    @property
+    def removed(self) -> List[str]:
+        """source_file spariti dal disco secondo l'ultimo plan()."""
+        return list(self._removed)
+
+    def chunk_ids(self, name: str) -> List[str]:
+        """ID dei chunk registrati per un file (lista vuota se sconosciuto)."""
+        entry = self.files.get(name)
+        return list(entry.chunk_ids) if entry else []
+
+    def commit(self, chunk_ids_by_file: Dict[str, List[str]],
+               duplicates_by_file: Optional[Dict[str, Dict[str, str]]] = None) -> None:
+        """
+        Registra i file dell'ultimo plan() effettivamente indicizzati
+        e dimentica quelli rimossi. I file in errore (assenti dal
+        dizionario) restano fuori dal manifest e verranno ritentati.
+        duplicates_by_file: per file, chunk scartati -> chunk originale.
+        """
+        duplicates_by_file = duplicates_by_file or {}
+        now = time.time()
+        for name, entry in self._pending.items():
+            entry.ingested_at = now
+            if name in chunk_ids_by_file:
+                entry.chunk_ids = list(chunk_ids_by_file[name])
+                entry.duplicates = dict(duplicates_by_file.get(name, {}))
+                self.files[name] = entry
+            elif entry.duplicate_of:
+                self.files[name] = entry
+        for name in self._removed:
+            self.files.pop(name, None)
+        self._pending = {}
+        self._removed = []
+        self.save()
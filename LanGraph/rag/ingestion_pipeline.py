@@ -0,0 +1,171 @@
+# ================================================================
+# PIPELINE DI INGESTION  –  stadi concorrenti con code limitate
+# ================================================================
+#
+#   sorgente ──> [load] ──q──> [split] ──q──> [embed] ──q──> [upsert]
+#
+# Ogni stadio gira nei propri thread e comunica col successivo
+# tramite una queue.Queue di dimensione fissa: se uno stadio è lento
+# la coda a monte si riempie e chi produce si blocca (backpressure).
+# Per ogni stadio si misurano elementi, tempo di lavoro, throughput
+# e profondità della coda in ingresso, per individuare il collo di
+# bottiglia.
+# ================================================================
+
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, List, Optional
+
+_DONE = object()          # sentinella di fine flusso
+
+
+@dataclass
+class StageStats:
+    """Metriche di uno stadio della pipeline"""
+    name: str
+    workers: int
+    items_in: int = 0
+    items_out: int = 0
+    busy_seconds: float = 0.0
+    depth_samples: int = 0
+    depth_total: int = 0
+    depth_max: int = 0
+    queue_size: int = 0
+
+    @property
+    def throughput(self) -> float:
+        """Elementi elaborati al secondo per worker (tempo di lavoro effettivo)."""
+        return self.items_in / self.busy_seconds if self.busy_seconds else 0.0
+
+    @property
+    def avg_depth(self) -> float:
+        return self.depth_total / self.depth_samples if self.depth_samples else 0.0
+
+    def __str__(self) -> str:
+        return (f"{self.name:<8} workers={self.workers:<2} in={self.items_in:<6} "
+                f"out={self.items_out:<6} busy={self.busy_seconds:7.2f}s "
+                f"{self.throughput:8.1f} it/s  coda(media/max)="
+                f"{self.avg_depth:.1f}/{self.depth_max} di {self.queue_size}")
+
+
+@dataclass
+class _Stage:
+    name: str
+    fn: Callable[[Any], Optional[Iterable[Any]]]
+    workers: int
+
+
+class IngestionPipeline:
+    """
+    Pipeline generica: ogni stadio riceve un elemento e restituisce
+    un iterabile (anche vuoto) di elementi per lo stadio successivo.
+    L'output dell'ultimo stadio viene scartato.
+    """
+
+    def __init__(self, queue_size: int = 8):
+        self.queue_size = queue_size
+        self._stages: List[_Stage] = []
+        self._error: Optional[BaseException] = None
+        self._abort = threading.Event()
+
+    def add_stage(self, name: str, fn: Callable[[Any], Optional[Iterable[Any]]],
+                  workers: int = 1) -> "IngestionPipeline":
+        self._stages.append(_Stage(name, fn, max(1, workers)))
+        return self
+
+    def _put(self, q: queue.Queue, item: Any) -> bool:
+        """put bloccante che si interrompe se la pipeline è stata abortita."""
+        while not self._abort.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _worker(self, stage: _Stage, stats: StageStats, lock: threading.Lock,
+                inbox: queue.Queue, outbox: Optional[queue.Queue]) -> None:
+        while True:
+            depth = inbox.qsize()
+            item = inbox.get()
+            if item is _DONE:
+                inbox.put(_DONE)         # la rilascia per gli altri worker dello stadio
+                return
+            if self._abort.is_set():
+                continue                 # svuota la coda senza lavorare
+            start = time.perf_counter()
+            produced = 0
+            try:
+                for out in stage.fn(item) or ():
+                    produced += 1
+                    if outbox is not None and not self._put(outbox, out):
+                        break
+            except BaseException as e:   # il primo errore ferma l'intera pipeline
+                with lock:
+                    if self._error is None:
+                        self._error = e
+                self._abort.set()
+            elapsed = time.perf_counter() - start
+            with lock:
+                stats.items_in += 1
+                stats.items_out += produced
+                stats.busy_seconds += elapsed
+                stats.depth_samples += 1
+                stats.depth_total += depth
+                stats.depth_max = max(stats.depth_max, depth)
+
+    def run(self, source: Iterable[Any]) -> List[StageStats]:
+        """
+        Esegue la pipeline sugli elementi di source e restituisce
+        le metriche per stadio. Rilancia il primo errore incontrato.
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self._stages]
+        stats = [StageStats(s.name, s.workers, queue_size=self.queue_size) for s in self._stages]
+        lock = threading.Lock()
+
+        groups = []
+        for i, stage in enumerate(self._stages):
+            outbox = queues[i + 1] if i + 1 < len(queues) else None
+            threads = [
+                threading.Thread(
+                    target=self._worker,
+                    args=(stage, stats[i], lock, queues[i], outbox),
+                    name=f"pipeline-{stage.name}-{w}",
+                    daemon=True,
+                )
+                for w in range(stage.workers)
+            ]
+            for t in threads:
+                t.start()
+            groups.append(threads)
+
+        for item in source:
+            if not self._put(queues[0], item):
+                break
+        queues[0].put(_DONE)
+
+        # Chiusura ordinata: uno stadio termina solo dopo quello a monte
+        for i, threads in enumerate(groups):
+            for t in threads:
+                t.join()
+            if i + 1 < len(queues):
+                queues[i + 1].put(_DONE)
+
+        if self._error is not None:
+            raise self._error
+        return stats
+
+
+def print_pipeline_report(stats: List[StageStats], wall_seconds: float) -> None:
+    """
+    Stampa le metriche per stadio e indica il probabile collo di bottiglia
+    (lo stadio con la coda in ingresso mediamente più piena).
+    """
+    print(f"\n  [PIPELINE] Tempo totale: {wall_seconds:.2f}s")
+    for s in stats:
+        print(f"    {s}")
+    busiest = max(stats, key=lambda s: (s.avg_depth, s.busy_seconds / s.workers), default=None)
+    if busiest is not None:
+        print(f"  [PIPELINE] Probabile collo di bottiglia: {busiest.name}\n")
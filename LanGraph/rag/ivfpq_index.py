@@ -0,0 +1,310 @@
+# ================================================================
+# INDICE IVF-PQ  –  ANN su disco per corpora da milioni di chunk
+# ================================================================
+# L'HNSW di Chroma tiene in RAM tutti i vettori e i grafi di link.
+# Qui invece:
+#
+#   IVF: k-means grossolano in nlist cluster; ogni vettore finisce
+#        nella lista invertita del centroide più vicino
+#   PQ:  il residuo (vettore - centroide) è diviso in m sottovettori,
+#        ognuno codificato con 1 byte (256 centroidi per sottospazio)
+#
+#   query ─> nprobe liste più vicine ─> distanze approssimate (tabelle
+#            PQ, ADC) ─> shortlist di 'rescore' candidati ─> distanza
+#            esatta sui vettori full-precision (mmap, fuori da Chroma)
+#
+# Questo modulo contiene il modello (centroidi e codebook, in RAM) e la
+# ricerca sulle liste. Codici, etichette di lista e vettori completi
+# sono righe di CompressedVectors (compressed_store.py), su disco in
+# mmap: un chunk nuovo viene assegnato e codificato con il modello già
+# addestrato e aggiunto in coda, senza ricostruire l'indice.
+# Spec: "ivf4096-pq64" (nlist=4096, m=64); "ivf-pq64" -> nlist ~ 4*sqrt(n),
+# con n = righe all'ultimo addestramento (poi fisso: per corpora che
+# crescono molto conviene un nlist esplicito).
+#
+# Curve recall/latenza rispetto alla ricerca esatta:
+#   python ivfpq_index.py --synthetic 200000 768
+# ================================================================
+
+import argparse
+import math
+import re
+import time
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from vector_compression import pairwise_distance
+
+_SPEC_RE = re.compile(r"ivf(\d*)-pq(\d+)")
+
+
+def is_ivf_spec(spec: Optional[str]) -> bool:
+    return bool(spec) and _SPEC_RE.fullmatch(spec.strip().lower()) is not None
+
+
+def parse_ivf_spec(spec: str) -> Tuple[Optional[int], int]:
+    """'ivf4096-pq64' -> (4096, 64); 'ivf-pq64' -> (None, 64) = nlist automatico."""
+    match = _SPEC_RE.fullmatch(spec.strip().lower())
+    if not match:
+        raise ValueError(f"Spec IVF non valida: '{spec}' (es. ivf4096-pq64, ivf-pq32)")
+    nlist, m = match.groups()
+    return (int(nlist) if nlist else None), int(m)
+
+
+def _sq_distances(x: np.ndarray, centroids: np.ndarray, c_norms: np.ndarray) -> np.ndarray:
+    return c_norms[None, :] - 2.0 * (x @ centroids.T) + np.einsum("ij,ij->i", x, x)[:, None]
+
+
+def assign(x: np.ndarray, centroids: np.ndarray, block: int = 16384) -> np.ndarray:
+    """Centroide più vicino di ogni riga, a blocchi (memoria limitata)."""
+    c_norms = np.einsum("ij,ij->i", centroids, centroids)
+    labels = np.empty(len(x), dtype=np.int32)
+    for start in range(0, len(x), block):
+        chunk = np.asarray(x[start:start + block], dtype=np.float32)
+        labels[start:start + len(chunk)] = _sq_distances(chunk, centroids, c_norms).argmin(axis=1)
+    return labels
+
+
+def kmeans(x: np.ndarray, k: int, iters: int = 20, seed: int = 0) -> np.ndarray:
+    """
+    Lloyd semplice: inizializzazione su punti casuali, cluster vuoti
+    ri-seminati con punti casuali.
+    """
+    rng = np.random.default_rng(seed)
+    x = np.asarray(x, dtype=np.float32)
+    k = min(k, len(x))
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iters):
+        labels = assign(x, centroids)
+        counts = np.bincount(labels, minlength=k)
+        empty = counts == 0
+        # Somme per cluster: ordinamento per etichetta + reduceat (molto più veloce di np.add.at)
+        order = np.argsort(labels, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums = np.add.reduceat(x[order], starts[~empty], axis=0)
+        centroids[~empty] = sums / counts[~empty, None]
+        if empty.any():
+            centroids[empty] = x[rng.choice(len(x), int(empty.sum()), replace=False)]
+    return centroids
+
+
+class IVFPQIndex:
+    """
+    Modello IVF-PQ (centroidi + codebook) e ricerca sulle liste. I codici
+    sono colonne di CompressedVectors (compressed_store.py), una riga per
+    vettore: "pq" (m byte) e "list" (lista del vettore). Le liste invertite
+    si ricavano dalle etichette; dopo una compattazione le righe sono in
+    ordine di lista e ogni lista si legge con accessi contigui.
+    """
+
+    order_key = "list"                  # colonna che dà l'ordine delle righe su disco
+    train_rows = 65536                  # righe campionate per k-means
+    pq_sample = 16384                   # residui usati per i codebook PQ
+
+    def __init__(self, spec: str, space: str = "l2", centroids: Optional[np.ndarray] = None,
+                 codebooks: Optional[np.ndarray] = None, nprobe: int = 16):
+        self.spec = spec
+        self.space = space
+        self.nlist_spec, self.m = parse_ivf_spec(spec)
+        self.nprobe = nprobe
+        self.dsub = 0
+        self._lists_cache: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+        self.centroids: Optional[np.ndarray] = None         # (nlist, D_pad)
+        self.codebooks: Optional[np.ndarray] = None         # (m, 256, dsub)
+        if centroids is not None:
+            self.load_model({"centroids": centroids, "codebooks": codebooks})
+
+    @property
+    def trained(self) -> bool:
+        return self.centroids is not None
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @property
+    def nbytes(self) -> int:
+        """Byte del modello in RAM (centroidi + codebook)."""
+        return self.centroids.nbytes + self.codebooks.nbytes if self.trained else 0
+
+    def columns(self, dim: int) -> Dict[str, Tuple[type, int]]:
+        return {"pq": (np.uint8, self.m), "list": (np.int32, 1)}
+
+    # --- Addestramento e codifica ---
+
+    def _prepare(self, vectors) -> np.ndarray:
+        """Normalizza (cosine) e allinea la dimensione a m * dsub con zeri."""
+        x = np.asarray(vectors, dtype=np.float32)
+        if x.ndim == 1:
+            x = x[None, :]
+        if self.space == "cosine":
+            x = x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+        pad = self.m * self.dsub - x.shape[1]
+        return np.pad(x, ((0, 0), (0, pad))) if pad else x
+
+    def train(self, sample: np.ndarray, total: int, seed: int = 0) -> None:
+        """
+        k-means grossolano e codebook PQ su un campione di righe; total =
+        righe del corpus (nlist automatico ~ 4*sqrt(total)).
+        """
+        nlist = max(1, min(self.nlist_spec or int(4 * math.sqrt(total)), len(sample)))
+        self.dsub = math.ceil(sample.shape[1] / self.m)
+        train = self._prepare(sample)
+        centroids = kmeans(train, nlist, iters=10, seed=seed)
+        labels = assign(train, centroids)
+        residuals = (train - centroids[labels])[:self.pq_sample]
+        codebooks = np.stack([
+            kmeans(residuals[:, j * self.dsub:(j + 1) * self.dsub], 256, iters=15, seed=seed + j)
+            for j in range(self.m)
+        ])
+        if codebooks.shape[1] < 256:          # corpus minuscolo: meno di 256 campioni
+            codebooks = np.pad(codebooks, ((0, 0), (0, 256 - codebooks.shape[1]), (0, 0)),
+                               constant_values=np.inf)
+        self.load_model({"centroids": centroids, "codebooks": codebooks})
+
+    def encode(self, vectors) -> Dict[str, np.ndarray]:
+        """Lista più vicina e codici PQ del residuo, con il modello già addestrato."""
+        x = self._prepare(vectors)
+        labels = assign(x, self.centroids)
+        return {"pq": self._encode(x - self.centroids[labels]), "list": labels[:, None]}
+
+    def _encode(self, residuals: np.ndarray) -> np.ndarray:
+        codes = np.empty((len(residuals), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            sub = np.ascontiguousarray(residuals[:, j * self.dsub:(j + 1) * self.dsub])
+            book = np.where(np.isfinite(self.codebooks[j]), self.codebooks[j], 1e30)
+            codes[:, j] = assign(sub, book)
+        return codes
+
+    # --- Ricerca ---
+
+    def _lists(self, labels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Righe ordinate per lista + offset di ogni lista, ricalcolati solo
+        quando la colonna delle etichette cambia (nuove righe, compattazione).
+        """
+        cached = self._lists_cache
+        if cached is None or cached[0] is not labels:
+            flat = np.asarray(labels).reshape(-1)
+            order = np.argsort(flat, kind="stable")
+            offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+            np.cumsum(np.bincount(flat, minlength=self.nlist), out=offsets[1:])
+            cached = self._lists_cache = (labels, order, offsets)
+        return cached[1], cached[2]
+
+    def candidates(self, query_vector, n: int, columns: Dict[str, np.ndarray], alive: np.ndarray,
+                   exhaustive: bool = False) -> np.ndarray:
+        """
+        Righe dei primi n candidati (distanze approssimate ADC) nelle
+        nprobe liste più vicine; exhaustive=True le visita tutte (per i
+        sottoinsiemi filtrati troppo sparsi per le sole nprobe liste).
+        """
+        if not len(columns["list"]):
+            return np.empty(0, dtype=np.int64)
+        order, offsets = self._lists(columns["list"])
+        q = self._prepare(query_vector)[0]
+        nprobe = self.nlist if exhaustive else min(self.nprobe, self.nlist)
+        coarse = np.einsum("ij,ij->i", self.centroids, self.centroids) - 2.0 * (self.centroids @ q)
+        probes = np.argpartition(coarse, nprobe - 1)[:nprobe]
+
+        rows, distances = [], []
+        subspaces = np.arange(self.m)
+        codes_column = columns["pq"]
+        for lst in probes:
+            members = order[offsets[lst]:offsets[lst + 1]]
+            members = members[alive[members]]
+            if not len(members):
+                continue
+            residual = (q - self.centroids[lst]).reshape(self.m, 1, self.dsub)
+            tables = ((self.codebooks - residual) ** 2).sum(axis=2)      # (m, 256)
+            codes = np.asarray(codes_column[members])
+            distances.append(tables[subspaces, codes].sum(axis=1))
+            rows.append(members)
+        if not rows:
+            return np.empty(0, dtype=np.int64)
+
+        rows = np.concatenate(rows)
+        distances = np.concatenate(distances)
+        n = min(n, len(distances))
+        top = np.argpartition(distances, n - 1)[:n]
+        return rows[top[np.argsort(distances[top])]]
+
+    # --- Persistenza del modello ---
+
+    def model_arrays(self) -> Dict[str, np.ndarray]:
+        return {"centroids": self.centroids, "codebooks": self.codebooks}
+
+    def load_model(self, arrays) -> None:
+        self.centroids = np.asarray(arrays["centroids"], dtype=np.float32)
+        self.codebooks = np.asarray(arrays["codebooks"], dtype=np.float32)
+        self.dsub = self.codebooks.shape[2]
+        self._lists_cache = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Curve recall/latenza IVF-PQ vs ricerca esatta")
+    parser.add_argument("--persist", default="./chroma_db")
+    parser.add_argument("--collection", default="aggregatore_docs")
+    parser.add_argument("--synthetic", type=int, nargs=2, metavar=("N", "DIM"),
+                        help="Usa N vettori casuali di dimensione DIM invece della collection")
+    parser.add_argument("--spec", default="ivf-pq64")
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rescore", type=int, default=100)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.synthetic:
+        n, dim = args.synthetic
+        # Embedding reali: gruppi tematici in un sottospazio a bassa dimensionalità
+        basis = rng.standard_normal((64, dim)).astype(np.float32)
+        topics = 3.0 * rng.standard_normal((max(1, n // 500), 64)).astype(np.float32)
+        latent = topics[rng.integers(len(topics), size=n)] + rng.standard_normal((n, 64)).astype(np.float32)
+        vectors = latent @ basis + 0.1 * rng.standard_normal((n, dim)).astype(np.float32)
+    else:
+        import chromadb
+        collection = chromadb.PersistentClient(path=args.persist).get_collection(args.collection)
+        vectors = np.asarray(collection.get(include=["embeddings"])["embeddings"], dtype=np.float32)
+    if len(vectors) == 0:
+        raise SystemExit("[ERRORE] Nessun vettore da valutare")
+
+    picks = rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)
+    queries = vectors[picks] + 0.05 * np.linalg.norm(vectors[picks], axis=1, keepdims=True) \
+        * rng.standard_normal((len(picks), vectors.shape[1])).astype(np.float32) / np.sqrt(vectors.shape[1])
+
+    start = time.perf_counter()
+    exact = [set(np.argpartition(pairwise_distance(q, vectors, "l2"), args.k)[:args.k]) for q in queries]
+    exact_ms = 1000 * (time.perf_counter() - start) / len(queries)
+
+    start = time.perf_counter()
+    index = IVFPQIndex(args.spec, "l2")
+    sample = rng.choice(len(vectors), min(len(vectors), index.train_rows), replace=False)
+    index.train(vectors[np.sort(sample)], len(vectors))
+    columns = index.encode(vectors)
+    alive = np.ones(len(vectors), dtype=bool)
+    build_s = time.perf_counter() - start
+    codes_bytes = sum(c.nbytes for c in columns.values()) + index.nbytes
+
+    print(f"\n[BENCH] {len(vectors)} vettori x {vectors.shape[1]} dim, {len(queries)} query, "
+          f"k={args.k}, rescore={args.rescore}")
+    print(f"  indice {args.spec}: nlist={index.nlist} m={index.m}  build {build_s:.1f}s  "
+          f"{codes_bytes / 2**20:.1f} MB (float32: {vectors.nbytes / 2**20:.1f} MB)")
+    print(f"  ricerca esatta: {exact_ms:.2f} ms/query\n")
+    print(f"  {'nprobe':>6} {'recall PQ':>10} {'+rescore':>9} {'ms/query':>9}")
+    for nprobe in args.nprobe:
+        index.nprobe = nprobe
+        approx_hits = rescored_hits = 0
+        elapsed = 0.0
+        for q, truth in zip(queries, exact):
+            approx_hits += len(truth & set(index.candidates(q, args.k, columns, alive).tolist()))
+            start = time.perf_counter()
+            shortlist = index.candidates(q, max(args.k, args.rescore), columns, alive)
+            dist = pairwise_distance(q, vectors[np.sort(shortlist)], "l2")
+            hits = np.sort(shortlist)[np.argsort(dist)[:args.k]]
+            elapsed += time.perf_counter() - start
+            rescored_hits += len(truth & set(hits.tolist()))
+        elapsed = 1000 * elapsed / len(queries)
+        total = args.k * len(queries)
+        print(f"  {nprobe:>6} {approx_hits / total:>10.3f} {rescored_hits / total:>9.3f} {elapsed:>9.2f}")
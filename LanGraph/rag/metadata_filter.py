@@ -0,0 +1,240 @@
+# ================================================================
+# FILTRI SUI METADATI  –  pre-filtro del retrieval
+# ================================================================
+# "Quali sono i punti principali del documento nanotech1.pdf?" non
+# deve competere con i chunk di tutti gli altri documenti. Il filtro
+# restringe i candidati PRIMA del calcolo delle similarità:
+#
+#   file sorgente, estensione, data di ingestion
+#       -> risolti sul catalogo dei file (dal manifest, nessuna
+#          lettura del vectorstore) in una lista di source_file
+#   intervallo di pagine
+#       -> condizione sul metadata 'page' dei PDF
+#
+# Il risultato è un filtro 'where' di Chroma: Chroma lo applica
+# sul suo indice dei metadati, NumpyVectorStore confronta con la
+# query solo le righe dei file ammessi, BM25 solo i loro chunk.
+#
+# I nomi di file citati nella domanda diventano il filtro sui file
+# sorgente: nome completo con estensione ("nanotech1.pdf"), nome
+# tra virgolette ("nanotech1", «note») oppure nome senza estensione
+# che non può essere una parola comune (almeno MIN_STEM_LEN caratteri
+# con una cifra, '_' o '-': nanotech1, report_2024). Così "rag" o
+# "note" nel testo della domanda non restringono il retrieval.
+#
+# Prova (da LanGraph/rag):
+#   python metadata_filter.py "riassumi nanotech1.pdf" --pages 2 5
+# ================================================================
+
+import argparse
+import os
+import re
+from dataclasses import dataclass, field, replace
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Union
+
+from ingestion_manifest import IngestionManifest
+
+_WORD_RE = re.compile(r"[\w\-.]+")
+_QUOTED_RE = re.compile(r'["“”«»`]\s*([^"“”«»`]+?)\s*["“”«»`]')
+_NOT_A_WORD_RE = re.compile(r"[\d_\-]")
+
+MIN_STEM_LEN = 5     # nomi senza estensione né virgolette più corti: ignorati
+
+
+def _timestamp(value: Union[float, str, datetime, None]) -> Optional[float]:
+    """Epoch da epoch, datetime o stringa ISO ("2026-10-01", "2026-10-01T12:00")."""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value.timestamp()
+
+
+def _format_date(value: Union[float, str, datetime]) -> str:
+    return datetime.fromtimestamp(_timestamp(value)).isoformat(sep=" ", timespec="minutes")
+
+
+@dataclass
+class MetadataFilter:
+    """
+    Filtro di retrieval. Le pagine sono numerate da 1 come le vede
+    l'utente (PyPDFLoader salva 'page' da 0); estremi inclusi.
+    Le date accettano epoch, datetime o stringhe ISO.
+    """
+    sources: List[str] = field(default_factory=list)       # nomi file (metadata source_file)
+    extensions: List[str] = field(default_factory=list)    # es. [".pdf", "docx"]
+    page_from: Optional[int] = None
+    page_to: Optional[int] = None
+    ingested_after: Union[float, str, datetime, None] = None
+    ingested_before: Union[float, str, datetime, None] = None
+
+    def is_empty(self) -> bool:
+        return not (self.sources or self.extensions or self.page_from or self.page_to
+                    or self.ingested_after or self.ingested_before)
+
+    def restricts_files(self) -> bool:
+        return bool(self.sources or self.extensions or self.ingested_after or self.ingested_before)
+
+    def __str__(self) -> str:
+        parts = []
+        if self.sources:
+            parts.append("file=" + ",".join(self.sources))
+        if self.extensions:
+            parts.append("estensioni=" + ",".join(self.extensions))
+        if self.page_from or self.page_to:
+            parts.append(f"pagine={self.page_from or 1}-{self.page_to or '…'}")
+        if self.ingested_after:
+            parts.append(f"dal={_format_date(self.ingested_after)}")
+        if self.ingested_before:
+            parts.append(f"al={_format_date(self.ingested_before)}")
+        return "  ".join(parts) or "nessuno"
+
+
+def _is_bare_name(word: str) -> bool:
+    """Nome di file citato senza estensione né virgolette (non una parola comune)."""
+    return len(word) >= MIN_STEM_LEN and _NOT_A_WORD_RE.search(word) is not None
+
+
+class MetadataCatalog:
+    """
+    Indice dei file indicizzati (nome, estensione, data di ingestion,
+    ID dei chunk) costruito dal manifest di ingestion.
+    Un file saltato perché identico a un altro viene risolto sull'originale;
+    i chunk scartati come near-duplicate contano come i chunk sopravvissuti
+    a cui puntano (il loro contenuto è indicizzato lì).
+    """
+
+    def __init__(self, manifest: IngestionManifest):
+        self.ingested_at: Dict[str, float] = {}
+        self.chunk_ids: Dict[str, List[str]] = {}
+        self.duplicates: Dict[str, List[str]] = {}
+        self.alias: Dict[str, str] = {}
+        self._owner: Dict[str, str] = {}
+        for name, entry in manifest.files.items():
+            self.ingested_at[name] = entry.ingested_at
+            self.chunk_ids[name] = entry.chunk_ids
+            self.duplicates[name] = sorted(set(entry.duplicates.values()))
+            self.alias[name] = entry.duplicate_of or name
+            for cid in entry.chunk_ids:
+                self._owner[cid] = name
+        self._by_lower = {name.lower(): name for name in self.alias}
+        self._by_stem = {}
+        for name in self.alias:
+            self._by_stem.setdefault(os.path.splitext(name)[0].lower(), name)
+
+    def __len__(self) -> int:
+        return len(self.alias)
+
+    def detect_sources(self, question: str) -> List[str]:
+        """
+        Nomi di file citati nella domanda, senza distinzione di maiuscole:
+        nome completo ("nanotech1.pdf"), nome tra virgolette ("nanotech1")
+        o nome senza estensione che non sia una parola comune (nanotech1).
+        """
+        question = question.lower()
+        found = []
+
+        def add(name: Optional[str]) -> None:
+            if name and name not in found:
+                found.append(name)
+
+        for quoted in _QUOTED_RE.findall(question):
+            add(self._by_lower.get(quoted) or self._by_stem.get(quoted))
+        for word in _WORD_RE.findall(question):
+            word = word.strip(".-")
+            add(self._by_lower.get(word) or (self._by_stem.get(word) if _is_bare_name(word) else None))
+        return found
+
+    def select_files(self, metadata_filter: MetadataFilter) -> Optional[List[str]]:
+        """
+        source_file ammessi dal filtro (già risolti sugli originali).
+        None se il filtro non restringe i file.
+        """
+        if not metadata_filter.restricts_files():
+            return None
+        names = metadata_filter.sources or list(self.alias)
+        extensions = {e.lower() if e.startswith(".") else "." + e.lower()
+                      for e in metadata_filter.extensions}
+        after = _timestamp(metadata_filter.ingested_after)
+        before = _timestamp(metadata_filter.ingested_before)
+        selected: List[str] = []
+        for name in names:
+            original = self.alias.get(name)
+            if original is None:
+                continue
+            if extensions and os.path.splitext(name)[1].lower() not in extensions:
+                continue
+            date = self.ingested_at.get(original, 0.0)
+            if (after is not None and date < after) or (before is not None and date > before):
+                continue
+            if original not in selected:
+                selected.append(original)
+        return selected
+
+    def allowed_chunk_ids(self, files: List[str]) -> Set[str]:
+        """Chunk dei file, compresi i sopravvissuti dei loro near-duplicate."""
+        return {cid for name in files
+                for cid in (*self.chunk_ids.get(name, ()), *self.duplicates.get(name, ()))}
+
+    def _sources_with_duplicates(self, files: List[str]) -> List[str]:
+        """files + i file che contengono i chunk sopravvissuti dei loro near-duplicate."""
+        sources = list(files)
+        for name in files:
+            for cid in self.duplicates.get(name, ()):
+                owner = self._owner.get(cid)
+                if owner is not None and owner not in sources:
+                    sources.append(owner)
+        return sources
+
+    def where(self, metadata_filter: MetadataFilter,
+              files: Optional[List[str]]) -> Optional[Dict[str, Any]]:
+        """
+        Filtro 'where' di Chroma equivalente (None = nessun vincolo). Con i
+        near-duplicate include anche i file dei chunk sopravvissuti: i risultati
+        vanno poi ristretti con allowed_chunk_ids.
+        """
+        clauses: List[Dict[str, Any]] = []
+        if files is not None:
+            clauses.append({"source_file": {"$in": self._sources_with_duplicates(files)}})
+        if metadata_filter.page_from:
+            clauses.append({"page": {"$gte": metadata_filter.page_from - 1}})
+        if metadata_filter.page_to:
+            clauses.append({"page": {"$lte": metadata_filter.page_to - 1}})
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def with_detected_sources(metadata_filter: Optional[MetadataFilter], catalog: MetadataCatalog,
+                          question: str) -> MetadataFilter:
+    """
+    Aggiunge al filtro i file citati nella domanda, se il chiamante
+    non ha già indicato i file sorgente.
+    """
+    metadata_filter = metadata_filter or MetadataFilter()
+    if metadata_filter.sources:
+        return metadata_filter
+    detected = catalog.detect_sources(question)
+    return replace(metadata_filter, sources=detected) if detected else metadata_filter
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Risolve il filtro sui metadati di una domanda")
+    parser.add_argument("question")
+    parser.add_argument("--manifest", default="./chroma_db_manifest.json")
+    parser.add_argument("--ext", nargs="*", default=[])
+    parser.add_argument("--pages", type=int, nargs=2, metavar=("DA", "A"))
+    parser.add_argument("--after", help="Data ISO minima di ingestion")
+    args = parser.parse_args()
+
+    catalog = MetadataCatalog(IngestionManifest.load(args.manifest))
+    requested = MetadataFilter(extensions=args.ext, ingested_after=args.after,
+                               page_from=args.pages[0] if args.pages else None,
+                               page_to=args.pages[1] if args.pages else None)
+    resolved = with_detected_sources(requested, catalog, args.question)
+    files = catalog.select_files(resolved)
+    print(f"[INFO] Catalogo: {len(catalog)} file")
+    print(f"[INFO] Filtro: {resolved}")
+    print(f"[INFO] File ammessi: {files if files is not None else 'tutti'}")
+    print(f"[INFO] where: {catalog.where(resolved, files)}")
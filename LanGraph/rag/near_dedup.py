@@ -0,0 +1,228 @@
+# ================================================================
+# NEAR-DUPLICATE DETECTION  –  MinHash + LSH prima dell'embedding
+# ================================================================
+# sync_vectorstore riconosce solo i chunk con testo identico. Pagine
+# quasi uguali (report DOCX da template, header CSV ripetuti, stesse
+# sezioni in versioni diverse di un documento) finirebbero embeddate
+# più volte e riempirebbero il top-k di copie.
+#
+# Ogni chunk viene ridotto a una firma MinHash (num_perm minimi su
+# shingle di parole); le firme sono divise in bande e indicizzate
+# (LSH): solo i chunk che condividono almeno una banda vengono
+# confrontati, quindi il costo per chunk resta ~costante.
+# Un chunk con similarità di Jaccard stimata >= threshold rispetto a
+# uno già indicizzato viene scartato.
+#
+# L'indice si salva su disco (firme + ID) e segue le sync incrementali.
+#
+# Benchmark (da LanGraph/rag):  python near_dedup.py [--synthetic 2000]
+# ================================================================
+
+import argparse
+import os
+import time
+import zlib
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+
+def _false_rates(threshold: float, bands: int, rows: int) -> Tuple[float, float]:
+    """Probabilità (integrate) di falso positivo e falso negativo di una configurazione LSH."""
+    below = np.linspace(0.0, threshold, 64)
+    above = np.linspace(threshold, 1.0, 64)
+    fp = np.mean(1 - (1 - below ** rows) ** bands) * threshold
+    fn = np.mean((1 - above ** rows) ** bands) * (1.0 - threshold)
+    return float(fp), float(fn)
+
+
+def optimal_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """
+    Sceglie (bande, righe per banda) con bande * righe <= num_perm
+    minimizzando falsi positivi + falsi negativi attorno alla soglia.
+    """
+    best, best_error = (1, num_perm), float("inf")
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            fp, fn = _false_rates(threshold, bands, rows)
+            if fp + fn < best_error:
+                best, best_error = (bands, rows), fp + fn
+    return best
+
+
+class NearDuplicateIndex:
+    """
+    Indice LSH di firme MinHash, indicizzato per ID di chunk.
+    check() restituisce (ID originale, similarità) se il testo è un
+    near-duplicate di un chunk già presente, altrimenti lo aggiunge.
+    """
+
+    def __init__(self, threshold: float = 0.9, num_perm: int = 128,
+                 shingle_size: int = 5, seed: int = 1):
+        if not 0.0 < threshold <= 1.0:
+            raise ValueError("threshold deve essere in (0, 1]")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.seed = seed
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, int(_MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self.bands, self.rows = optimal_bands(threshold, num_perm)
+        self._signatures: Dict[str, np.ndarray] = {}
+        self._buckets: List[Dict[bytes, Set[str]]] = [{} for _ in range(self.bands)]
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._signatures
+
+    # --- Firme ---
+
+    def signature(self, text: str) -> np.ndarray:
+        """
+        Firma MinHash degli shingle di shingle_size parole (minuscolo,
+        spazi normalizzati): num_perm permutazioni universali in un solo
+        passaggio vettoriale.
+        """
+        words = text.lower().split()
+        k = self.shingle_size
+        shingles = [" ".join(words[i:i + k]) for i in range(max(1, len(words) - k + 1))]
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        permuted = (hashes[:, None] * self._a + self._b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def _band_keys(self, signature: np.ndarray) -> Iterable[Tuple[int, bytes]]:
+        for band in range(self.bands):
+            start = band * self.rows
+            yield band, signature[start:start + self.rows].tobytes()
+
+    # --- Indice ---
+
+    def add(self, key: str, signature: np.ndarray) -> None:
+        if key in self._signatures:
+            return
+        self._signatures[key] = signature
+        for band, band_key in self._band_keys(signature):
+            self._buckets[band].setdefault(band_key, set()).add(key)
+
+    def remove(self, keys: Iterable[str]) -> None:
+        for key in keys:
+            signature = self._signatures.pop(key, None)
+            if signature is None:
+                continue
+            for band, band_key in self._band_keys(signature):
+                bucket = self._buckets[band].get(band_key)
+                if bucket is not None:
+                    bucket.discard(key)
+                    if not bucket:
+                        del self._buckets[band][band_key]
+
+    def find(self, signature: np.ndarray) -> Optional[Tuple[str, float]]:
+        """
+        Chunk indicizzato più simile tra i candidati LSH, se la
+        similarità stimata (frazione di minimi uguali) supera la soglia.
+        """
+        candidates: Set[str] = set()
+        for band, band_key in self._band_keys(signature):
+            candidates.update(self._buckets[band].get(band_key, ()))
+        best: Optional[Tuple[str, float]] = None
+        for key in candidates:
+            similarity = float(np.mean(self._signatures[key] == signature))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (key, similarity)
+        return best
+
+    def check(self, key: str, text: str) -> Optional[Tuple[str, float]]:
+        """
+        Se 'text' è un near-duplicate restituisce (ID originale, similarità)
+        e non lo indicizza; altrimenti lo aggiunge con ID 'key'.
+        """
+        if key in self._signatures:
+            return None
+        signature = self.signature(text)
+        match = self.find(signature)
+        if match is None:
+            self.add(key, signature)
+        return match
+
+    # --- Persistenza ---
+
+    def save(self, path: str) -> None:
+        """Scrittura atomica di ID e firme in un unico .npz."""
+        keys = list(self._signatures)
+        matrix = (np.stack([self._signatures[k] for k in keys])
+                  if keys else np.zeros((0, self.num_perm), dtype=np.uint32))
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, keys=np.array(keys, dtype=str), signatures=matrix,
+                 params=np.array([self.num_perm, self.shingle_size, self.seed]))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str, threshold: float = 0.9, num_perm: int = 128,
+             shingle_size: int = 5, seed: int = 1) -> Optional["NearDuplicateIndex"]:
+        """
+        Ricarica un indice salvato. None se manca, è illeggibile o è
+        stato costruito con parametri di firma diversi (va ricostruito).
+        La soglia può cambiare liberamente: le bande vengono ricalcolate.
+        """
+        if not os.path.exists(path):
+            return None
+        try:
+            with np.load(path) as data:
+                if data["params"].tolist() != [num_perm, shingle_size, seed]:
+                    return None
+                keys, matrix = data["keys"].tolist(), data["signatures"]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[WARN] Indice near-duplicate illeggibile ({e}): verrà ricostruito.")
+            return None
+        index = cls(threshold, num_perm, shingle_size, seed)
+        for key, signature in zip(keys, matrix):
+            index.add(key, signature)
+        return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Near-duplicate detection sui chunk")
+    parser.add_argument("--threshold", type=float, default=0.9)
+    parser.add_argument("--num-perm", type=int, default=128)
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="Numero di chunk sintetici (metà sono copie ritoccate); 0 = corpus di ./data")
+    args = parser.parse_args()
+
+    if args.synthetic:
+        import random
+        rng = random.Random(0)
+        vocab = [f"parola{i}" for i in range(5000)]
+        originals = [" ".join(rng.choice(vocab) for _ in range(400)) for _ in range(args.synthetic // 2)]
+        texts = list(originals)
+        for text in originals:
+            words = text.split()
+            for _ in range(3):                              # ritocchi sparsi (es. data, numero report)
+                words[rng.randrange(len(words))] = rng.choice(vocab)
+            texts.append(" ".join(words))
+    else:
+        import rag
+        texts = [c.page_content for c in rag.chunk_documents(rag.load_all_documents())]
+    if not texts:
+        raise SystemExit("[ERRORE] Nessun chunk")
+
+    start = time.perf_counter()
+    index = NearDuplicateIndex(args.threshold, args.num_perm)
+    setup = time.perf_counter() - start
+    start = time.perf_counter()
+    dropped = [match for i, text in enumerate(texts) if (match := index.check(str(i), text))]
+    elapsed = time.perf_counter() - start
+
+    print(f"\n[BENCH] {len(texts)} chunk  soglia={args.threshold}  "
+          f"LSH={index.bands} bande x {index.rows} righe  (setup {setup:.2f}s)")
+    print(f"  near-duplicate scartati: {len(dropped)} ({len(dropped) / len(texts):.1%} di embedding risparmiati)")
+    print(f"  velocità: {len(texts) / elapsed:.0f} chunk/s")
+    if dropped:
+        similarities = [s for _, s in dropped]
+        print(f"  similarità dei duplicati: min={min(similarities):.2f} media={np.mean(similarities):.2f}")
@@ -0,0 +1,610 @@
+# ================================================================
+# VECTORSTORE NUMPY  –  brute-force in-process su matrice mmap
+# ================================================================
+# Per collection piccole e medie il giro su Chroma (client, SQLite,
+# HNSW, serializzazione) costa più della ricerca stessa. Qui:
+#
+#   vectors.<gen>.npy        embedding normalizzati (float32 o float16:
+#                            metà memoria, ma la conversione rallenta la ricerca)
+#   text.<gen>.bin + .npy    testi UTF-8 concatenati + offset
+#   meta.<gen>.bin + .npy    metadati JSON concatenati + offset
+#   ids.<gen>.json           ID dei chunk (riga -> ID)
+#   store.json               generazione corrente (scritto per ultimo)
+#
+# All'apertura i file vengono mappati in memoria (np.load mmap_mode),
+# senza copie: il sistema operativo carica solo le pagine lette.
+# Il top-k è un unico prodotto matrice-vettore + argpartition.
+#
+# Espone l'interfaccia VectorStore di LangChain più il sottoinsieme
+# di Chroma usato nel progetto (get/delete/upsert/count/_collection),
+# quindi si sostituisce a Chroma senza toccare il resto del codice.
+# Le modifiche restano in RAM finché non si chiama persist().
+#
+# Confronto di latenza con Chroma:
+#   python numpy_store.py --vectors 20000 --dim 4096
+# ================================================================
+
+import argparse
+import json
+import math
+import os
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+STORE_FILE = "store.json"
+SEARCH_BLOCK_ROWS = 4096           # righe float16 convertite a float32 per blocco (restano in cache)
+_DTYPES = {"f32": np.float32, "f16": np.float16}
+
+
+def matches_where(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """
+    Sottoinsieme dei filtri 'where' di Chroma:
+    {"campo": valore}, {"campo": {"$eq"|"$ne"|"$in"|"$nin"|"$gt"|"$gte"|"$lt"|"$lte": ...}},
+    {"$and": [...]}, {"$or": [...]}.
+    """
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, c) for c in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(matches_where(metadata, c) for c in condition):
+                return False
+            continue
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for op, expected in condition.items():
+            if op == "$eq" and value != expected:
+                return False
+            if op == "$ne" and value == expected:
+                return False
+            if op == "$in" and value not in expected:
+                return False
+            if op == "$nin" and value in expected:
+                return False
+            if op in ("$gt", "$gte", "$lt", "$lte"):
+                if value is None:
+                    return False
+                if ((op == "$gt" and not value > expected) or (op == "$gte" and not value >= expected)
+                        or (op == "$lt" and not value < expected) or (op == "$lte" and not value <= expected)):
+                    return False
+    return True
+
+
+# Punteggi di rilevanza sulla stessa scala di Chroma (spazio "l2" di default,
+# LangChain: 1 - d/√2 con d = L2 al quadrato). Su vettori normalizzati
+# d = 2·(1 - coseno), quindi rilevanza = 1 - √2·(distanza coseno): la stessa
+# SIMILARITY_THRESHOLD tiene gli stessi chunk con entrambi i backend.
+def relevance_from_distance(distance: float) -> float:
+    return 1.0 - math.sqrt(2) * distance
+
+
+def similarity_for_relevance(score: float) -> float:
+    """Similarità coseno minima che corrisponde al punteggio di rilevanza 'score'."""
+    return 1.0 - (1.0 - score) / math.sqrt(2)
+
+
+def _normalize(vectors) -> np.ndarray:
+    x = np.asarray(vectors, dtype=np.float32)
+    if x.ndim == 1:
+        return x / max(float(np.linalg.norm(x)), 1e-12)
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+def _pack(items: Sequence[bytes]) -> Tuple[bytes, np.ndarray]:
+    offsets = np.zeros(len(items) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in items], out=offsets[1:])
+    return b"".join(items), offsets
+
+
+def source_constraint(where: Optional[Dict[str, Any]]) -> Optional[Set[str]]:
+    """
+    Valori di source_file ammessi da un filtro 'where' ($eq / $in, anche
+    dentro $and). None se il filtro non vincola source_file.
+    """
+    allowed: Optional[Set[str]] = None
+    for key, condition in (where or {}).items():
+        if key == "$and":
+            values = [source_constraint(c) for c in condition]
+        elif key == "source_file":
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            values = []
+            if "$eq" in condition:
+                values.append({condition["$eq"]})
+            if "$in" in condition:
+                values.append(set(condition["$in"]))
+        else:
+            continue
+        for value in values:
+            if value is not None:
+                allowed = value if allowed is None else allowed & value
+    return allowed
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Vectorstore a ricerca esatta (distanza coseno) su embedding normalizzati
+    in una matrice memory-mapped, con testi e metadati in un sidecar.
+    persist_directory=None -> solo in memoria (come Chroma senza persistenza).
+    """
+
+    def __init__(self, collection_name: str = "langchain",
+                 embedding_function: Optional[Embeddings] = None,
+                 persist_directory: Optional[str] = None, dtype: str = "f32"):
+        if dtype not in _DTYPES:
+            raise ValueError(f"dtype deve essere uno tra {list(_DTYPES)}")
+        self._embedding_function = embedding_function
+        self.collection_name = collection_name
+        self.dtype = dtype
+        self.directory = os.path.join(persist_directory, collection_name) if persist_directory else None
+        # Compatibilità con chroma_space() / codice che legge la metrica della collection
+        self.metadata = {"hnsw:space": "cosine"}
+        self.configuration = {"hnsw": {"space": "cosine"}}
+        self._lock = threading.RLock()
+
+        # Generazione su disco (mmap, sola lettura)
+        self._generation = 0
+        self._base_ids: List[str] = []
+        self._base_rows: Dict[str, int] = {}
+        self._vectors = np.zeros((0, 0), dtype=_DTYPES[dtype])
+        self._alive = np.zeros(0, dtype=bool)
+        self._text = self._text_offsets = self._meta = self._meta_offsets = None
+        self._meta_cache: Optional[List[Dict[str, Any]]] = None
+        self._source_rows: Optional[Dict[str, np.ndarray]] = None
+
+        # Modifiche in RAM non ancora persistite: ID -> (vettore, testo, metadati)
+        self._new: Dict[str, Tuple[np.ndarray, str, Dict[str, Any]]] = {}
+        self._dirty = False
+
+        if self.directory and os.path.exists(os.path.join(self.directory, STORE_FILE)):
+            self._open()
+
+    # --- Apertura e persistenza ---
+
+    def _path(self, name: str, generation: int) -> str:
+        stem, ext = os.path.splitext(name)
+        return os.path.join(self.directory, f"{stem}.{generation}{ext}")
+
+    def _map_bytes(self, path: str) -> np.ndarray:
+        # np.memmap non accetta file vuoti
+        if os.path.getsize(path) == 0:
+            return np.zeros(0, dtype=np.uint8)
+        return np.memmap(path, dtype=np.uint8, mode="r")
+
+    def _open(self) -> None:
+        with open(os.path.join(self.directory, STORE_FILE), "r", encoding="utf-8") as f:
+            state = json.load(f)
+        gen = state["generation"]
+        self._generation = gen
+        self._vectors = np.load(self._path("vectors.npy", gen), mmap_mode="r")
+        with open(self._path("ids.json", gen), "r", encoding="utf-8") as f:
+            self._base_ids = json.load(f)
+        self._base_rows = {doc_id: row for row, doc_id in enumerate(self._base_ids)}
+        self._alive = np.ones(len(self._base_ids), dtype=bool)
+        self._text = self._map_bytes(self._path("text.bin", gen))
+        self._text_offsets = np.load(self._path("text_offsets.npy", gen), mmap_mode="r")
+        self._meta = self._map_bytes(self._path("meta.bin", gen))
+        self._meta_offsets = np.load(self._path("meta_offsets.npy", gen), mmap_mode="r")
+        self._meta_cache = None
+        self._source_rows = None
+        # dtype cambiato in configurazione: la prossima persist() riscrive la matrice
+        self._dirty = state["dtype"] != self.dtype
+
+    def persist(self) -> None:
+        """
+        Compatta righe vive + modifiche in RAM in una nuova generazione.
+        store.json viene sostituito per ultimo (os.replace): un crash a metà
+        lascia leggibile la generazione precedente.
+        """
+        with self._lock:
+            if not self.directory or not self._dirty:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            rows = np.flatnonzero(self._alive)
+            ids = [self._base_ids[r] for r in rows] + list(self._new)
+            texts = [self._row_text(r) for r in rows] + [t for _, t, _ in self._new.values()]
+            metas = [self._row_metadata(r) for r in rows] + [m for _, _, m in self._new.values()]
+            blocks = []
+            if len(rows):
+                blocks.append(np.asarray(self._vectors[rows], dtype=np.float32))
+            if self._new:
+                blocks.append(np.stack([v for v, _, _ in self._new.values()]))
+            vectors = (np.vstack(blocks) if blocks else np.zeros((0, 0), dtype=np.float32)
+                       ).astype(_DTYPES[self.dtype])
+
+            old, gen = self._generation, self._generation + 1
+            text_bytes, text_offsets = _pack([t.encode("utf-8") for t in texts])
+            meta_bytes, meta_offsets = _pack([json.dumps(m, ensure_ascii=False).encode("utf-8")
+                                              for m in metas])
+            np.save(self._path("vectors.npy", gen), vectors)
+            np.save(self._path("text_offsets.npy", gen), text_offsets)
+            np.save(self._path("meta_offsets.npy", gen), meta_offsets)
+            with open(self._path("text.bin", gen), "wb") as f:
+                f.write(text_bytes)
+            with open(self._path("meta.bin", gen), "wb") as f:
+                f.write(meta_bytes)
+            with open(self._path("ids.json", gen), "w", encoding="utf-8") as f:
+                json.dump(ids, f)
+            tmp = os.path.join(self.directory, STORE_FILE + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"generation": gen, "dtype": self.dtype, "count": len(ids),
+                           "dim": int(vectors.shape[1]) if vectors.ndim == 2 else 0}, f)
+            os.replace(tmp, os.path.join(self.directory, STORE_FILE))
+
+            self._new = {}
+            self._dirty = False
+            self._open()
+            if old:
+                for name in ("vectors.npy", "text_offsets.npy", "meta_offsets.npy",
+                             "text.bin", "meta.bin", "ids.json"):
+                    try:
+                        os.remove(self._path(name, old))
+                    except OSError:
+                        pass    # es. Windows con la mappa ancora aperta: verrà sovrascritto
+
+    # --- Accesso alle righe su disco ---
+
+    def _row_text(self, row: int) -> str:
+        start, end = self._text_offsets[row], self._text_offsets[row + 1]
+        return bytes(self._text[start:end]).decode("utf-8")
+
+    def _row_metadata(self, row: int) -> Dict[str, Any]:
+        if self._meta_cache is not None:
+            return self._meta_cache[row]
+        start, end = self._meta_offsets[row], self._meta_offsets[row + 1]
+        return json.loads(bytes(self._meta[start:end]))
+
+    def _all_metadatas(self) -> List[Dict[str, Any]]:
+        """Metadati di tutte le righe su disco, decodificati una volta (per i filtri)."""
+        if self._meta_cache is None:
+            self._meta_cache = [self._row_metadata(r) for r in range(len(self._base_ids))]
+        return self._meta_cache
+
+    def _rows_by_source(self) -> Dict[str, np.ndarray]:
+        """Indice source_file -> righe su disco, costruito una volta per generazione."""
+        if self._source_rows is None:
+            groups: Dict[str, List[int]] = {}
+            for row, meta in enumerate(self._all_metadatas()):
+                groups.setdefault(meta.get("source_file"), []).append(row)
+            self._source_rows = {name: np.asarray(rows, dtype=np.int64) for name, rows in groups.items()}
+        return self._source_rows
+
+    def _document(self, doc_id: str) -> Document:
+        if doc_id in self._new:
+            _, text, meta = self._new[doc_id]
+            return Document(page_content=text, metadata=dict(meta), id=doc_id)
+        row = self._base_rows[doc_id]
+        return Document(page_content=self._row_text(row), metadata=self._row_metadata(row), id=doc_id)
+
+    def _live_ids(self) -> List[str]:
+        return [self._base_ids[r] for r in np.flatnonzero(self._alive)] + list(self._new)
+
+    # --- Interfaccia stile Chroma ---
+
+    @property
+    def _collection(self) -> "NumpyVectorStore":
+        """Il codice che parla direttamente alla collection Chroma (upsert, count, get) trova qui gli stessi metodi."""
+        return self
+
+    def count(self) -> int:
+        with self._lock:
+            return int(self._alive.sum()) + len(self._new)
+
+    def upsert(self, ids: Sequence[str], embeddings: Sequence[Sequence[float]],
+               metadatas: Optional[Sequence[Optional[Dict[str, Any]]]] = None,
+               documents: Optional[Sequence[str]] = None) -> None:
+        vectors = _normalize(embeddings)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        with self._lock:
+            for i, doc_id in enumerate(ids):
+                row = self._base_rows.get(doc_id)
+                if row is not None:
+                    self._alive[row] = False
+                meta = dict(metadatas[i] or {}) if metadatas else {}
+                self._new[doc_id] = (vectors[i], documents[i] if documents else "", meta)
+            self._dirty = True
+
+    def get(self, ids: Optional[Sequence[str]] = None, where: Optional[Dict[str, Any]] = None,
+            limit: Optional[int] = None, offset: Optional[int] = None,
+            include: Sequence[str] = ("documents", "metadatas"), **kwargs) -> Dict[str, Any]:
+        with self._lock:
+            if ids is not None:
+                if isinstance(ids, str):
+                    ids = [ids]
+                selected = [i for i in ids
+                            if i in self._new or (i in self._base_rows and self._alive[self._base_rows[i]])]
+            else:
+                selected = self._live_ids()
+            if where:
+                selected = [i for i in selected if matches_where(self._metadata_of(i), where)]
+            start = offset or 0
+            selected = selected[start:start + limit] if limit is not None else selected[start:]
+
+            result: Dict[str, Any] = {"ids": selected, "documents": None, "metadatas": None,
+                                      "embeddings": None}
+            if "documents" in include:
+                result["documents"] = [self._document(i).page_content for i in selected]
+            if "metadatas" in include:
+                result["metadatas"] = [self._metadata_of(i) for i in selected]
+            if "embeddings" in include:
+                result["embeddings"] = [self._vector_of(i) for i in selected]
+            return result
+
+    def _metadata_of(self, doc_id: str) -> Dict[str, Any]:
+        if doc_id in self._new:
+            return self._new[doc_id][2]
+        return self._all_metadatas()[self._base_rows[doc_id]]
+
+    def _vector_of(self, doc_id: str) -> np.ndarray:
+        if doc_id in self._new:
+            return self._new[doc_id][0]
+        return np.asarray(self._vectors[self._base_rows[doc_id]], dtype=np.float32)
+
+    # --- Interfaccia VectorStore ---
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self._embedding_function
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        if ids is None or any(i is None for i in ids):
+            ids = [i or uuid.uuid4().hex for i in (ids or [None] * len(texts))]
+        vectors = self._embedding_function.embed_documents(texts)
+        self.upsert(ids, vectors, metadatas, texts)
+        return list(ids)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> None:
+        with self._lock:
+            for doc_id in ids or []:
+                if self._new.pop(doc_id, None) is not None:
+                    self._dirty = True
+                row = self._base_rows.get(doc_id)
+                if row is not None and self._alive[row]:
+                    self._alive[row] = False
+                    self._dirty = True
+
+    def _base_similarities(self, query: np.ndarray) -> np.ndarray:
+        """Coseno query-righe su disco; float16 convertito a blocchi (niente copia intera)."""
+        n = len(self._base_ids)
+        if n == 0:
+            return np.zeros(0, dtype=np.float32)
+        if self._vectors.dtype == np.float32:
+            return self._vectors @ query
+        sims = np.empty(n, dtype=np.float32)
+        for start in range(0, n, SEARCH_BLOCK_ROWS):
+            block = np.asarray(self._vectors[start:start + SEARCH_BLOCK_ROWS], dtype=np.float32)
+            sims[start:start + len(block)] = block @ query
+        return sims
+
+    def _candidate_rows(self, filter: Optional[Dict[str, Any]]) -> Optional[np.ndarray]:
+        """Righe su disco dei file ammessi dal filtro; None = tutte."""
+        sources = source_constraint(filter)
+        if sources is None:
+            return None
+        index = self._rows_by_source()
+        parts = [index[name] for name in sources if name in index]
+        return np.sort(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+
+    def search_by_vector(self, embedding: Sequence[float], k: int = 4,
+                         filter: Optional[Dict[str, Any]] = None) -> List[Tuple[str, float]]:
+        """
+        Top-k esatto: (ID, distanza coseno) in ordine crescente di distanza.
+        Se il filtro vincola source_file, vengono confrontate con la query
+        solo le righe di quei file (indice per source_file).
+        """
+        query = _normalize(embedding)
+        with self._lock:
+            rows = self._candidate_rows(filter)
+            if rows is None:
+                rows = np.arange(len(self._base_ids))
+                sims = self._base_similarities(query)
+            else:
+                sims = (np.asarray(self._vectors[rows], dtype=np.float32) @ query
+                        if len(rows) else np.zeros(0, dtype=np.float32))
+            sims = np.where(self._alive[rows], sims, -np.inf)
+            new_ids = list(self._new)
+            if new_ids:
+                new_sims = np.stack([self._new[i][0] for i in new_ids]) @ query
+                sims = np.concatenate([sims, new_sims])
+            if filter:
+                metas = self._all_metadatas()
+                metas = [metas[r] for r in rows] + [self._new[i][2] for i in new_ids]
+                allowed = np.fromiter((matches_where(m, filter) for m in metas), dtype=bool, count=len(metas))
+                sims = np.where(allowed, sims, -np.inf)
+
+            valid = int(np.isfinite(sims).sum())
+            k = min(k, valid)
+            if k <= 0:
+                return []
+            top = np.argpartition(-sims, k - 1)[:k]
+            top = top[np.argsort(-sims[top])]
+            n_rows = len(rows)
+            distances = np.clip(1.0 - sims[top], 0.0, 2.0)      # arrotondamenti float
+            return [(self._base_ids[rows[i]] if i < n_rows else new_ids[i - n_rows], float(d))
+                    for i, d in zip(top, distances)]
+
+    def range_search_by_vector(self, embedding: Sequence[float], min_similarity: float,
+                               max_results: int, deadline: Optional[float] = None,
+                               filter: Optional[Dict[str, Any]] = None
+                               ) -> Tuple[List[Tuple[str, float]], str, int]:
+        """
+        Tutte le righe con similarità coseno >= min_similarity (al più le
+        max_results migliori), confrontando la matrice a blocchi: il filtro
+        sui metadati si valuta solo sulle righe sopra la soglia e, scaduta
+        la deadline (time.perf_counter()), la scansione si ferma.
+        Restituisce ([(ID, distanza)], motivo dello stop, righe confrontate).
+        """
+        query = _normalize(embedding)
+        with self._lock:
+            rows = self._candidate_rows(filter)
+            total = len(self._base_ids) if rows is None else len(rows)
+            metas = self._all_metadatas() if filter else None
+            found_rows, found_sims = [], []
+            stop, scanned = "completa", 0
+            for start in range(0, total, SEARCH_BLOCK_ROWS):
+                if rows is None:
+                    block = np.arange(start, min(start + SEARCH_BLOCK_ROWS, total))
+                    matrix = self._vectors[start:start + SEARCH_BLOCK_ROWS]
+                else:
+                    block = rows[start:start + SEARCH_BLOCK_ROWS]
+                    matrix = self._vectors[block]
+                sims = np.asarray(matrix, dtype=np.float32) @ query
+                hit = np.flatnonzero((sims >= min_similarity) & self._alive[block])
+                if metas is not None:
+                    hit = hit[[matches_where(metas[block[i]], filter) for i in hit]]
+                found_rows.append(block[hit])
+                found_sims.append(sims[hit])
+                scanned += len(block)
+                if deadline is not None and scanned < total and time.perf_counter() > deadline:
+                    stop = "tempo"
+                    break
+
+            ids = [self._base_ids[r] for r in np.concatenate(found_rows)] if found_rows else []
+            sims = np.concatenate(found_sims) if found_sims else np.zeros(0, dtype=np.float32)
+            if stop != "tempo" and self._new:
+                new_ids = [i for i, (_, _, m) in self._new.items() if matches_where(m, filter)]
+                if new_ids:
+                    new_sims = np.stack([self._new[i][0] for i in new_ids]) @ query
+                    keep = np.flatnonzero(new_sims >= min_similarity)
+                    ids += [new_ids[i] for i in keep]
+                    sims = np.concatenate([sims, new_sims[keep]])
+                scanned += len(self._new)
+
+            order = np.argsort(-sims)
+            if len(order) > max_results:
+                order = order[:max_results]
+                stop = "tempo" if stop == "tempo" else "limite"
+            distances = np.clip(1.0 - sims[order], 0.0, 2.0)
+            return [(ids[i], float(d)) for i, d in zip(order, distances)], stop, scanned
+
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     filter: Optional[Dict[str, Any]] = None,
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        """(documento, distanza coseno): più bassa = più simile, come Chroma."""
+        hits = self.search_by_vector(self._embedding_function.embed_query(query), k, filter)
+        with self._lock:
+            return [(self._document(doc_id), dist) for doc_id, dist in hits]
+
+    def similarity_search(self, query: str, k: int = 4,
+                          filter: Optional[Dict[str, Any]] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[Dict[str, Any]] = None,
+                                    **kwargs: Any) -> List[Document]:
+        hits = self.search_by_vector(embedding, k, filter)
+        with self._lock:
+            return [self._document(doc_id) for doc_id, _ in hits]
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding: Sequence[float], k: int = 4,
+                                                          filter: Optional[Dict[str, Any]] = None,
+                                                          **kwargs: Any) -> List[Tuple[Document, float]]:
+        """Come Chroma (nonostante il nome): (documento, distanza), più bassa = più simile."""
+        hits = self.search_by_vector(embedding, k, filter)
+        with self._lock:
+            return [(self._document(doc_id), dist) for doc_id, dist in hits]
+
+    def _select_relevance_score_fn(self):
+        return relevance_from_distance
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings,
+                   metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None,
+                   collection_name: str = "langchain", persist_directory: Optional[str] = None,
+                   dtype: str = "f32", **kwargs: Any) -> "NumpyVectorStore":
+        store = cls(collection_name=collection_name, embedding_function=embedding,
+                    persist_directory=persist_directory, dtype=dtype)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        store.persist()
+        return store
+
+
+# ================================================================
+# BENCHMARK: latenza di ricerca rispetto a Chroma
+# ================================================================
+
+def _percentiles(samples: List[float]) -> Tuple[float, float]:
+    samples = sorted(samples)
+    return statistics.median(samples), samples[min(len(samples) - 1, int(0.95 * len(samples)))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latenza top-k: NumpyVectorStore vs Chroma")
+    parser.add_argument("--vectors", type=int, default=20000)
+    parser.add_argument("--dim", type=int, default=4096)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    from langchain_chroma import Chroma
+
+    rng = np.random.default_rng(0)
+    basis = rng.standard_normal((64, args.dim)).astype(np.float32)
+    vectors = rng.standard_normal((args.vectors, 64)).astype(np.float32) @ basis
+    vectors += 0.1 * rng.standard_normal(vectors.shape).astype(np.float32)
+    ids = [f"c{i}" for i in range(args.vectors)]
+    texts = [f"chunk {i}" for i in range(args.vectors)]
+    metas = [{"source_file": f"doc{i % 50}.pdf"} for i in range(args.vectors)]
+    queries = vectors[rng.choice(args.vectors, args.queries)] + \
+        0.05 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+
+    print(f"\n[BENCH] {args.vectors} vettori x {args.dim} dim, {args.queries} query, k={args.k}")
+    print(f"  {'backend':<14} {'apertura ms':>11} {'p50 ms':>8} {'p95 ms':>8} {'recall':>7}")
+    with tempfile.TemporaryDirectory() as workdir:
+        exact = None
+        for dtype in ("f32", "f16"):
+            directory = os.path.join(workdir, dtype)
+            store = NumpyVectorStore("bench", persist_directory=directory, dtype=dtype)
+            store.upsert(ids, vectors, metas, texts)
+            store.persist()
+            start = time.perf_counter()
+            store = NumpyVectorStore("bench", persist_directory=directory, dtype=dtype)
+            opened = (time.perf_counter() - start) * 1000
+            latencies, results = [], []
+            for q in queries:
+                start = time.perf_counter()
+                docs = store.similarity_search_by_vector(q.tolist(), k=args.k)
+                latencies.append((time.perf_counter() - start) * 1000)
+                results.append({d.id for d in docs})
+            exact = exact or results
+            recall = np.mean([len(a & b) / args.k for a, b in zip(results, exact)])
+            p50, p95 = _percentiles(latencies)
+            print(f"  {'numpy ' + dtype:<14} {opened:>11.1f} {p50:>8.2f} {p95:>8.2f} {recall:>7.3f}")
+
+        chroma = Chroma(collection_name="bench", persist_directory=os.path.join(workdir, "chroma"),
+                        collection_metadata={"hnsw:space": "cosine"})
+        for start in range(0, args.vectors, 5000):
+            chroma._collection.add(ids=ids[start:start + 5000], embeddings=vectors[start:start + 5000],
+                                   metadatas=metas[start:start + 5000], documents=texts[start:start + 5000])
+        del chroma
+        start = time.perf_counter()
+        chroma = Chroma(collection_name="bench", persist_directory=os.path.join(workdir, "chroma"))
+        chroma.similarity_search_by_vector(queries[0].tolist(), k=args.k)     # caricamento indice HNSW
+        opened = (time.perf_counter() - start) * 1000
+        latencies, results = [], []
+        for q in queries:
+            start = time.perf_counter()
+            docs = chroma.similarity_search_by_vector(q.tolist(), k=args.k)
+            latencies.append((time.perf_counter() - start) * 1000)
+            results.append({d.id for d in docs})
+        recall = np.mean([len(a & b) / args.k for a, b in zip(results, exact)])
+        p50, p95 = _percentiles(latencies)
+        print(f"  {'chroma (HNSW)':<14} {opened:>11.1f} {p50:>8.2f} {p95:>8.2f} {recall:>7.3f}")
@@ -0,0 +1,219 @@
+# ================================================================
+# CACHE DEGLI EMBEDDING DELLE DOMANDE  –  LRU in memoria con TTL
+# ================================================================
+# Ogni retrieval embedda la domanda (llama3 via HTTP: un forward
+# completo), anche per le domande di esempio ripetute e per i rerun
+# di Streamlit. Qui i vettori delle domande restano in memoria:
+#
+#   chiave   (modello, testo normalizzato: NFKC, minuscolo, spazi)
+#   valore   vettore + istante di calcolo (scade dopo ttl_s)
+#   limite   max_entries, eviction LRU
+#
+# shared_query_cache() restituisce un'unica istanza per processo:
+# le sessioni Streamlit e i CachedEmbeddings ricreati a ogni rerun
+# la condividono. Con path la cache viene salvata all'uscita (.npz)
+# e ricaricata all'avvio (le voci scadute vengono scartate).
+# stats() riporta hit rate e tempo di embedding risparmiato.
+#
+# Benchmark (da LanGraph/rag):
+#   python query_cache.py --model llama3 --queries 200 --distinct 20
+# ================================================================
+
+import argparse
+import atexit
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL_S = 3600.0
+
+_SPACES = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """Forma canonica della domanda usata come chiave (il vettore è quello del testo originale)."""
+    return _SPACES.sub(" ", unicodedata.normalize("NFKC", text)).strip().casefold()
+
+
+class QueryEmbeddingCache:
+    """
+    Cache LRU thread-safe dei vettori delle domande, per modello.
+    Un miss calcola il vettore fuori dal lock: due sessioni con la
+    stessa domanda nuova possono embeddarla entrambe, senza errori.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl_s: float = DEFAULT_TTL_S,
+                 path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.miss_seconds = 0.0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str], Tuple[List[float], float]]" = OrderedDict()
+        if path and os.path.exists(path):
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_or_embed(self, model: str, text: str,
+                     embed: Callable[[str], List[float]]) -> List[float]:
+        key = (model, normalize_query(text))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[1] <= self.ttl_s:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+                self.expired += 1
+
+        start = time.perf_counter()
+        vector = embed(text)
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.misses += 1
+            self.miss_seconds += elapsed
+            self._entries[key] = (vector, now)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return vector
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    # --- Persistenza ---
+
+    def save(self) -> None:
+        """Scrive le voci valide in path (file temporaneo + os.replace)."""
+        if not self.path:
+            return
+        now = time.time()
+        with self._lock:
+            items = [(k, v) for k, v in self._entries.items() if now - v[1] <= self.ttl_s]
+        vectors = [np.asarray(vector, dtype=np.float32) for _, (vector, _) in items]
+        offsets = np.zeros(len(items) + 1, dtype=np.int64)
+        np.cumsum([len(v) for v in vectors], out=offsets[1:])
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                models=np.array([model for (model, _), _ in items], dtype=str),
+                queries=np.array([query for (_, query), _ in items], dtype=str),
+                created=np.array([created for _, (_, created) in items], dtype=np.float64),
+                offsets=offsets,
+                data=np.concatenate(vectors) if vectors else np.zeros(0, dtype=np.float32),
+            )
+        os.replace(tmp_path, self.path)
+
+    def _load(self) -> None:
+        try:
+            with np.load(self.path) as data:
+                models, queries = data["models"], data["queries"]
+                created, offsets, flat = data["created"], data["offsets"], data["data"]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[WARN] Cache delle domande non leggibile ({self.path}): {e}")
+            return
+        now = time.time()
+        for i in range(len(models)):
+            if now - created[i] <= self.ttl_s:
+                vector = flat[offsets[i]:offsets[i + 1]].tolist()
+                self._entries[(str(models[i]), str(queries[i]))] = (vector, float(created[i]))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    # --- Metriche ---
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            miss_ms = self.miss_seconds / self.misses * 1000 if self.misses else 0.0
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "expired": self.expired,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+                "miss_ms": miss_ms,
+                "saved_s": self.hits * miss_ms / 1000,
+            }
+
+    def __str__(self) -> str:
+        s = self.stats()
+        return (f"hit={s['hits']}  miss={s['misses']}  hit_rate={s['hit_rate']:.1%}  "
+                f"voci={s['entries']}  embedding medio={s['miss_ms']:.0f} ms  "
+                f"risparmiati={s['saved_s']:.1f}s")
+
+
+# Una cache per processo (per path): la usano tutti i CachedEmbeddings
+_SHARED: Dict[Optional[str], QueryEmbeddingCache] = {}
+_SHARED_LOCK = threading.Lock()
+
+
+def shared_query_cache(max_entries: int = DEFAULT_MAX_ENTRIES, ttl_s: float = DEFAULT_TTL_S,
+                       path: Optional[str] = None) -> QueryEmbeddingCache:
+    """
+    Cache condivisa del processo. Chiamate successive aggiornano limite
+    e TTL; con path il salvataggio avviene all'uscita del processo.
+    """
+    key = os.path.abspath(path) if path else None
+    with _SHARED_LOCK:
+        cache = _SHARED.get(key)
+        if cache is None:
+            cache = _SHARED[key] = QueryEmbeddingCache(max_entries, ttl_s, path)
+            if path:
+                atexit.register(cache.save)
+        cache.max_entries, cache.ttl_s = max_entries, ttl_s
+        return cache
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latenza degli embedding delle domande con e senza cache")
+    parser.add_argument("--model", default="llama3", help="llama3 (Ollama) oppure st:<modello>")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--distinct", type=int, default=20, help="domande diverse (le altre sono ripetizioni)")
+    args = parser.parse_args()
+
+    import random
+
+    from embedding_backends import create_backend
+
+    backend = create_backend(args.model)
+    rng = random.Random(0)
+    pool = [f"Quali sono i punti principali del documento {i}?" for i in range(args.distinct)]
+    # Ripetizioni con varianti di maiuscole e spazi (stessa chiave normalizzata)
+    stream = [rng.choice([q, q.upper(), "  " + q.replace(" ", "  ")])
+              for q in (rng.choice(pool) for _ in range(args.queries))]
+
+    cache = QueryEmbeddingCache()
+    latencies = {"senza cache": [], "con cache": []}
+    for text in stream:
+        start = time.perf_counter()
+        backend.embed_query(text)
+        latencies["senza cache"].append((time.perf_counter() - start) * 1000)
+        start = time.perf_counter()
+        cache.get_or_embed(args.model, text, backend.embed_query)
+        latencies["con cache"].append((time.perf_counter() - start) * 1000)
+
+    print(f"\n[BENCH] {args.queries} domande ({args.distinct} distinte), modello {args.model}")
+    print(f"  {'':<12} {'p50 ms':>8} {'media ms':>9} {'totale s':>9}")
+    for name, values in latencies.items():
+        values.sort()
+        print(f"  {name:<12} {values[len(values) // 2]:>8.2f} {sum(values) / len(values):>9.2f} "
+              f"{sum(values) / 1000:>9.2f}")
+    print(f"  cache: {cache}")
@@ -3,7 +3,7 @@
 # ================================================================
 # Regole rispettate:
 #   [1] Ingestion eterogenea       -> loader scelto per estensione
-#   [2] Context Window Management  -> TokenTextSplitter (token-based)
+#   [2] Context Window Management  -> chunk in token del tokenizer llama3
 #   [3] Quality Control            -> soglia similarity_threshold
 #   [4] Prompt Dinamico            -> tono + lingua come parametri
 #   [5] Pure LCEL                  -> niente create_stuff/create_retrieval
@@ -61,18 +61,101 @@ from langchain_community.document_loaders import (
     UnstructuredExcelLoader,
 )
 
-from langchain_text_splitters import TokenTextSplitter
-DOCUMENTS_PATH   = "./data"
-PERSIST_DIRECTORY = "./chroma_db"
-RESET_DB         = False                 
+import hashlib
+import json
+import random
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from langchain_text_splitters import TextSplitter
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, Optional, Sequence, Set, Tuple
+
+from ingestion_manifest import FileEntry, IngestionManifest, IngestionPlan
+from ingestion_pipeline import IngestionPipeline, print_pipeline_report
+from embedding_cache import CachedEmbeddings
+from query_cache import shared_query_cache
+from result_cache import RetrievalCache
+from cdc_splitter import ContentDefinedSplitter
+from token_chunking import TokenAwareSplitter, TokenCountingSplitter
+from near_dedup import NearDuplicateIndex
+from bm25_index import BM25Index, reciprocal_rank_fusion
+from numpy_store import NumpyVectorStore, matches_where
+from sharded_store import ShardedVectorStore, shard_of
+from metadata_filter import MetadataCatalog, MetadataFilter, with_detected_sources
+from range_search import range_search
+from index_versions import REBUILD_LOCK, IndexPaths, IndexVersions
+from index_snapshot import SnapshotInfo, SnapshotReader, export_snapshot, import_snapshot
+from text_store import ChunkTextStore
+import embedding_backends
+from compressed_store import CompressedVectors, CompressedVectorStore
+from vector_compression import chroma_space
 
-EMBEDDING_MODEL  = "llama3"    
+DOCUMENTS_PATH   = "./data"
+VECTOR_BACKEND   = "chroma"              # "chroma" | "numpy" (brute-force in-process su matrice mmap)
+NUMPY_VECTOR_DTYPE = "f32"               # "f32" | "f16" (solo backend numpy)
+PERSIST_DIRECTORY = "./chroma_db" if VECTOR_BACKEND == "chroma" else "./numpy_db"
+                                         # radice delle versioni dell'indice (vedi index_versions.py)
+VECTOR_SHARDS    = 1                     # >1: chunk partizionati per hash su N collection, ricerca in parallelo
+                                         # (cambiando il numero di shard serve RESET_DB)
+SHARD_DIRECTORIES = None                 # opzionale: una directory per shard (es. dischi diversi)
+RESET_DB         = False                 # True: ricostruzione blue/green (l'indice attuale resta
+                                         # interrogabile fino allo swap)
+INDEX_VERSIONS_KEPT = 2                  # versioni su disco: attiva + una per il rollback
+VALIDATION_SAMPLES = 20                  # chunk campione cercati sulla nuova versione prima dello swap
+VALIDATION_MIN_RECALL = 0.9              # quota minima di campioni che ritrovano sé stessi nei top-5
+SNAPSHOT_DTYPE   = "f32"                 # "f32" | "f16" (snapshot grande la metà, vettori approssimati)
+INGESTION_MODE   = "batch"               # "batch" (tutto in RAM) | "stream" (lazy, memoria limitata)
+                                         # | "pipeline" (load/split/embed/upsert concorrenti)
+INGESTION_WORKERS = max(1, (os.cpu_count() or 1) - 1)   # 1 = caricamento sequenziale
+
+EMBEDDING_MODEL  = "llama3"             # "llama3" (Ollama) | "st:all-MiniLM-L6-v2" (locale, CPU)
+                                         # cambiando modello l'indice viene ricostruito in blue/green
+EMBEDDING_CACHE_ENTRIES = 500_000       # limite della cache embedding su disco (LRU)
+QUERY_CACHE_ENTRIES = 1024              # domande embeddate tenute in memoria (LRU, condivise nel processo)
+QUERY_CACHE_TTL_S = 3600                # validità di una domanda in cache (secondi)
+QUERY_CACHE_PATH = None                 # es. "./query_cache.npz": salvata all'uscita, ricaricata all'avvio
+EMBED_MAX_IN_FLIGHT = 4                 # richieste /api/embed contemporanee verso Ollama
+EMBED_PROCESSES  = 1                     # processi di encoding per sentence-transformers
 LLM_MODEL        = "llama3"
 
 
 CHUNK_SIZE       = 800
 CHUNK_OVERLAP    = 100
+TOKENIZER        = "tiktoken:cl100k_base"  # tokenizer con cui si misurano i chunk (nessun download gated);
+                                         # token esatti di llama3: "hf:<path di tokenizer.json>"
+                                         # (es. scaricato da meta-llama/Meta-Llama-3-8B)
+CHUNKING_MODE    = "token"               # "token" (offset fissi) | "cdc" (confini dal contenuto)
+CDC_MIN_WORDS    = 150                   # dimensioni CDC in parole (~0.75 parole/token)
+CDC_AVG_WORDS    = 400
+CDC_MAX_WORDS    = 600
+CDC_UNIT         = "sentence"            # "word" | "sentence"
 SIMILARITY_THRESHOLD = 0.3
+RANGE_SEARCH      = True    # tutti i chunk sopra SIMILARITY_THRESHOLD invece di k=5 + soglia
+RANGE_MAX_RESULTS = 20      # tetto sul numero di chunk della range search
+RANGE_MAX_MS      = 250     # tetto di tempo della range search (ms)
+HYBRID_RETRIEVAL  = True    # fonde ricerca densa e BM25 (nomi di file, codici, termini esatti)
+RESULT_CACHE_ENTRIES = 256  # risultati di retrieval in cache (LRU, invalidati da ogni scrittura); 0 = spenta
+HYBRID_CANDIDATES = 20      # candidati per lista prima della fusione
+RRF_K             = 60      # costante della reciprocal-rank fusion
+BM25_MIN_RATIO    = 0.5     # un chunk sotto soglia densa passa per il BM25 se >= ratio x miglior punteggio
+                            # BM25 e contiene un identificatore citato o tutti i termini selettivi
+CHROMA_BATCH_SIZE = 5000    # limite prudenziale per add/delete in un'unica chiamata
+CHUNK_TEXT_STORE  = None    # None (testi nel vectorstore) | "zstd" (side store compresso, pacchetto
+                            # zstandard, fallback zlib): si leggono solo i testi dei chunk finali
+                            # (si attiva anche su un indice esistente; per spegnerlo serve RESET_DB)
+EMBED_BATCH_SIZE  = 256     # chunk per batch di embedding/upsert
+VECTOR_COMPRESSION = None   # None | "pca256-int8" | "trunc1024-f16" | "int8" | "f16"
+                            # | "ivf4096-pq64" / "ivf-pq64" (IVF-PQ su disco, corpora molto grandi):
+                            # vettori fuori dall'HNSW, in <versione>_compressed (vale per le versioni
+                            # nuove; per attivarlo o cambiarlo su un indice esistente serve rebuild_index)
+COMPRESSION_RESCORE = 50    # candidati ricalcolati con i vettori full-precision
+IVF_NPROBE        = 16      # liste IVF visitate per query (recall vs latenza)
+DEDUP_THRESHOLD   = 0.85    # None = nessuna deduplicazione | Jaccard stimata oltre cui un chunk è una copia
+DEDUP_NUM_PERM    = 128     # permutazioni MinHash (precisione della stima)
+EMBED_WORKERS     = 4       # richieste di embedding concorrenti (modalità pipeline)
+PIPELINE_QUEUE_SIZE = 8     # capienza delle code tra gli stadi (backpressure)
 ### 1. INGESTION  –  Multi-Source Loader manuale
 # Mappa: estensione -> classe loader
 LOADER_MAP = {
@@ -83,129 +166,1138 @@ LOADER_MAP = {
     ".xls":  UnstructuredExcelLoader,
 }
 
-def detect_and_load(file_path: str) -> List[Document]:
+def iter_file_documents(file_path: str) -> Iterator[Document]:
     """
-    Rileva l'estensione del file e invoca il loader corretto.
-    Aggiunge metadata 'source_file' con il nome del file.
+    Versione lazy di detect_and_load: produce una pagina/riga alla volta
+    tramite loader.lazy_load(), senza materializzare l'intero file.
     """
     ext = Path(file_path).suffix.lower()
 
     if ext not in LOADER_MAP:
         print(f"  [SKIP] Formato non supportato: {file_path}")
-        return []
+        return
 
-    loader_cls = LOADER_MAP[ext]
-    loader     = loader_cls(file_path)
-    docs       = loader.load()
-
-    # Normalizzazione metadata
-    for doc in docs:
+    loader = LOADER_MAP[ext](file_path)
+    for doc in loader.lazy_load():
         doc.metadata["source_file"] = Path(file_path).name
+        yield doc
+
+
+def detect_and_load(file_path: str) -> List[Document]:
+    """
+    Rileva l'estensione del file e invoca il loader corretto.
+    Aggiunge metadata 'source_file' con il nome del file.
+    """
+    if Path(file_path).suffix.lower() not in LOADER_MAP:
+        print(f"  [SKIP] Formato non supportato: {file_path}")
+        return []
+
+    docs = list(iter_file_documents(file_path))
 
     print(f"  [OK]   {Path(file_path).name} -> {len(docs)} documento/i caricato/i")
     return docs
 
 
-def load_all_documents() -> List[Document]:
+def _load_file_isolated(file_path: str) -> Tuple[str, List[Document], Optional[str]]:
     """
-    Scansiona DOCUMENTS_PATH, rileva ogni file, carica con il loader giusto.
+    Carica un singolo file catturando qualsiasi eccezione.
+    Eseguita nei processi worker: un file corrotto non interrompe l'ingestion.
+    """
+    try:
+        return file_path, detect_and_load(file_path), None
+    except Exception as e:
+        return file_path, [], f"{type(e).__name__}: {e}"
+
+
+def list_document_files() -> List[str]:
+    """
+    Elenca (in ordine alfabetico) i file presenti in DOCUMENTS_PATH.
     """
     if not os.path.exists(DOCUMENTS_PATH):
         os.makedirs(DOCUMENTS_PATH)
         print(f"[INFO] Creata '{DOCUMENTS_PATH}'. Inserisci i file e rilancia.")
         return []
+    return [str(p) for p in sorted(Path(DOCUMENTS_PATH).iterdir()) if p.is_file()]
+
+
+def load_all_documents(workers: int = INGESTION_WORKERS,
+                       file_paths: Optional[List[str]] = None,
+                       failed: Optional[List[str]] = None) -> List[Document]:
+    """
+    Scansiona DOCUMENTS_PATH, rileva ogni file, carica con il loader giusto.
+    Con file_paths carica solo i file indicati (es. quelli del plan del manifest).
+    Con workers > 1 i file vengono distribuiti su un pool di processi
+    (il parsing dei PDF è CPU-bound); l'ordine dei risultati resta quello
+    alfabetico dei file e gli errori sono isolati per singolo file.
+    I nomi dei file andati in errore vengono aggiunti a 'failed'.
+    """
+    if file_paths is None:
+        file_paths = list_document_files()
+    if not file_paths:
+        return []
 
     print("[INFO] Scansione documenti...")
     all_docs: List[Document] = []
 
-    for file_path in sorted(Path(DOCUMENTS_PATH).iterdir()):
-        if file_path.is_file():
-            docs = detect_and_load(str(file_path))
-            all_docs.extend(docs)
-
-    print(f"[INFO] Totale documenti caricati: {len(all_docs)}")
+    if workers > 1 and len(file_paths) > 1:
+        print(f"[INFO] Caricamento parallelo su {min(workers, len(file_paths))} processi...")
+        with ProcessPoolExecutor(max_workers=min(workers, len(file_paths))) as pool:
+            futures = [pool.submit(_load_file_isolated, p) for p in file_paths]
+            results = []
+            # Si attende nell'ordine di sottomissione -> output stabile
+            for file_path, future in zip(file_paths, futures):
+                try:
+                    results.append(future.result())
+                except Exception as e:   # es. worker terminato (BrokenProcessPool)
+                    results.append((file_path, [], f"{type(e).__name__}: {e}"))
+    else:
+        results = [_load_file_isolated(p) for p in file_paths]
+
+    errors = 0
+    for file_path, docs, error in results:
+        if error:
+            errors += 1
+            print(f"  [ERRORE] {Path(file_path).name}: {error}")
+            if failed is not None:
+                failed.append(Path(file_path).name)
+        all_docs.extend(docs)
+
+    print(f"[INFO] Totale documenti caricati: {len(all_docs)}"
+          + (f" ({errors} file in errore)" if errors else ""))
     return all_docs
 
 ### 2. SPLITTING  –  Token-based (unico ammesso)
 
+def _make_splitter() -> TextSplitter:
+    """
+    "token": finestre di CHUNK_SIZE token misurate con TOKENIZER.
+    "cdc":   content-defined chunking, i confini restano stabili dopo
+             modifiche locali e solo i chunk toccati vanno ri-embeddati.
+    In entrambi i casi ogni chunk ha metadata["token_count"].
+    Lo splitter (e il tokenizer) viene creato una volta per configurazione.
+    """
+    return _cached_splitter(CHUNKING_MODE, TOKENIZER, CHUNK_SIZE, CHUNK_OVERLAP,
+                            CDC_MIN_WORDS, CDC_AVG_WORDS, CDC_MAX_WORDS, CDC_UNIT)
+
+
+@lru_cache(maxsize=4)
+def _cached_splitter(mode: str, tokenizer: str, chunk_size: int, chunk_overlap: int,
+                     cdc_min: int, cdc_avg: int, cdc_max: int, cdc_unit: str) -> TextSplitter:
+    if mode == "cdc":
+        cdc = ContentDefinedSplitter(
+            min_size=cdc_min,
+            avg_size=cdc_avg,
+            max_size=cdc_max,
+            unit=cdc_unit,
+        )
+        return TokenCountingSplitter(cdc, tokenizer)
+    return TokenAwareSplitter(
+        tokenizer,
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+    )
+
+
 def chunk_documents(documents: List[Document]) -> List[Document]:
     """
-    Divide i documenti in chunk usando TokenTextSplitter.
+    Divide i documenti in chunk con lo splitter scelto da CHUNKING_MODE.
     """
     if not documents:
         return []
 
-    splitter = TokenTextSplitter(
-        chunk_size=CHUNK_SIZE,
-        chunk_overlap=CHUNK_OVERLAP,
-        length_function=len,
-    )
+    splitter = _make_splitter()
     chunks = splitter.split_documents(documents)
     print(f"[INFO] Chunk generati: {len(chunks)}")
     return chunks
 
 
+def stream_chunk_batches(file_paths: List[str], batch_size: int = EMBED_BATCH_SIZE,
+                         failed: Optional[List[str]] = None) -> Iterator[List[Document]]:
+    """
+    Percorso streaming: legge ogni file pagina per pagina (lazy_load),
+    splitta subito e restituisce batch di batch_size chunk.
+    La memoria di picco dipende da batch_size, non dalla dimensione del file.
+    I nomi dei file andati in errore vengono aggiunti a 'failed'.
+    """
+    splitter = _make_splitter()
+    buffer: List[Document] = []
+
+    for file_path in file_paths:
+        name = Path(file_path).name
+        pages = 0
+        try:
+            for doc in iter_file_documents(file_path):
+                pages += 1
+                buffer.extend(splitter.split_documents([doc]))
+                while len(buffer) >= batch_size:
+                    yield buffer[:batch_size]
+                    buffer = buffer[batch_size:]
+        except Exception as e:
+            print(f"  [ERRORE] {name}: {type(e).__name__}: {e}")
+            if failed is not None:
+                failed.append(name)
+            continue
+        print(f"  [OK]   {name} -> {pages} pagina/e in streaming")
+
+    if buffer:
+        yield buffer
+
+
 ### 3. VECTORSTORE  –  Sync intelligente
 
+_VERSIONS: Dict[Tuple, IndexVersions] = {}
+
+
+def index_versions() -> IndexVersions:
+    key = (PERSIST_DIRECTORY, tuple(SHARD_DIRECTORIES or ()), INDEX_VERSIONS_KEPT)
+    if key not in _VERSIONS:
+        _VERSIONS[key] = IndexVersions(*key)
+    return _VERSIONS[key]
+
+
+def active_paths() -> IndexPaths:
+    """Percorsi della versione dell'indice attualmente servita."""
+    return index_versions().active()
+
+
+def _paths_of(vectorstore) -> IndexPaths:
+    # Versione da cui il vectorstore è stato aperto: dopo uno swap i
+    # vectorstore già aperti continuano a usare i propri indici
+    return getattr(vectorstore, "index_paths", None) or active_paths()
+
+
 def reset_vectorstore():
-    if os.path.exists(PERSIST_DIRECTORY):
-        shutil.rmtree(PERSIST_DIRECTORY)
-        print("[INFO] Vectorstore resettato.")
+    """Cancella tutte le versioni dell'indice (per la ricostruzione senza downtime: rebuild_index)."""
+    index_versions().remove_all()
+    print("[INFO] Vectorstore resettato.")
+    _SPARSE_INDEXES.clear()
+    _TEXT_STORES.clear()
+    _COMPRESSED.clear()
+    _RESULTS.bump()
+
+
+def load_manifest(paths: Optional[IndexPaths] = None) -> IngestionManifest:
+    """
+    Carica il manifest di ingestion della versione (default: attiva). Se il
+    vectorstore non esiste (primo avvio o nuova versione) il manifest non è
+    affidabile e si riparte da zero.
+    """
+    paths = paths or active_paths()
+    if not paths.exists():
+        return IngestionManifest(paths.manifest)
+    return IngestionManifest.load(paths.manifest)
+
+
+def plan_ingestion(manifest: IngestionManifest) -> IngestionPlan:
+    """
+    Confronta DOCUMENTS_PATH con il manifest: solo i file nuovi o
+    modificati andranno caricati e splittati.
+    """
+    plan = manifest.plan(list_document_files(), skip_identical=DEDUP_THRESHOLD is not None)
+    print(f"[INFO] Manifest: {len(plan.to_load)} da caricare, "
+          f"{len(plan.unchanged)} invariati, {len(plan.removed)} rimossi")
+    for file_path, original in plan.duplicates.items():
+        print(f"[INFO] {Path(file_path).name} è identico a {original}: saltato")
+    return plan
+
+
+@dataclass
+class SyncReport:
+    """Esito di una sincronizzazione del vectorstore"""
+    added: int = 0
+    removed: int = 0
+    unchanged: int = 0
+    duplicates: int = 0
+
+    def __str__(self) -> str:
+        return (f"aggiunti={self.added}  rimossi={self.removed}  invariati={self.unchanged}"
+                f"  near-duplicate scartati={self.duplicates}")
+
+
+def _batched(items: Sequence, size: int) -> Iterator[Sequence]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _delete_ids(vectorstore: Chroma, ids: List[str],
+                sparse: Optional[BM25Index] = None,
+                texts: Optional[ChunkTextStore] = None) -> None:
+    for batch in _batched(ids, CHROMA_BATCH_SIZE):
+        vectorstore.delete(ids=list(batch))
+    if sparse is not None:
+        sparse.remove(ids)
+    if texts is not None:
+        texts.remove(ids)
+
+
+def _existing_ids(vectorstore: Chroma, ids: List[str],
+                  texts: Optional[ChunkTextStore] = None) -> set:
+    """
+    Verifica in batch quali ID esistono già (include=[]: nessun testo caricato).
+    Con lo store dei testi conta come esistente solo un chunk con il testo
+    salvato (una sync interrotta prima di texts.save() lo reinserisce).
+    """
+    found = set()
+    for batch in _batched(ids, CHROMA_BATCH_SIZE):
+        found.update(vectorstore.get(ids=list(batch), include=[])["ids"])
+    if texts is not None:
+        found = {cid for cid in found if cid in texts}
+    return found
 
 
-def sync_vectorstore(chunks: List[Document], embeddings) -> Chroma:
+def _write_chunks(vectorstore: Chroma, ids: List[str], chunks: Sequence[Document], vectors,
+                  sparse: Optional[BM25Index] = None,
+                  texts: Optional[ChunkTextStore] = None) -> None:
     """
-    Crea o aggiorna il vectorstore.
-    Aggiunge solo i chunk ancora mancanti nel DB.
+    Upsert di chunk già embeddati. Con lo store dei testi il documento nel
+    vectorstore resta vuoto e il testo va nel side store compresso.
     """
-    vectorstore = Chroma(
+    contents = [c.page_content for c in chunks]
+    metadatas = [c.metadata for c in chunks]
+    if texts is not None:
+        texts.add(ids, contents)
+    vectorstore._collection.upsert(
+        ids=list(ids),
+        embeddings=vectors,
+        metadatas=metadatas,
+        documents=[""] * len(ids) if texts is not None else contents,
+    )
+    if sparse is not None:
+        sparse.add(ids, contents, metadatas)
+
+
+def make_chunk_id(source_file: str, text: str, ordinal: int = 0) -> str:
+    """
+    ID deterministico di un chunk: hash di file sorgente, posizione e testo.
+    La posizione è l'ordinale del testo tra i chunk identici dello stesso
+    file, così l'ID non cambia se il chunk si sposta per modifiche altrove.
+    """
+    key = f"{source_file}\x00{ordinal}\x00{text}".encode("utf-8")
+    return hashlib.sha256(key).hexdigest()[:32]
+
+
+def assign_chunk_ids(chunks: List[Document],
+                     seen: Optional[Dict[Tuple[str, bytes], int]] = None) -> List[str]:
+    """
+    Calcola gli ID deterministici dei chunk nell'ordine in cui sono dati.
+    'seen' conserva gli ordinali tra batch successivi dello stesso file
+    (indicizzato per digest del testo, così resta piccolo).
+    """
+    if seen is None:
+        seen = {}
+    ids = []
+    for chunk in chunks:
+        source_file = chunk.metadata.get("source_file", "?")
+        key = (source_file, hashlib.sha1(chunk.page_content.encode("utf-8")).digest())
+        ordinal = seen.get(key, 0)
+        seen[key] = ordinal + 1
+        ids.append(make_chunk_id(source_file, chunk.page_content, ordinal))
+    return ids
+
+
+def sync_vectorstore(chunks: List[Document], embeddings,
+                     manifest: Optional[IngestionManifest] = None,
+                     paths: Optional[IndexPaths] = None,
+                     failed_sources: Optional[List[str]] = None) -> Tuple[Chroma, SyncReport]:
+    """
+    Crea o aggiorna il vectorstore con semantica di vera sincronizzazione:
+      - i chunk dei file rimossi da DOCUMENTS_PATH vengono cancellati in blocco;
+      - per ogni file ricaricato i chunk in DB vengono confrontati con quelli
+        nuovi: gli identici restano, gli obsoleti vengono cancellati e i nuovi
+        inseriti con upsert.
+    Se viene passato il manifest, registra gli ID dei chunk di ogni file
+    (tranne quelli in failed_sources, che verranno ritentati).
+    paths = versione dell'indice da aggiornare (default: attiva).
+    """
+    return sync_vectorstore_batches(_batched(chunks, EMBED_BATCH_SIZE), embeddings, manifest,
+                                    failed_sources, paths)
+
+
+def _open_collection(embeddings, directory: str) -> Chroma:
+    if VECTOR_BACKEND == "numpy":
+        return NumpyVectorStore(
+            collection_name="aggregatore_docs",
+            embedding_function=embeddings,
+            persist_directory=directory,
+            dtype=NUMPY_VECTOR_DTYPE,
+        )
+    return Chroma(
         collection_name="aggregatore_docs",
         embedding_function=embeddings,
-        persist_directory=PERSIST_DIRECTORY,
+        persist_directory=directory,
     )
 
-    if not chunks:
-        print("[WARN] Nessun chunk da indicizzare.")
-        return vectorstore
 
-    # Confronto con i testi già presenti
-    existing  = vectorstore.get()
-    existing_texts = set(existing["documents"]) if existing["documents"] else set()
-    new_chunks = [c for c in chunks if c.page_content not in existing_texts]
+def _open_vectorstore(embeddings, paths: Optional[IndexPaths] = None) -> Chroma:
+    paths = paths or active_paths()
+    if VECTOR_SHARDS > 1:
+        vectorstore = ShardedVectorStore(
+            [_open_collection(embeddings, paths.shard_dir(i)) for i in range(VECTOR_SHARDS)],
+            paths.store,
+        )
+    else:
+        vectorstore = _open_collection(embeddings, paths.store)
+    vectorstore = _with_compression(vectorstore, paths)
+    vectorstore.index_paths = paths
+    return vectorstore
+
+
+def _with_compression(vectorstore: Chroma, paths: IndexPaths) -> Chroma:
+    """
+    Con VECTOR_COMPRESSION i vettori della versione stanno in
+    <base>_compressed (compressed_store.py) e la collection riceve solo un
+    segnaposto. Decide lo stato su disco: una versione compressa resta
+    compressa con la sua spec, un indice già popolato con vettori completi
+    resta com'è; per cambiare serve una nuova versione (rebuild_index).
+    """
+    stored = CompressedVectors.stored_spec(paths.compressed)
+    if stored is None:
+        if not VECTOR_COMPRESSION:
+            return vectorstore
+        if vectorstore._collection.count():
+            print(f"[WARN] {paths.name} ha già i vettori completi nel vectorstore: "
+                  f"VECTOR_COMPRESSION={VECTOR_COMPRESSION} vale dalla prossima rebuild_index.")
+            return vectorstore
+    elif stored != VECTOR_COMPRESSION:
+        print(f"[WARN] {paths.name} usa la compressione {stored} (configurata: "
+              f"{VECTOR_COMPRESSION}): per cambiarla serve rebuild_index.")
+    directory = paths.compressed
+    if directory not in _COMPRESSED:
+        _COMPRESSED[directory] = CompressedVectors(directory, stored or VECTOR_COMPRESSION,
+                                                   chroma_space(vectorstore), nprobe=IVF_NPROBE)
+    return CompressedVectorStore(vectorstore, _COMPRESSED[directory], COMPRESSION_RESCORE)
+
+
+def rebuild_shard(embeddings, shard: int) -> int:
+    """
+    Ricostruisce un solo shard (es. directory persa o corrotta): ricarica
+    e risplitta i file del manifest, tiene i chunk di quello shard già
+    registrati (niente near-duplicate) e li reinserisce. Gli embedding
+    arrivano dalla cache; gli altri shard non vengono toccati.
+    """
+    if VECTOR_SHARDS <= 1:
+        raise ValueError("rebuild_shard richiede VECTOR_SHARDS > 1")
+    manifest = load_manifest()
+    vectorstore = _open_vectorstore(embeddings)
+    wanted = {cid for entry in manifest.files.values() for cid in entry.chunk_ids
+              if shard_of(cid, VECTOR_SHARDS) == shard}
+    paths = [entry.path for entry in manifest.files.values()
+             if not entry.duplicate_of and os.path.exists(entry.path)]
+    chunks = chunk_documents(load_all_documents(file_paths=paths))
+    ids = assign_chunk_ids(chunks)
+    keep = [i for i, cid in enumerate(ids) if cid in wanted]
+    keep_ids = [ids[i] for i in keep]
+    contents = [chunks[i].page_content for i in keep]
+    vectors = embeddings.embed_documents(contents) if keep else []
+    # Stesso percorso di scrittura della sync: testi nel side store se attivo
+    texts = open_text_store(vectorstore)
+    if texts is not None:
+        texts.add(keep_ids, contents)
+    added = vectorstore.rebuild_shard(shard, keep_ids, vectors,
+                                      [chunks[i].metadata for i in keep],
+                                      [""] * len(keep) if texts is not None else contents)
+    if texts is not None:
+        texts.save()
+    _RESULTS.bump()
+    print(f"[INFO] Shard {shard} ricostruito: {added} chunk "
+          f"({len(wanted) - added} non ritrovati nei file)")
+    return added
+
+
+def _delete_removed_sources(vectorstore: Chroma, manifest: Optional[IngestionManifest],
+                            report: SyncReport, sparse: Optional[BM25Index] = None,
+                            texts: Optional[ChunkTextStore] = None) -> List[str]:
+    """
+    Cancella in blocco i chunk dei file spariti da DOCUMENTS_PATH.
+    """
+    removed_sources = manifest.removed if manifest is not None else []
+    if removed_sources:
+        stale = vectorstore.get(where={"source_file": {"$in": removed_sources}}, include=[])
+        _delete_ids(vectorstore, stale["ids"], sparse, texts)
+        report.removed += len(stale["ids"])
+        print(f"[INFO] File rimossi: {', '.join(removed_sources)}")
+    return removed_sources
+
 
-    if new_chunks:
-        vectorstore.add_documents(documents=new_chunks)
-        print(f"[INFO] Chunk aggiunti al vectorstore: {len(new_chunks)}")
+# Indici BM25, store dei testi e vettori compressi aperti in questo processo, per
+# directory: sync e retrieval (anche tra i rerun di Streamlit) condividono la stessa istanza.
+_SPARSE_INDEXES: Dict[str, BM25Index] = {}
+_TEXT_STORES: Dict[str, ChunkTextStore] = {}
+_COMPRESSED: Dict[str, CompressedVectors] = {}
+
+# Risultati di retrieval del processo, condivisi tra le sessioni Streamlit:
+# ogni sync che scrive sull'indice passa a una nuova generazione.
+_RESULTS = RetrievalCache(RESULT_CACHE_ENTRIES)
+
+
+def _forget_side_indexes(paths: IndexPaths) -> None:
+    _SPARSE_INDEXES.pop(paths.bm25, None)
+    _TEXT_STORES.pop(paths.texts, None)
+    _COMPRESSED.pop(paths.compressed, None)
+
+
+def open_text_store(vectorstore: Chroma) -> Optional[ChunkTextStore]:
+    """Store compresso dei testi della versione del vectorstore (None se CHUNK_TEXT_STORE è spento)."""
+    if not CHUNK_TEXT_STORE:
+        return None
+    directory = _paths_of(vectorstore).texts
+    if directory not in _TEXT_STORES:
+        _TEXT_STORES[directory] = ChunkTextStore(directory, codec=CHUNK_TEXT_STORE)
+    return _TEXT_STORES[directory]
+
+
+def _chunk_texts(vectorstore: Chroma, ids: Sequence[str], documents: Sequence[Optional[str]]) -> List[str]:
+    """
+    Testi dei chunk: dal side store se attivo, altrimenti (o per i chunk
+    indicizzati prima dello store) il documento salvato nel vectorstore.
+    """
+    texts = open_text_store(vectorstore)
+    if texts is None:
+        return [d or "" for d in documents]
+    return [t if t is not None else (d or "") for t, d in zip(texts.get(ids), documents)]
+
+
+def _attach_texts(vectorstore: Chroma, docs: List[Document]) -> List[Document]:
+    """Decomprime solo i testi dei chunk finali del retrieval."""
+    empty = [d for d in docs if not d.page_content]
+    if empty:
+        for doc, text in zip(empty, _chunk_texts(vectorstore, [d.id for d in empty], [""] * len(empty))):
+            doc.page_content = text
+    return docs
+
+
+def open_sparse_index(vectorstore: Chroma) -> Optional[BM25Index]:
+    """
+    Indice BM25 affiancato al vectorstore, nella sua stessa versione
+    (None se HYBRID_RETRIEVAL è spento).
+    Se manca o non ha lo stesso numero di chunk del vectorstore (primo
+    avvio, sync interrotta) viene ricostruito dai testi in DB.
+    """
+    if not HYBRID_RETRIEVAL:
+        return None
+    directory = _paths_of(vectorstore).bm25
+    index = _SPARSE_INDEXES.get(directory)
+    if index is None:
+        index = _SPARSE_INDEXES[directory] = BM25Index(directory)
+    total = vectorstore._collection.count()
+    if len(index) != total:
+        print(f"[INFO] Indice BM25 da ricostruire ({len(index)} chunk, vectorstore {total})...")
+        index.clear()
+        for offset in range(0, total, CHROMA_BATCH_SIZE):
+            got = vectorstore.get(include=["documents", "metadatas"],
+                                  limit=CHROMA_BATCH_SIZE, offset=offset)
+            index.add(got["ids"], _chunk_texts(vectorstore, got["ids"], got["documents"]),
+                      got["metadatas"])
+        index.save()
+    return index
+
+
+class ChunkDeduplicator:
+    """
+    Scarta i chunk near-duplicate prima dell'embedding (MinHash + LSH).
+    L'indice contiene i chunk presenti nel vectorstore: quando un file
+    viene ricaricato i suoi vecchi chunk ne escono, così un chunk non
+    può risultare "copia" di una propria versione obsoleta.
+    Per ogni file registra chunk scartato -> chunk originale.
+    """
+
+    def __init__(self, vectorstore: Chroma, manifest: Optional[IngestionManifest]):
+        self.vectorstore = vectorstore
+        self.manifest = manifest
+        self.duplicates_by_file: Dict[str, Dict[str, str]] = {}
+        self._files: set = set()
+        self.index: Optional[NearDuplicateIndex] = None
+        self.path = _paths_of(vectorstore).dedup
+        if DEDUP_THRESHOLD is None:
+            return
+
+        self.index = NearDuplicateIndex.load(self.path, DEDUP_THRESHOLD, DEDUP_NUM_PERM)
+        if self.index is None:
+            # Primo avvio (o parametri cambiati): firme dei chunk già in DB
+            self.index = NearDuplicateIndex(DEDUP_THRESHOLD, DEDUP_NUM_PERM)
+            total = vectorstore._collection.count()
+            for offset in range(0, total, CHROMA_BATCH_SIZE):
+                got = vectorstore.get(include=["documents"], limit=CHROMA_BATCH_SIZE, offset=offset)
+                for chunk_id, text in zip(got["ids"], _chunk_texts(vectorstore, got["ids"],
+                                                                   got["documents"])):
+                    self.index.add(chunk_id, self.index.signature(text))
+        if manifest is not None:
+            for name in manifest.removed:
+                self.index.remove(manifest.chunk_ids(name))
+
+    def _forget_old_chunks(self, name: str) -> None:
+        if self.manifest is not None and name in self.manifest.files:
+            old_ids = self.manifest.chunk_ids(name)
+        else:
+            old_ids = self.vectorstore.get(where={"source_file": name}, include=[])["ids"]
+        self.index.remove(old_ids)
+
+    def filter(self, batch: List[Document], batch_ids: List[str],
+               report: SyncReport) -> Tuple[List[Document], List[str]]:
+        """Restituisce solo i chunk (e gli ID) da indicizzare."""
+        if self.index is None:
+            return batch, batch_ids
+        kept, kept_ids = [], []
+        for chunk, chunk_id in zip(batch, batch_ids):
+            name = chunk.metadata.get("source_file", "?")
+            if name not in self._files:
+                self._files.add(name)
+                self._forget_old_chunks(name)
+            match = self.index.check(chunk_id, chunk.page_content)
+            if match is None:
+                kept.append(chunk)
+                kept_ids.append(chunk_id)
+            else:
+                self.duplicates_by_file.setdefault(name, {})[chunk_id] = match[0]
+                report.duplicates += 1
+        return kept, kept_ids
+
+    def save(self) -> None:
+        if self.index is not None:
+            self.index.save(self.path)
+
+
+def _finalize_sync(vectorstore: Chroma, report: SyncReport,
+                   manifest: Optional[IngestionManifest],
+                   chunk_ids_by_file: Dict[str, List[str]],
+                   removed_sources: List[str],
+                   failed_sources: Optional[List[str]] = None,
+                   dedup: Optional[ChunkDeduplicator] = None,
+                   sparse: Optional[BM25Index] = None,
+                   texts: Optional[ChunkTextStore] = None) -> None:
+    """
+    Chiude una sincronizzazione: cancella i chunk obsoleti dei file
+    ricaricati, salva l'indice BM25 e lo store dei testi e registra nel
+    manifest gli ID prodotti e i near-duplicate.
+    """
+    # File caricati senza chunk (vuoti, PDF scansionati): registrati con chunk_ids=[],
+    # così il prossimo avvio li salta invece di riaprirli
+    if manifest is not None:
+        for name in manifest.pending:
+            chunk_ids_by_file.setdefault(name, [])
+    for name in failed_sources or []:
+        chunk_ids_by_file.pop(name, None)
+
+    # ID attualmente in DB per i file ricaricati (dal manifest o, se assenti, da Chroma)
+    old_ids: set = set()
+    untracked = []
+    for name in chunk_ids_by_file:
+        if manifest is not None and name in manifest.files:
+            old_ids.update(manifest.chunk_ids(name))
+        else:
+            untracked.append(name)
+    if untracked:
+        old_ids.update(vectorstore.get(where={"source_file": {"$in": untracked}}, include=[])["ids"])
+
+    produced = {cid for ids in chunk_ids_by_file.values() for cid in ids}
+    stale_ids = sorted(old_ids.difference(produced))
+    if stale_ids:
+        _delete_ids(vectorstore, stale_ids, sparse, texts)
+        report.removed += len(stale_ids)
+
+    # Backend numpy e vettori compressi tengono le modifiche in RAM: vanno scritte prima del manifest
+    if isinstance(vectorstore, (NumpyVectorStore, ShardedVectorStore, CompressedVectorStore)):
+        vectorstore.persist()
+    if isinstance(vectorstore, CompressedVectorStore) and (report.added or report.removed):
+        print(f"[INFO] Vettori compressi {vectorstore.vectors}")
+    if sparse is not None:
+        sparse.save()
+    if texts is not None:
+        texts.save()
+
+    # I file saltati dal manifest contano come invariati
+    if manifest is not None:
+        for name, entry in manifest.files.items():
+            if name not in chunk_ids_by_file and name not in removed_sources:
+                report.unchanged += len(entry.chunk_ids)
+        manifest.commit(chunk_ids_by_file, dedup.duplicates_by_file if dedup else None)
+    if dedup is not None:
+        dedup.save()
+    if chunk_ids_by_file or report.added or report.removed:
+        _RESULTS.bump()
+
+    print(f"[INFO] Sync vectorstore: {report}")
+
+
+def sync_vectorstore_batches(batches: Iterable[Sequence[Document]], embeddings,
+                             manifest: Optional[IngestionManifest] = None,
+                             failed_sources: Optional[List[str]] = None,
+                             paths: Optional[IndexPaths] = None) -> Tuple[Chroma, SyncReport]:
+    """
+    Come sync_vectorstore ma consuma i chunk a batch (anche da un generatore):
+    ogni batch viene verificato per ID, embeddato e scritto prima di leggere il
+    successivo. In memoria restano solo gli ID, mai i testi già scritti.
+    I file in failed_sources non vengono ripuliti né registrati nel manifest.
+    """
+    vectorstore = _open_vectorstore(embeddings, paths)
+    report = SyncReport()
+
+    # --- 1. File spariti dal disco ---
+    sparse = open_sparse_index(vectorstore)
+    texts = open_text_store(vectorstore)
+    removed_sources = _delete_removed_sources(vectorstore, manifest, report, sparse, texts)
+
+    # --- 2. File nuovi o modificati: confronto per ID, mai per testo ---
+    seen: Dict[Tuple[str, bytes], int] = {}
+    chunk_ids_by_file: Dict[str, List[str]] = {}
+    dedup = ChunkDeduplicator(vectorstore, manifest)
+    for batch in batches:
+        batch = list(batch)
+        batch_ids = assign_chunk_ids(batch, seen)
+        for chunk in batch:
+            chunk_ids_by_file.setdefault(chunk.metadata.get("source_file", "?"), [])
+        batch, batch_ids = dedup.filter(batch, batch_ids, report)
+        for chunk, chunk_id in zip(batch, batch_ids):
+            chunk_ids_by_file[chunk.metadata.get("source_file", "?")].append(chunk_id)
+
+        present = _existing_ids(vectorstore, batch_ids, texts)
+        new_chunks = [c for c, cid in zip(batch, batch_ids) if cid not in present]
+        new_ids = [cid for cid in batch_ids if cid not in present]
+        if new_chunks:
+            vectors = embeddings.embed_documents([c.page_content for c in new_chunks])
+            _write_chunks(vectorstore, new_ids, new_chunks, vectors, sparse, texts)
+        report.added += len(new_chunks)
+        report.unchanged += len(batch) - len(new_chunks)
+
+    # --- 3. Chunk obsoleti + manifest ---
+    _finalize_sync(vectorstore, report, manifest, chunk_ids_by_file, removed_sources,
+                   failed_sources, dedup, sparse, texts)
+    return vectorstore, report
+
+
+def sync_vectorstore_pipeline(file_paths: List[str], embeddings,
+                              manifest: Optional[IngestionManifest] = None,
+                              paths: Optional[IndexPaths] = None) -> Tuple[Chroma, SyncReport]:
+    """
+    Ingestion a pipeline: load (pool di processi) -> split -> embed (thread
+    concorrenti verso Ollama) -> upsert (Chroma) girano in parallelo, collegati
+    da code limitate. Alla fine stampa throughput e profondità delle code.
+    """
+    vectorstore = _open_vectorstore(embeddings, paths)
+    report = SyncReport()
+    sparse = open_sparse_index(vectorstore)
+    texts = open_text_store(vectorstore)
+    removed_sources = _delete_removed_sources(vectorstore, manifest, report, sparse, texts)
+
+    seen: Dict[Tuple[str, bytes], int] = {}
+    chunk_ids_by_file: Dict[str, List[str]] = {}
+    failed: List[str] = []
+    splitter = _make_splitter()
+    dedup = ChunkDeduplicator(vectorstore, manifest)
+
+    def load(file_path: str):
+        _, docs, error = pool.submit(_load_file_isolated, file_path).result()
+        if error:
+            print(f"  [ERRORE] {Path(file_path).name}: {error}")
+            failed.append(Path(file_path).name)
+            return
+        yield docs
+
+    def split(docs: List[Document]):
+        # Un file alla volta, un solo worker: gli ordinali degli ID restano stabili
+        chunks = splitter.split_documents(docs)
+        for batch in _batched(chunks, EMBED_BATCH_SIZE):
+            batch_ids = assign_chunk_ids(batch, seen)
+            for chunk in batch:
+                chunk_ids_by_file.setdefault(chunk.metadata.get("source_file", "?"), [])
+            batch, batch_ids = dedup.filter(batch, batch_ids, report)
+            for chunk, chunk_id in zip(batch, batch_ids):
+                chunk_ids_by_file[chunk.metadata.get("source_file", "?")].append(chunk_id)
+            present = _existing_ids(vectorstore, batch_ids, texts)
+            report.unchanged += len(present)
+            todo = [(c, cid) for c, cid in zip(batch, batch_ids) if cid not in present]
+            if todo:
+                yield todo
+
+    def embed(todo):
+        vectors = embeddings.embed_documents([c.page_content for c, _ in todo])
+        yield todo, vectors
+
+    def upsert(item):
+        todo, vectors = item
+        _write_chunks(vectorstore, [cid for _, cid in todo], [c for c, _ in todo], vectors,
+                      sparse, texts)
+        report.added += len(todo)
+
+    workers = max(1, min(INGESTION_WORKERS, len(file_paths)))
+    pipeline = (
+        IngestionPipeline(queue_size=PIPELINE_QUEUE_SIZE)
+        .add_stage("load", load, workers=workers)
+        .add_stage("split", split)
+        .add_stage("embed", embed, workers=EMBED_WORKERS)
+        .add_stage("upsert", upsert)
+    )
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        stats = pipeline.run(file_paths)
+    print_pipeline_report(stats, time.perf_counter() - start)
+
+    _finalize_sync(vectorstore, report, manifest, chunk_ids_by_file, removed_sources, failed, dedup,
+                   sparse, texts)
+    return vectorstore, report
+
+
+def ingest(embeddings, manifest: IngestionManifest, plan: IngestionPlan,
+           paths: Optional[IndexPaths] = None) -> Tuple[Chroma, SyncReport]:
+    """
+    Carica, splitta e sincronizza i file del plan secondo INGESTION_MODE:
+      - "batch":  caricamento parallelo completo, poi chunking e sync;
+      - "stream": lazy loading pagina per pagina, embedding a batch fissi;
+      - "pipeline": stadi concorrenti collegati da code limitate.
+    paths = versione dell'indice da aggiornare (default: attiva).
+    """
+    paths = paths or active_paths()
+    if INGESTION_MODE == "pipeline":
+        vectorstore, report = sync_vectorstore_pipeline(plan.to_load, embeddings, manifest, paths)
+    elif INGESTION_MODE == "stream":
+        failed: List[str] = []
+        batches = stream_chunk_batches(plan.to_load, EMBED_BATCH_SIZE, failed)
+        vectorstore, report = sync_vectorstore_batches(batches, embeddings, manifest, failed, paths)
     else:
-        print("[INFO] Vectorstore già aggiornato.")
+        failed = []
+        documents = load_all_documents(file_paths=plan.to_load, failed=failed)
+        chunks = chunk_documents(documents)
+        vectorstore, report = sync_vectorstore(chunks, embeddings, manifest, paths, failed)
 
-    return vectorstore
+    # Indice storico (senza metadati): il modello è quello configurato finora
+    if not os.path.exists(paths.meta):
+        paths.write_meta({"embedding_model": EMBEDDING_MODEL})
+    return vectorstore, report
+
+
+def serving_embedding_model() -> str:
+    """Modello con cui è stata costruita la versione attiva dell'indice."""
+    return active_paths().read_meta().get("embedding_model", EMBEDDING_MODEL)
+
+
+def build_embeddings(model: Optional[str] = None) -> CachedEmbeddings:
+    """
+    Backend del modello indicato (default: quello della versione attiva
+    dell'indice, così le query restano coerenti finché una ricostruzione
+    con il nuovo EMBEDDING_MODEL non viene attivata), avvolto dalla cache
+    persistente condivisa: i chunk già visti (anche da altre app) non
+    vengono ri-embeddati. Le domande passano dalla cache in memoria del
+    processo, condivisa tra le sessioni e i rerun di Streamlit.
+    """
+    return embedding_backends.build_embeddings(
+        model or serving_embedding_model(),
+        max_in_flight=EMBED_MAX_IN_FLIGHT,
+        processes=EMBED_PROCESSES,
+        max_entries=EMBEDDING_CACHE_ENTRIES,
+        query_cache=shared_query_cache(QUERY_CACHE_ENTRIES, QUERY_CACHE_TTL_S, QUERY_CACHE_PATH),
+    )
+
+def validate_index(vectorstore: Chroma, manifest: IngestionManifest) -> Optional[str]:
+    """
+    Controlli su una versione appena costruita, prima dello swap:
+      - numero di chunk nel vectorstore == chunk registrati nel manifest;
+      - VALIDATION_SAMPLES chunk campione, cercati con il proprio vettore
+        salvato, devono ritrovare sé stessi nei top-5 (nessuna chiamata
+        al modello di embedding, anche per i restore da snapshot).
+    Restituisce il motivo del rifiuto, None se la versione è valida.
+    """
+    ids = [cid for entry in manifest.files.values() for cid in entry.chunk_ids]
+    total = vectorstore._collection.count()
+    if total != len(ids):
+        return f"{total} chunk nel vectorstore, {len(ids)} nel manifest"
+    if not ids:
+        return "nessun chunk indicizzato" if list_document_files() else None
+
+    sample = random.Random(0).sample(ids, min(VALIDATION_SAMPLES, len(ids)))
+    got = vectorstore.get(ids=sample, include=["embeddings"])
+    found = 0
+    for chunk_id, vector in zip(got["ids"], got["embeddings"]):
+        results = vectorstore.similarity_search_by_vector_with_relevance_scores(list(vector), k=5)
+        found += any(doc.id == chunk_id for doc, _ in results)
+    recall = found / len(sample)
+    print(f"[INFO] Validazione: {total} chunk, {found}/{len(sample)} campioni ritrovati")
+    if recall < VALIDATION_MIN_RECALL:
+        return f"recall dei campioni {recall:.0%} < {VALIDATION_MIN_RECALL:.0%}"
+    return None
+
+
+def rebuild_index(background: bool = False) -> Optional[threading.Thread]:
+    """
+    Ricostruzione blue/green: indicizza tutti i documenti con
+    EMBEDDING_MODEL in una nuova versione, la valida e la attiva con uno
+    swap atomico del puntatore. Fino allo swap le query usano la versione
+    attuale; se la validazione fallisce la nuova versione viene scartata.
+    Con background=True gira in un thread (restituito) e non blocca.
+    """
+    if REBUILD_LOCK.locked():
+        print("[INFO] Ricostruzione dell'indice già in corso.")
+        return None
+    if background:
+        thread = threading.Thread(target=rebuild_index, name="index-rebuild", daemon=True)
+        thread.start()
+        return thread
+
+    with REBUILD_LOCK:
+        versions = index_versions()
+        paths = versions.new_version()
+        print(f"[INFO] Ricostruzione blue/green in {paths.base} "
+              f"(servita intanto: {versions.active().base})...")
+        start = time.perf_counter()
+        manifest = load_manifest(paths)
+        vectorstore, report = ingest(build_embeddings(EMBEDDING_MODEL), manifest,
+                                     plan_ingestion(manifest), paths)
+        problem = validate_index(vectorstore, manifest)
+        if problem:
+            print(f"[ERRORE] Nuova versione scartata ({problem}): resta attiva {versions.active().base}")
+            _forget_side_indexes(paths)
+            paths.remove()
+            return None
+        dropped = versions.activate(paths, {
+            "embedding_model": EMBEDDING_MODEL,
+            "chunks": vectorstore._collection.count(),
+            "built_in_s": round(time.perf_counter() - start, 1),
+        })
+        for old in dropped:
+            _forget_side_indexes(old)
+        print(f"[INFO] Versione attiva: {paths.base} (rollback: "
+              f"{', '.join(p.base for p in versions.previous()) or 'nessuno'})")
+    return None
+
+
+def export_index_snapshot(path: str) -> SnapshotInfo:
+    """
+    Snapshot della versione attiva dell'indice (vettori, ID, testi,
+    metadati, manifest e modello di embedding) in un unico file.
+    """
+    paths = active_paths()
+    vectorstore = _open_vectorstore(None, paths)
+    manifest = None
+    if os.path.exists(paths.manifest):
+        with open(paths.manifest, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    return export_snapshot(vectorstore, path, meta=paths.read_meta(), manifest=manifest,
+                           dtype=SNAPSHOT_DTYPE, page_size=CHROMA_BATCH_SIZE,
+                           text_store=open_text_store(vectorstore))
+
+
+def restore_index_snapshot(path: str, sources: Optional[List[str]] = None) -> bool:
+    """
+    Cold start da snapshot: carica i chunk (tutti o solo quelli dei file
+    in sources) in una nuova versione dell'indice, insieme al manifest
+    dei file ripristinati, la valida e la attiva come rebuild_index.
+    Nessun documento viene ricaricato e nessun embedding ricalcolato.
+    """
+    reader = SnapshotReader(path)
+    with REBUILD_LOCK:
+        versions = index_versions()
+        paths = versions.new_version()
+        start = time.perf_counter()
+        model = reader.meta.get("embedding_model", EMBEDDING_MODEL)
+        vectorstore = _open_vectorstore(build_embeddings(model), paths)
+        texts = open_text_store(vectorstore)
+        try:
+            loaded = import_snapshot(reader, vectorstore, sources, batch_size=CHROMA_BATCH_SIZE,
+                                     text_store=texts)
+        except ValueError as e:
+            print(f"[ERRORE] Snapshot non ripristinato: {e}")
+            _forget_side_indexes(paths)
+            paths.remove()
+            return False
+        if isinstance(vectorstore, (NumpyVectorStore, ShardedVectorStore, CompressedVectorStore)):
+            vectorstore.persist()
+        if texts is not None:
+            texts.save()
+
+        # Manifest dei soli file ripristinati (e delle loro copie identiche)
+        manifest = IngestionManifest(paths.manifest)
+        if reader.manifest:
+            restored = set(reader.sources if sources is None else sources)
+            manifest.files = {name: FileEntry(**entry)
+                              for name, entry in reader.manifest.get("files", {}).items()
+                              if (entry.get("duplicate_of") or name) in restored}
+        manifest.save()
+        open_sparse_index(vectorstore)
+
+        problem = validate_index(vectorstore, manifest)
+        if problem:
+            print(f"[ERRORE] Snapshot scartato ({problem}): resta attiva {versions.active().base}")
+            _forget_side_indexes(paths)
+            paths.remove()
+            return False
+        elapsed = time.perf_counter() - start
+        meta = {k: v for k, v in reader.meta.items() if k != "activated"}
+        dropped = versions.activate(paths, dict(meta, embedding_model=model, chunks=loaded,
+                                                restored_from=os.path.abspath(path),
+                                                restored_in_s=round(elapsed, 2)))
+        for old in dropped:
+            _forget_side_indexes(old)
+    built = reader.meta.get("built_in_s")
+    print(f"[INFO] Snapshot ripristinato in {paths.base}: {loaded} chunk in {elapsed:.2f}s"
+          + (f" (ricostruzione completa: {built}s, {built / max(elapsed, 1e-9):.0f}x)" if built else ""))
+    return True
+
+
+def index_is_stale() -> bool:
+    """True se la versione attiva è stata costruita con un altro EMBEDDING_MODEL."""
+    active = active_paths()
+    if not active.exists() or serving_embedding_model() == EMBEDDING_MODEL:
+        return False
+    print(f"[WARN] L'indice attivo usa '{serving_embedding_model()}', configurato "
+          f"'{EMBEDDING_MODEL}': serve una ricostruzione.")
+    return True
 
 ###  QUALITY CONTROL
 
-def retrieve_and_filter(vectorstore: Chroma, query_text: str) -> List[Document]:
+# Catalogo dei file per i filtri, ricostruito solo quando il manifest cambia
+_CATALOG: Dict[str, Tuple[int, MetadataCatalog]] = {}
+
+
+def metadata_catalog(paths: Optional[IndexPaths] = None) -> MetadataCatalog:
+    path = (paths or active_paths()).manifest
+    mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else 0
+    cached = _CATALOG.get(path)
+    if cached is None or cached[0] != mtime:
+        cached = _CATALOG[path] = (mtime, MetadataCatalog(IngestionManifest.load(path)))
+    return cached[1]
+
+
+def _dense_search(vectorstore: Chroma, query_text: str, k: int,
+                  where: Optional[dict]) -> List[Tuple[Document, float]]:
+    """
+    Con RANGE_SEARCH tutti i chunk sopra SIMILARITY_THRESHOLD (entro
+    RANGE_MAX_RESULTS / RANGE_MAX_MS), altrimenti i primi k.
     """
-    Recupera i chunk più simili e scarta quelli sotto SIMILARITY_THRESHOLD.
+    if not RANGE_SEARCH:
+        kwargs = {"filter": where} if where else {}
+        return vectorstore.similarity_search_with_relevance_scores(query=query_text, k=k, **kwargs)
+    result = range_search(vectorstore, query_text, SIMILARITY_THRESHOLD,
+                          RANGE_MAX_RESULTS, RANGE_MAX_MS, where)
+    print(f"\n  [RANGE] {result}")
+    return result.hits
+
+
+def _within_files(results: List[Tuple[Document, float]], files: Optional[List[str]],
+                  allowed: Optional[Set[str]]) -> List[Tuple[Document, float]]:
+    """
+    Il where include anche i file che ospitano i chunk sopravvissuti dei
+    near-duplicate: degli altri chunk di quei file restano solo quelli ammessi.
+    """
+    if files is None:
+        return results
+    return [(doc, score) for doc, score in results
+            if doc.metadata.get("source_file") in files or doc.id in allowed]
+
+
+def retrieve_and_filter(vectorstore: Chroma, query_text: str,
+                        metadata_filter: Optional[MetadataFilter] = None) -> List[Document]:
+    """
+    Recupera i chunk più simili e scarta quelli sotto SIMILARITY_THRESHOLD
+    (con RANGE_SEARCH la soglia è applicata direttamente nella ricerca).
+    metadata_filter (file, estensione, pagine, data di ingestion) e i nomi
+    di file citati nella domanda restringono i candidati prima della ricerca.
+    Con HYBRID_RETRIEVAL la lista densa viene fusa (RRF) con quella BM25:
+    un chunk con punteggio BM25 vicino al migliore (BM25_MIN_RATIO) passa
+    il filtro anche con punteggio denso basso solo se contiene un
+    identificatore citato (nome di file, codice) o tutti i termini
+    selettivi della domanda: una parola in comune non basta.
     Stampa anche un log dei punteggi per trasparenza.
+    Il risultato resta in cache (RESULT_CACHE_ENTRIES) finché una sync non
+    scrive sull'indice: stessa domanda normalizzata, versione, filtri e
+    parametri di ricerca restituiscono i chunk senza rifare la ricerca.
     """
-    # Recupera fino a 5 candidati con punteggio
-    results_with_scores = vectorstore.similarity_search_with_relevance_scores(
-        query=query_text,
-        k=5,
-    )
+    if not RESULT_CACHE_ENTRIES:
+        return _search_and_filter(vectorstore, query_text, metadata_filter)
+    k = RANGE_MAX_RESULTS if RANGE_SEARCH else 5
+    key = _RESULTS.key(query_text, _paths_of(vectorstore).base, k, SIMILARITY_THRESHOLD,
+                       repr(metadata_filter), RANGE_SEARCH, RANGE_MAX_MS, HYBRID_RETRIEVAL,
+                       HYBRID_CANDIDATES, RRF_K, BM25_MIN_RATIO, VECTOR_COMPRESSION)
+    cached = _RESULTS.get(key)
+    if cached is not None:
+        print(f"\n  [CACHE] {len(cached)} chunk dalla cache dei risultati ({_RESULTS})\n")
+        return cached
+    docs = _search_and_filter(vectorstore, query_text, metadata_filter)
+    _RESULTS.put(key, docs)
+    return docs
 
-    # Log dei punteggi grezzi
-    print("\n  [QUALITY CONTROL] Punteggi recuperati:")
-    for doc, score in results_with_scores:
-        src  = doc.metadata.get("source_file", "?")
-        flag = "✓" if score >= SIMILARITY_THRESHOLD else "✗"
-        print(f"    {flag} score={score:.3f}  [{src}]")
 
-    # Filtra: tieni solo quelli sopra la soglia
-    filtered = [doc for doc, score in results_with_scores if score >= SIMILARITY_THRESHOLD]
+def _search_and_filter(vectorstore: Chroma, query_text: str,
+                       metadata_filter: Optional[MetadataFilter] = None) -> List[Document]:
+    """Ricerca vera e propria di retrieve_and_filter (senza cache)."""
+    # --- Pre-filtro sui metadati ---
+    catalog = metadata_catalog(_paths_of(vectorstore))
+    metadata_filter = with_detected_sources(metadata_filter, catalog, query_text)
+    files = catalog.select_files(metadata_filter)
+    where = catalog.where(metadata_filter, files)
+    if not metadata_filter.is_empty():
+        scope = f"{len(files)} file" if files is not None else "tutti i file"
+        print(f"\n  [FILTRO] {metadata_filter}  ->  {scope}")
+    if files == []:
+        print("  [QUALITY CONTROL] Nessun documento soddisfa il filtro\n")
+        return []
 
-    print(f"  [QUALITY CONTROL] Chunk passati il filtro: {len(filtered)}/{len(results_with_scores)}\n")
-    return filtered
+    # Chunk ammessi (con i sopravvissuti dei near-duplicate dei file filtrati)
+    allowed = catalog.allowed_chunk_ids(files) if files is not None else None
+
+    sparse = open_sparse_index(vectorstore)
+    if sparse is None:
+        # Recupera i candidati con punteggio (range search o fino a 5)
+        results_with_scores = _within_files(_dense_search(vectorstore, query_text, 5, where),
+                                            files, allowed)
+
+        # Log dei punteggi grezzi
+        print("\n  [QUALITY CONTROL] Punteggi recuperati:")
+        for doc, score in results_with_scores:
+            src  = doc.metadata.get("source_file", "?")
+            flag = "✓" if score >= SIMILARITY_THRESHOLD else "✗"
+            print(f"    {flag} score={score:.3f}  [{src}]")
+
+        # Filtra: tieni solo quelli sopra la soglia
+        filtered = [doc for doc, score in results_with_scores if score >= SIMILARITY_THRESHOLD]
+
+        print(f"  [QUALITY CONTROL] Chunk passati il filtro: {len(filtered)}/{len(results_with_scores)}\n")
+        return _attach_texts(vectorstore, filtered)
+
+    # --- Ibrido: candidati densi + BM25, fusi per rango ---
+    dense = _within_files(_dense_search(vectorstore, query_text, HYBRID_CANDIDATES, where),
+                          files, allowed)
+    start = time.perf_counter()
+    bm25 = sparse.search(query_text, HYBRID_CANDIDATES, allowed)
+    sparse_ms = (time.perf_counter() - start) * 1000
+
+    docs: Dict[str, Document] = {}
+    dense_scores: Dict[str, float] = {}
+    dense_ranking = []
+    for doc, score in dense:
+        docs[doc.id] = doc
+        dense_scores[doc.id] = score
+        dense_ranking.append(doc.id)
+
+    # I chunk trovati solo dal BM25 vanno letti dal vectorstore (e filtrati, es. per pagina)
+    missing = [cid for cid, _ in bm25 if cid not in docs]
+    if missing:
+        got = vectorstore.get(ids=missing, include=["documents", "metadatas"])
+        for cid, text, meta in zip(got["ids"], got["documents"], got["metadatas"]):
+            if matches_where(meta or {}, where):
+                docs[cid] = Document(page_content=text, metadata=meta or {}, id=cid)
+    bm25 = [(cid, score) for cid, score in bm25 if cid in docs]
+    bm25_floor = BM25_MIN_RATIO * bm25[0][1] if bm25 else 0.0
+    bm25_scores = dict(bm25)
+    limit = RANGE_MAX_RESULTS if RANGE_SEARCH else 5
+    fused = reciprocal_rank_fusion([dense_ranking, [cid for cid, _ in bm25]], k=RRF_K)[:limit]
+    # Il punteggio BM25 è relativo al corpus: serve anche una corrispondenza lessicale piena
+    lexical = sparse.lexical_matches(query_text, [cid for cid, _ in fused if cid in bm25_scores])
+
+    print(f"\n  [QUALITY CONTROL] Punteggi recuperati (ibrido, BM25 {sparse_ms:.1f} ms):")
+    filtered = []
+    for cid, rrf in fused:
+        dense_score = dense_scores.get(cid)
+        passed = ((dense_score is not None and dense_score >= SIMILARITY_THRESHOLD)
+                  or (cid in lexical and bm25_scores[cid] >= max(bm25_floor, 1e-9)))
+        src  = docs[cid].metadata.get("source_file", "?")
+        flag = "✓" if passed else "✗"
+        dense_txt = f"{dense_score:.3f}" if dense_score is not None else "  -  "
+        bm25_txt = f"{bm25_scores[cid]:.2f}" if cid in bm25_scores else "  -  "
+        print(f"    {flag} rrf={rrf:.4f}  score={dense_txt}  bm25={bm25_txt}  [{src}]")
+        if passed:
+            filtered.append(docs[cid])
+
+    print(f"  [QUALITY CONTROL] Chunk passati il filtro: {len(filtered)}/{len(fused)}\n")
+    return _attach_texts(vectorstore, filtered)
 
 
 
@@ -264,12 +1356,13 @@ def format_docs(docs: List[Document]) -> str:
 def build_lcel_chain(vectorstore: Chroma, llm):
     """
     Costruisce la chain RAG in pure LCEL.
-    Il recupero usa retrieve_and_filter (quality control manuale).
+    Il recupero usa retrieve_and_filter (quality control manuale);
+    l'input può contenere "filters" (MetadataFilter) per restringere i documenti.
     """
 
     # Step 1: recupera i chunk con filtro e li formatta
     retrieval_step = (
-        RunnableLambda(lambda x: retrieve_and_filter(vectorstore, x["input"]))
+        RunnableLambda(lambda x: retrieve_and_filter(vectorstore, x["input"], x.get("filters")))
         | RunnableLambda(format_docs)
     )
 
@@ -291,15 +1384,17 @@ def build_lcel_chain(vectorstore: Chroma, llm):
     return full_chain
 
 
-def query(chain, question: str, tone: str = "professionale", lingua: str = "italiano") -> str:
+def query(chain, question: str, tone: str = "professionale", lingua: str = "italiano",
+          filters: Optional[MetadataFilter] = None) -> str:
     """
-    Esegue una query sulla chain LCEL.
+    Esegue una query sulla chain LCEL, opzionalmente ristretta da filters.
     """
     try:
         return chain.invoke({
-            "input":  question,
-            "tone":   tone,
-            "lingua": lingua,
+            "input":   question,
+            "tone":    tone,
+            "lingua":  lingua,
+            "filters": filters,
         })
     except Exception as e:
         return f"[ERRORE] {e}"
@@ -307,23 +1402,22 @@ def query(chain, question: str, tone: str = "professionale", lingua: str = "ital
 
 if __name__ == "__main__":
 
-    # --- Reset opzionale ---
-    if RESET_DB:
-        reset_vectorstore()
+    # --- Ricostruzione blue/green (reset o modello cambiato) ---
+    if RESET_DB or index_is_stale():
+        rebuild_index()
 
-    # --- Embeddings (nomic-embed-text via Ollama) ---
-    print("[INFO] Inizializzazione embeddings (nomic-embed-text)...")
-    embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL)
+    # --- Embeddings (modello della versione attiva dell'indice) ---
+    print(f"[INFO] Inizializzazione embeddings ({serving_embedding_model()})...")
+    embeddings = build_embeddings()
 
-    # --- Caricamento multi-source ---
-    documents = load_all_documents()
+    # --- Manifest: solo i file nuovi o modificati ---
+    manifest = load_manifest()
+    plan = plan_ingestion(manifest)
 
-    # --- Chunking token-based ---
-    chunks = chunk_documents(documents)
-
-    # --- Sync vectorstore ---
+    # --- Caricamento multi-source + chunking token-based + sync vectorstore ---
     print("[INFO] Sincronizzazione vectorstore...")
-    vectorstore = sync_vectorstore(chunks, embeddings)
+    vectorstore, _ = ingest(embeddings, manifest, plan)
+    print(f"[INFO] Cache embedding: {embeddings}")
 
     # --- LLM ---
     llm = ChatOllama(model=LLM_MODEL, temperature=0)
@@ -359,71 +1453,83 @@ if __name__ == "__main__":
                 question="Summarize the content of cell1.docx.",
                 tone="professional",
                 lingua="english"))
+    print(f"\n[INFO] Cache domande: {embeddings.query_cache}")
+    print(f"[INFO] Cache risultati: {_RESULTS}")
 
 # ================================================================
 # AGGREGATORE DOCUMENTALE AVANZATO – STREAMLIT + LCEL
 # ================================================================
 
-import streamlit as st
-from pathlib import Path
-from typing import List
-
-
-# ================================================================
-# HEADER STREAMLIT
-# ================================================================
-st.set_page_config(page_title="Aggregatore Documentale Avanzato", layout="wide")
-st.title("📚 Aggregatore Documentale Avanzato")
-st.markdown(
-    """
-    Inserisci una domanda, scegli il tono e la lingua della risposta.
-    L'aggregatore cercherà tra i documenti caricati nella knowledge base.
-    """
-)
-
-# ================================================================
-# INPUT UTENTE
-# ================================================================
-user_query = st.text_area("✏️ Domanda:", height=100)
-user_tone = st.selectbox("🎨 Tono della risposta:", ["professionale", "amichevole", "tecnico"])
-user_lang = st.selectbox("🌐 Lingua della risposta:", ["italiano", "english", "español"])
-
-# ================================================================
-# BOTTONI
-# ================================================================
-if st.button("Genera Risposta"):
-    with st.spinner("Caricamento e generazione risposta..."):
-        # --- Reset opzionale vectorstore ---
-        if RESET_DB:
-            reset_vectorstore()
-
-        # --- Embeddings ---
-        embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL)
-
-        # --- Caricamento documenti ---
-        documents = load_all_documents()
-        if not documents:
-            st.warning("📂 Nessun documento trovato. Inserisci file in ./data")
-        else:
-            # --- Chunking ---
-            chunks = chunk_documents(documents)
-
-            # --- Sync vectorstore ---
-            vectorstore = sync_vectorstore(chunks, embeddings)
-
-            # --- LLM ---
-            llm = ChatOllama(model=LLM_MODEL, temperature=0)
+# Solo quando eseguito come script (python rag.py / streamlit run rag.py):
+# importare rag da altri moduli (es. i benchmark) non avvia la UI.
+if __name__ == "__main__":
 
-            # --- Chain LCEL ---
-            rag_chain = build_lcel_chain(vectorstore, llm)
+    import streamlit as st
+    from pathlib import Path
+    from typing import List
+
+
+    # ================================================================
+    # HEADER STREAMLIT
+    # ================================================================
+    st.set_page_config(page_title="Aggregatore Documentale Avanzato", layout="wide")
+    st.title("📚 Aggregatore Documentale Avanzato")
+    st.markdown(
+        """
+        Inserisci una domanda, scegli il tono e la lingua della risposta.
+        L'aggregatore cercherà tra i documenti caricati nella knowledge base.
+        """
+    )
 
-            # --- Query ---
-            risposta = query(rag_chain, user_query, tone=user_tone, lingua=user_lang)
-            st.markdown("### ✅ Risposta generata:")
-            st.write(risposta)
+    # ================================================================
+    # INPUT UTENTE
+    # ================================================================
+    user_query = st.text_area("✏️ Domanda:", height=100)
+    user_tone = st.selectbox("🎨 Tono della risposta:", ["professionale", "amichevole", "tecnico"])
+    user_lang = st.selectbox("🌐 Lingua della risposta:", ["italiano", "english", "español"])
+    user_files = st.multiselect(
+        "📄 Limita ai documenti (vuoto = tutti; i file citati nella domanda vengono riconosciuti):",
+        [Path(p).name for p in list_document_files()],
+    )
 
-# ================================================================
-# FOOTER
-# ================================================================
-st.markdown("---")
-st.markdown("Aggregatore Documentale Avanzato – LCEL + LangChain + Ollama + ChromaDB")
+    # ================================================================
+    # BOTTONI
+    # ================================================================
+    if st.button("Genera Risposta"):
+        with st.spinner("Caricamento e generazione risposta..."):
+            # --- Ricostruzione blue/green in background: fino allo swap
+            #     si continua a rispondere con la versione attuale ---
+            if RESET_DB or index_is_stale():
+                if rebuild_index(background=True):
+                    st.info("🔄 Ricostruzione dell'indice avviata in background.")
+
+            # --- Embeddings ---
+            embeddings = build_embeddings()
+
+            # --- Manifest: i file invariati non vengono ricaricati ---
+            manifest = load_manifest()
+            plan = plan_ingestion(manifest)
+            if not plan.to_load and not plan.unchanged:
+                st.warning("📂 Nessun documento trovato. Inserisci file in ./data")
+            else:
+                # --- Caricamento documenti + chunking + sync vectorstore ---
+                vectorstore, _ = ingest(embeddings, manifest, plan)
+
+                # --- LLM ---
+                llm = ChatOllama(model=LLM_MODEL, temperature=0)
+
+                # --- Chain LCEL ---
+                rag_chain = build_lcel_chain(vectorstore, llm)
+
+                # --- Query ---
+                risposta = query(rag_chain, user_query, tone=user_tone, lingua=user_lang,
+                                 filters=MetadataFilter(sources=user_files))
+                st.markdown("### ✅ Risposta generata:")
+                st.write(risposta)
+                st.caption(f"Cache domande: {embeddings.query_cache}  \nCache risultati: {_RESULTS}")
+
+    # ================================================================
+    # FOOTER
+    # ================================================================
+    st.markdown("---")
+    st.markdown("Aggregatore Documentale Avanzato – LCEL + LangChain + Ollama + ChromaDB")
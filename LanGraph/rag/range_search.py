@@ -0,0 +1,193 @@
+# ================================================================
+# RANGE SEARCH  –  tutti i chunk sopra la soglia, con tetti
+# ================================================================
+# "k=5 e poi soglia" restituisce 5 chunk anche se i rilevanti sono
+# 40, e paga 5 candidati (e il loro log) anche quando nessuno supera
+# la soglia. La range search restituisce ogni chunk con punteggio
+# >= min_score, entro un tetto sul numero (max_results) e sul tempo
+# (max_ms):
+#
+#   NumpyVectorStore   scansione a blocchi nativa: confronta la
+#                      soglia blocco per blocco e si ferma alla
+#                      scadenza del tempo (range_search_by_vector)
+#   Chroma / indice    ricerca top-k con k crescente (x4 per giro):
+#   compresso o IVF    si ferma appena l'ultimo risultato scende
+#                      sotto la soglia, la collection è esaurita,
+#                      si raggiunge il tetto o scade il tempo
+#
+# L'embedding della domanda si calcola una sola volta per tutti i giri.
+#
+# Benchmark (da LanGraph/rag):  python range_search.py --chunks 50000
+# ================================================================
+
+import argparse
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+from numpy_store import similarity_for_relevance
+
+START_K = 8          # primo giro della ricerca a k crescente
+GROWTH = 4           # fattore di crescita di k tra un giro e l'altro
+
+
+@dataclass
+class RangeResult:
+    """Esito di una range search: hit in ordine di punteggio decrescente"""
+    hits: List[Tuple[Document, float]] = field(default_factory=list)
+    min_score: float = 0.0
+    stop: str = "soglia"     # soglia | completa | esaurita | limite | tempo
+    elapsed_ms: float = 0.0
+    scanned: int = 0         # k dell'ultimo giro, o righe confrontate (scansione nativa)
+    rounds: int = 0
+
+    def __str__(self) -> str:
+        how = (f"{self.scanned} righe confrontate" if self.rounds == 0
+               else f"{self.rounds} giri, k finale={self.scanned}")
+        return (f"{len(self.hits)} chunk con score >= {self.min_score:.2f} in "
+                f"{self.elapsed_ms:.1f} ms ({how}, stop: {self.stop})")
+
+
+def _native_range(vectorstore, query_vector: Sequence[float], min_score: float,
+                  max_results: int, deadline: float,
+                  filter: Optional[Dict[str, Any]]) -> RangeResult:
+    relevance = vectorstore._select_relevance_score_fn()
+    # Il NumpyVectorStore lavora in similarità coseno: soglia convertita dalla scala di rilevanza
+    hits, stop, scanned = vectorstore.range_search_by_vector(
+        query_vector, similarity_for_relevance(min_score), max_results, deadline, filter)
+    got = vectorstore.get(ids=[doc_id for doc_id, _ in hits], include=["documents", "metadatas"])
+    docs = {doc_id: Document(page_content=text, metadata=meta or {}, id=doc_id)
+            for doc_id, text, meta in zip(got["ids"], got["documents"], got["metadatas"])}
+    return RangeResult(hits=[(docs[doc_id], relevance(dist)) for doc_id, dist in hits],
+                       min_score=min_score, stop=stop, scanned=scanned)
+
+
+def _expanding_range(vectorstore, query_vector: Sequence[float], min_score: float,
+                     max_results: int, deadline: float,
+                     filter: Optional[Dict[str, Any]]) -> RangeResult:
+    relevance = vectorstore._select_relevance_score_fn()
+    kwargs = {"filter": filter} if filter else {}
+    k, rounds = min(START_K, max_results + 1), 0
+    while True:
+        rounds += 1
+        results = vectorstore.similarity_search_by_vector_with_relevance_scores(
+            query_vector, k=k, **kwargs)
+        scored = [(doc, relevance(dist)) for doc, dist in results]
+        hits = [(doc, score) for doc, score in scored if score >= min_score]
+        if len(scored) < k:
+            stop = "esaurita"
+        elif scored[-1][1] < min_score:
+            stop = "soglia"
+        elif len(hits) > max_results:
+            stop = "limite"
+        elif time.perf_counter() > deadline:
+            stop = "tempo"
+        else:
+            k = min(k * GROWTH, max_results + 1)
+            continue
+        hits.sort(key=lambda hit: hit[1], reverse=True)
+        if len(hits) > max_results:
+            hits = hits[:max_results]
+            stop = "tempo" if stop == "tempo" else "limite"
+        return RangeResult(hits=hits, min_score=min_score, stop=stop, scanned=k, rounds=rounds)
+
+
+def range_search(vectorstore, query: str, min_score: float, max_results: int = 20,
+                 max_ms: Optional[float] = None,
+                 filter: Optional[Dict[str, Any]] = None) -> RangeResult:
+    """
+    Chunk con punteggio di rilevanza >= min_score (al più max_results,
+    i migliori). Con max_ms la ricerca si ferma alla scadenza e
+    restituisce i migliori trovati fino a quel momento (stop="tempo").
+    """
+    start = time.perf_counter()
+    deadline = start + max_ms / 1000 if max_ms is not None else float("inf")
+    query_vector = vectorstore.embeddings.embed_query(query)
+    search = _native_range if hasattr(vectorstore, "range_search_by_vector") else _expanding_range
+    result = search(vectorstore, query_vector, min_score, max_results, deadline, filter)
+    result.elapsed_ms = (time.perf_counter() - start) * 1000
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Range search vs top-5 + soglia")
+    parser.add_argument("--chunks", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--min-score", type=float, default=0.6)
+    parser.add_argument("--max-results", type=int, default=40)
+    parser.add_argument("--queries", type=int, default=50)
+    args = parser.parse_args()
+
+    import tempfile
+    import warnings
+
+    import numpy as np
+    from langchain_chroma import Chroma
+    from langchain_core.embeddings import Embeddings
+
+    from numpy_store import NumpyVectorStore
+
+    class _Fixed(Embeddings):
+        """Testo "q<i>" -> vettore i-esimo precalcolato (query e documenti)."""
+        def __init__(self, vectors):
+            self.vectors = vectors
+
+        def embed_documents(self, texts):
+            return [self.embed_query(text) for text in texts]
+
+        def embed_query(self, text):
+            return self.vectors[int(text[1:])].tolist()
+
+    # Argomenti a grappolo: ogni domanda ha un numero variabile di chunk rilevanti
+    rng = np.random.default_rng(0)
+    topics = rng.normal(size=(200, args.dim)).astype(np.float32)
+    sizes = rng.zipf(1.6, size=len(topics)).clip(1, 400)
+    members = np.repeat(np.arange(len(topics)), sizes)[:args.chunks]
+    vectors = np.vstack([                    # chunk sugli argomenti + chunk non correlati
+        topics[members] + 0.9 * rng.normal(size=(len(members), args.dim)),
+        rng.normal(size=(args.chunks - len(members), args.dim)),
+    ]).astype(np.float32)
+    members = np.concatenate([members, np.full(args.chunks - len(members), -1)])
+    queries = topics[rng.integers(0, len(topics), args.queries)]
+    queries += 0.3 * rng.normal(size=queries.shape).astype(np.float32)
+    # Embedding normalizzati come quelli di Ollama / sentence-transformers: punteggi
+    # uguali tra numpy e Chroma (spazio l2 di default, come in rag.py)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    embedding = _Fixed(queries)
+    ids = [f"c{i}" for i in range(args.chunks)]
+    metas = [{"source_file": f"doc{m}.pdf"} for m in members]
+
+    # Scala l2 di Chroma: i chunk lontani hanno rilevanza negativa (LangChain avvisa)
+    warnings.filterwarnings("ignore", message="Relevance scores must be between 0 and 1")
+    with tempfile.TemporaryDirectory() as workdir:
+        stores = {
+            "numpy": NumpyVectorStore("bench", embedding, workdir),
+            "chroma": Chroma("bench", embedding_function=embedding, persist_directory=workdir),
+        }
+        for store in stores.values():
+            for s in range(0, args.chunks, 5000):
+                store._collection.upsert(ids=ids[s:s + 5000], embeddings=vectors[s:s + 5000].tolist(),
+                                         metadatas=metas[s:s + 5000], documents=ids[s:s + 5000])
+        stores["numpy"].persist()
+
+        print(f"\n[BENCH] {args.chunks} chunk x {args.dim}d, {args.queries} query, "
+              f"soglia={args.min_score}, tetto={args.max_results}")
+        print(f"  {'store':>7} {'modo':>12} {'hit medi':>9} {'hit max':>8} {'p50 ms':>7} {'p95 ms':>7}")
+        for name, store in stores.items():
+            for mode in ("top5+soglia", "range"):
+                counts, latencies = [], []
+                for i in range(args.queries):
+                    start = time.perf_counter()
+                    if mode == "range":
+                        hits = range_search(store, f"q{i}", args.min_score, args.max_results).hits
+                    else:
+                        hits = [h for h in store.similarity_search_with_relevance_scores(f"q{i}", k=5)
+                                if h[1] >= args.min_score]
+                    latencies.append((time.perf_counter() - start) * 1000)
+                    counts.append(len(hits))
+                latencies.sort()
+                print(f"  {name:>7} {mode:>12} {np.mean(counts):>9.1f} {max(counts):>8} "
+                      f"{latencies[len(latencies) // 2]:>7.2f} {latencies[int(0.95 * len(latencies))]:>7.2f}")
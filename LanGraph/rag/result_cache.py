@@ -0,0 +1,98 @@
+# ================================================================
+# CACHE DEI RISULTATI DI RETRIEVAL  –  LRU per generazione dell'indice
+# ================================================================
+# Domande identiche sulla stessa collection ripetono tutta la
+# ricerca (densa, BM25, fusione, filtri). Qui il risultato finale
+# viene conservato con chiave:
+#
+#   (generazione, domanda normalizzata, k / soglia / filtri / config)
+#
+# La generazione è un contatore incrementato da ogni scrittura
+# sull'indice (sync con chunk aggiunti o rimossi, inizializzazione
+# del vectorstore, reset): le chiavi vecchie non sono più
+# raggiungibili, quindi un risultato in cache non è mai stale.
+# Un retrieval iniziato prima di una scrittura non rientra in cache
+# (la sua chiave ha la generazione precedente).
+#
+# Eviction LRU oltre max_entries; lock unico, così le sessioni
+# Streamlit concorrenti condividono la cache senza corrompere
+# l'ordine LRU. I Document vengono copiati in uscita: chi li
+# modifica non altera la cache.
+# ================================================================
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+
+from query_cache import normalize_query
+
+DEFAULT_MAX_ENTRIES = 256
+
+
+def _copy(docs: Sequence[Document]) -> List[Document]:
+    return [Document(page_content=d.page_content, metadata=dict(d.metadata), id=d.id) for d in docs]
+
+
+class RetrievalCache:
+    """Risultati di retrieval per (generazione dell'indice, domanda, parametri)"""
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple, List[Document]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def key(self, query: str, *params: Hashable) -> Tuple:
+        """Chiave per la generazione corrente (params: k, soglia, filtri, ...)."""
+        return (self.generation, normalize_query(query)) + params
+
+    def get(self, key: Tuple) -> Optional[List[Document]]:
+        with self._lock:
+            docs = self._entries.get(key)
+            if docs is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return _copy(docs)
+
+    def put(self, key: Tuple, docs: Sequence[Document]) -> None:
+        with self._lock:
+            if self.max_entries <= 0 or key[0] != self.generation:
+                return          # indice cambiato durante il retrieval
+            self._entries[key] = _copy(docs)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def bump(self) -> int:
+        """Nuova generazione dell'indice: i risultati precedenti vengono scartati."""
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            return self.generation
+
+    # --- Metriche ---
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+                "generation": self.generation,
+            }
+
+    def __str__(self) -> str:
+        s = self.stats()
+        return (f"hit={s['hits']}  miss={s['misses']}  hit_rate={s['hit_rate']:.1%}  "
+                f"voci={s['entries']}  generazione={s['generation']}")
@@ -0,0 +1,337 @@
+# ================================================================
+# VECTORSTORE SHARDED  –  partizionamento per hash + scatter-gather
+# ================================================================
+# Una sola collection in una sola directory lega indice, scritture e
+# ricerca a un processo e a un disco. Qui i chunk sono distribuiti
+# su N shard (collection Chroma o NumpyVectorStore, ognuna nella sua
+# directory, anche su dischi diversi):
+#
+#   shard(ID) = crc32(ID) mod N       stabile: lo stesso chunk finisce
+#                                     sempre nello stesso shard
+#   scritture                         raggruppate per shard, in parallelo
+#   ricerca                           la query va a tutti gli shard in
+#                                     parallelo (thread: HNSW e numpy
+#                                     rilasciano il GIL), i top-k parziali
+#                                     ordinati si fondono con un heap
+#
+# Ogni shard si ricostruisce da solo (rebuild_shard) senza toccare
+# gli altri. Il numero di shard è registrato in shards.json: cambiarlo
+# richiede un reset del vectorstore.
+#
+# Espone lo stesso sottoinsieme di Chroma usato nel progetto
+# (get/delete/upsert/count/_collection), come NumpyVectorStore.
+#
+# Benchmark (da LanGraph/rag):
+#   python sharded_store.py --vectors 100000 --shards 1 2 4 8
+# ================================================================
+
+import argparse
+import heapq
+import itertools
+import json
+import os
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+SHARDS_FILE = "shards.json"
+
+
+def shard_of(doc_id: str, n_shards: int) -> int:
+    return zlib.crc32(doc_id.encode("utf-8")) % n_shards
+
+
+class ShardedVectorStore(VectorStore):
+    """
+    N vectorstore con la stessa interfaccia (Chroma o NumpyVectorStore)
+    visti come uno solo. 'directory' (opzionale) ospita shards.json.
+    """
+
+    def __init__(self, shards: Sequence[VectorStore], directory: Optional[str] = None):
+        if not shards:
+            raise ValueError("Serve almeno uno shard")
+        self.shards = list(shards)
+        self.directory = directory
+        self._pool = ThreadPoolExecutor(max_workers=len(self.shards), thread_name_prefix="shard")
+        if directory:
+            self._check_layout()
+
+    def _check_layout(self) -> None:
+        path = os.path.join(self.directory, SHARDS_FILE)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                stored = json.load(f)["shards"]
+            if stored != len(self.shards):
+                raise ValueError(f"Il vectorstore in '{self.directory}' ha {stored} shard, "
+                                 f"configurati {len(self.shards)}: serve un reset (RESET_DB)")
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"shards": len(self.shards)}, f)
+
+    def _map(self, fn: Callable, items: Iterable) -> List[Any]:
+        """Esegue fn su ogni elemento in parallelo (un thread per shard)."""
+        return list(self._pool.map(fn, items))
+
+    def _group(self, ids: Sequence[str]) -> Dict[int, List[int]]:
+        """Shard -> posizioni degli ID che gli appartengono."""
+        groups: Dict[int, List[int]] = {}
+        for pos, doc_id in enumerate(ids):
+            groups.setdefault(shard_of(doc_id, len(self.shards)), []).append(pos)
+        return groups
+
+    # --- Interfaccia stile Chroma ---
+
+    @property
+    def _collection(self) -> "ShardedVectorStore":
+        return self
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        """Metrica della collection (chroma_space), uguale per tutti gli shard."""
+        return self.shards[0]._collection.metadata or {}
+
+    @property
+    def configuration(self) -> Dict[str, Any]:
+        return getattr(self.shards[0]._collection, "configuration", None) or {}
+
+    def count(self) -> int:
+        return sum(self._map(lambda s: s._collection.count(), self.shards))
+
+    def upsert(self, ids: Sequence[str], embeddings: Sequence[Sequence[float]],
+               metadatas: Optional[Sequence[Optional[Dict[str, Any]]]] = None,
+               documents: Optional[Sequence[str]] = None) -> None:
+        def write(item):
+            shard, positions = item
+            self.shards[shard]._collection.upsert(
+                ids=[ids[p] for p in positions],
+                embeddings=[embeddings[p] for p in positions],
+                metadatas=[metadatas[p] for p in positions] if metadatas else None,
+                documents=[documents[p] for p in positions] if documents else None,
+            )
+        self._map(write, self._group(ids).items())
+
+    def get(self, ids: Optional[Sequence[str]] = None, where: Optional[Dict[str, Any]] = None,
+            limit: Optional[int] = None, offset: Optional[int] = None,
+            include: Sequence[str] = ("documents", "metadatas"), **kwargs) -> Dict[str, Any]:
+        """
+        Con ids: ogni ID viene chiesto solo al suo shard. Senza: gli shard
+        vengono letti in ordine, con limit/offset applicati sul totale.
+        """
+        include = list(include)
+        fields = [f for f in ("documents", "metadatas", "embeddings") if f in include]
+        result: Dict[str, Any] = {"ids": [], "documents": None, "metadatas": None, "embeddings": None}
+        for f in fields:
+            result[f] = []
+
+        def merge(page: Dict[str, Any]) -> None:
+            result["ids"].extend(page["ids"])
+            for f in fields:
+                result[f].extend(list(page[f]) if page[f] is not None else [])
+
+        if ids is not None:
+            if isinstance(ids, str):
+                ids = [ids]
+            groups = self._group(ids)
+            pages = self._map(lambda item: self.shards[item[0]]._collection.get(
+                ids=[ids[p] for p in item[1]], where=where, include=include), groups.items())
+            for page in pages:
+                merge(page)
+            return result
+
+        skip, remaining = offset or 0, limit
+        for shard in self.shards:
+            if remaining is not None and remaining <= 0:
+                break
+            if where is None:
+                n = shard._collection.count()
+                if skip >= n:
+                    skip -= n
+                    continue
+                page = shard._collection.get(limit=remaining, offset=skip, include=include)
+                skip = 0
+            else:
+                matching = shard._collection.get(where=where, include=[])["ids"]
+                if skip >= len(matching):
+                    skip -= len(matching)
+                    continue
+                selected = matching[skip:skip + remaining if remaining is not None else None]
+                skip = 0
+                page = shard._collection.get(ids=selected, include=include)
+            merge(page)
+            if remaining is not None:
+                remaining -= len(page["ids"])
+        return result
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> None:
+        ids = list(ids or [])
+        self._map(lambda item: self.shards[item[0]].delete(ids=[ids[p] for p in item[1]]),
+                  self._group(ids).items())
+
+    def persist(self) -> None:
+        """Scrive gli shard che tengono le modifiche in RAM (NumpyVectorStore)."""
+        self._map(lambda s: s.persist() if hasattr(s, "persist") else None, self.shards)
+
+    def rebuild_shard(self, shard: int, ids: Sequence[str], embeddings: Sequence[Sequence[float]],
+                      metadatas: Sequence[Dict[str, Any]], documents: Sequence[str]) -> int:
+        """
+        Svuota lo shard e lo ripopola con i chunk già embeddati che gli
+        appartengono (gli altri vengono ignorati), con upsert sugli ID dati
+        come nelle scritture della sync. Gli altri shard restano interrogabili.
+        """
+        store = self.shards[shard]
+        old = store._collection.get(include=[])["ids"]
+        for start in range(0, len(old), 5000):
+            store.delete(ids=old[start:start + 5000])
+        mine = [p for p, doc_id in enumerate(ids) if shard_of(doc_id, len(self.shards)) == shard]
+        for start in range(0, len(mine), 5000):
+            batch = mine[start:start + 5000]
+            store._collection.upsert(
+                ids=[ids[p] for p in batch],
+                embeddings=[embeddings[p] for p in batch],
+                metadatas=[metadatas[p] for p in batch],
+                documents=[documents[p] for p in batch],
+            )
+        if hasattr(store, "persist"):
+            store.persist()
+        return len(mine)
+
+    # --- Interfaccia VectorStore ---
+
+    @property
+    def embeddings(self) -> Optional[Embeddings]:
+        return self.shards[0].embeddings
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        if ids is None:
+            raise ValueError("ShardedVectorStore richiede ID espliciti (determinano lo shard)")
+        # Embedding una volta sola per tutto il batch, poi scritture per shard
+        vectors = self.embeddings.embed_documents(texts)
+        self.upsert(ids, vectors, metadatas or [{} for _ in texts], texts)
+        return list(ids)
+
+    def similarity_search_by_vector_with_relevance_scores(self, embedding: Sequence[float], k: int = 4,
+                                                          filter: Optional[Dict[str, Any]] = None,
+                                                          **kwargs: Any) -> List[Tuple[Document, float]]:
+        """
+        Scatter-gather: top-k di ogni shard in parallelo, poi fusione delle
+        liste (già ordinate per distanza crescente) con un heap.
+        """
+        partial = self._map(
+            lambda s: s.similarity_search_by_vector_with_relevance_scores(
+                embedding, k=k, filter=filter, **kwargs),
+            self.shards)
+        return list(itertools.islice(heapq.merge(*partial, key=lambda hit: hit[1]), k))
+
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     filter: Optional[Dict[str, Any]] = None,
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        """(documento, distanza) come Chroma: l'embedding della query si calcola una volta."""
+        return self.similarity_search_by_vector_with_relevance_scores(
+            self.embeddings.embed_query(query), k, filter, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4,
+                          filter: Optional[Dict[str, Any]] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter, **kwargs)]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[Dict[str, Any]] = None,
+                                    **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in
+                self.similarity_search_by_vector_with_relevance_scores(embedding, k, filter, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        return self.shards[0]._select_relevance_score_fn()
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings,
+                   metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None,
+                   n_shards: int = 2, directory: Optional[str] = None,
+                   shard_class: Optional[Callable[..., VectorStore]] = None,
+                   collection_name: str = "langchain", **kwargs: Any) -> "ShardedVectorStore":
+        """
+        Crea n_shards shard di shard_class (default Chroma; anche NumpyVectorStore)
+        in directory/shard_<i> e vi distribuisce i testi con add_texts.
+        Senza directory gli shard restano in memoria; senza ids gli ID sono casuali.
+        """
+        if shard_class is None:
+            from langchain_chroma import Chroma
+            shard_class = Chroma
+        shards = [
+            shard_class(
+                # Le collection Chroma in memoria sono condivise per nome: uno per shard
+                collection_name=collection_name if directory else f"{collection_name}_{i}",
+                embedding_function=embedding,
+                persist_directory=os.path.join(directory, f"shard_{i}") if directory else None,
+                **kwargs,
+            )
+            for i in range(n_shards)
+        ]
+        store = cls(shards, directory)
+        store.add_texts(texts, metadatas, ids=ids or [uuid.uuid4().hex for _ in texts])
+        store.persist()
+        return store
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latenza e throughput al crescere degli shard")
+    parser.add_argument("--vectors", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--backend", choices=["chroma", "numpy"], default="chroma")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    import tempfile
+
+    import numpy as np
+    from langchain_chroma import Chroma
+
+    from numpy_store import NumpyVectorStore
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((args.vectors, args.dim)).astype(np.float32)
+    ids = [f"{i:032x}" for i in range(args.vectors)]
+    texts = [f"chunk {i}" for i in range(args.vectors)]
+    metas = [{"source_file": f"doc{i % 50}.pdf"} for i in range(args.vectors)]
+    queries = vectors[rng.choice(args.vectors, args.queries)] + \
+        0.1 * rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+
+    def open_shard(directory: str) -> VectorStore:
+        if args.backend == "numpy":
+            return NumpyVectorStore("bench", persist_directory=directory)
+        return Chroma("bench", persist_directory=directory, collection_metadata={"hnsw:space": "cosine"})
+
+    print(f"\n[BENCH] {args.vectors} vettori x {args.dim} dim, backend={args.backend}, "
+          f"{args.queries} query, k={args.k}")
+    print(f"  {'shard':>5} {'ingestion vett/s':>16} {'p50 ms':>8} {'p95 ms':>8}")
+    for n in args.shards:
+        with tempfile.TemporaryDirectory() as workdir:
+            store = ShardedVectorStore([open_shard(os.path.join(workdir, f"shard_{i}")) for i in range(n)],
+                                       workdir)
+            start = time.perf_counter()
+            for s in range(0, args.vectors, 5000):
+                store.upsert(ids[s:s + 5000], vectors[s:s + 5000], metas[s:s + 5000], texts[s:s + 5000])
+            store.persist()
+            ingest = args.vectors / (time.perf_counter() - start)
+
+            store.similarity_search_by_vector(queries[0].tolist(), k=args.k)     # caricamento indici
+            latencies = []
+            for q in queries:
+                start = time.perf_counter()
+                store.similarity_search_by_vector_with_relevance_scores(q.tolist(), k=args.k)
+                latencies.append((time.perf_counter() - start) * 1000)
+            latencies.sort()
+            print(f"  {n:>5} {ingest:>16.0f} {latencies[len(latencies) // 2]:>8.2f} "
+                  f"{latencies[int(0.95 * len(latencies))]:>8.2f}")
@@ -0,0 +1,6 @@
+# I moduli di LanGraph/rag sono piatti (nessun package): i test li importano
+# come fa rag.py, con la directory del progetto nel path.
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
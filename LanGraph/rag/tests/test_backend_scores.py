@@ -0,0 +1,73 @@
+# Stessa SIMILARITY_THRESHOLD, stessi chunk: i punteggi di rilevanza del
+# backend numpy devono stare sulla scala della collection Chroma di rag.py.
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+
+import rag
+from range_search import range_search
+
+DIM = 32
+CHUNKS = 300
+QUERIES = 20
+
+
+class _Fixed(Embeddings):
+    """Testo "q<i>" -> i-esimo vettore di query (normalizzato come quelli di Ollama)."""
+
+    def __init__(self, queries: np.ndarray):
+        self.queries = queries
+
+    def embed_documents(self, texts):
+        return [self.embed_query(t) for t in texts]
+
+    def embed_query(self, text):
+        return self.queries[int(text[1:])].tolist()
+
+
+def _unit(x: np.ndarray) -> np.ndarray:
+    return x / np.linalg.norm(x, axis=-1, keepdims=True)
+
+
+@pytest.fixture(scope="module")
+def stores(tmp_path_factory):
+    rng = np.random.default_rng(0)
+    topics = rng.normal(size=(10, DIM))
+    vectors = _unit(topics[rng.integers(0, 10, CHUNKS)] + 0.8 * rng.normal(size=(CHUNKS, DIM)))
+    queries = _unit(topics[rng.integers(0, 10, QUERIES)] + 0.3 * rng.normal(size=(QUERIES, DIM)))
+    embedding = _Fixed(queries.astype(np.float32))
+    ids = [f"c{i}" for i in range(CHUNKS)]
+    metas = [{"source_file": f"doc{i % 7}.pdf"} for i in range(CHUNKS)]
+
+    opened = {}
+    with pytest.MonkeyPatch.context() as mp:     # VECTOR_BACKEND ripristinato per i test successivi
+        for backend in ("chroma", "numpy"):
+            mp.setattr(rag, "VECTOR_BACKEND", backend)
+            store = rag._open_collection(embedding, str(tmp_path_factory.mktemp(backend)))
+            store._collection.upsert(ids=ids, embeddings=vectors.astype(np.float32).tolist(),
+                                     metadatas=metas, documents=ids)
+            opened[backend] = store
+    opened["numpy"].persist()
+    return opened
+
+
+# Scala l2: i chunk lontani hanno rilevanza negativa e LangChain lo segnala
+@pytest.mark.filterwarnings("ignore:Relevance scores must be between 0 and 1")
+@pytest.mark.parametrize("threshold", [0.3, 0.5])
+def test_same_hits_above_threshold(stores, threshold):
+    for i in range(QUERIES):
+        hits = {}
+        for backend, store in stores.items():
+            scored = store.similarity_search_with_relevance_scores(f"q{i}", k=CHUNKS)
+            hits[backend] = {doc.id: score for doc, score in scored if score >= threshold}
+        assert set(hits["numpy"]) == set(hits["chroma"])
+        for doc_id, score in hits["numpy"].items():
+            assert score == pytest.approx(hits["chroma"][doc_id], abs=1e-4)
+
+
+def test_range_search_same_hits(stores):
+    for i in range(QUERIES):
+        found = {backend: {doc.id for doc, _ in range_search(store, f"q{i}", 0.4, CHUNKS).hits}
+                 for backend, store in stores.items()}
+        assert found["numpy"] == found["chroma"]
@@ -0,0 +1,54 @@
+# Vettori compressi fuori dall'HNSW: aggiunte e cancellazioni incrementali
+# sul modello già addestrato, rescoring dai vettori full-precision su disco.
+
+import numpy as np
+import pytest
+
+import compressed_store
+from compressed_store import CompressedVectors
+
+DIM = 48
+
+
+def _vectors(rng, n):
+    basis = np.random.default_rng(0).standard_normal((8, DIM))
+    return (rng.standard_normal((n, 8)) @ basis + 0.1 * rng.standard_normal((n, DIM))).astype(np.float32)
+
+
+@pytest.mark.parametrize("spec", ["pca16-int8", "ivf-pq8"])
+def test_incremental_updates_keep_the_model(tmp_path, monkeypatch, spec):
+    monkeypatch.setattr(compressed_store, "FLUSH_ROWS", 256)
+    rng = np.random.default_rng(1)
+    first = _vectors(rng, 1000)
+    store = CompressedVectors(str(tmp_path), spec)
+    store.add([f"a{i}" for i in range(1000)], first)
+    store.save()
+    model_generation = store._codes_gen
+
+    added = _vectors(rng, 100)
+    store.add([f"b{i}" for i in range(100)], added)
+    store.remove([f"a{i}" for i in range(50)])
+    store.save()
+    # Nessun riaddestramento: righe nuove in coda, cancellate come tombstone
+    assert store._codes_gen == model_generation
+    assert store.count == 1100 and len(store) == 1050
+
+    reopened = CompressedVectors(str(tmp_path), spec)
+    assert len(reopened) == 1050
+    for i in range(0, 100, 10):
+        assert reopened.search(added[i], 5, 50)[0][0] == f"b{i}"
+    hits = reopened.search(first[3], 10, 50)
+    assert hits[0][0] != "a3" and all(doc_id not in {f"a{i}" for i in range(50)} for doc_id, _ in hits)
+
+
+def test_compaction_drops_deleted_rows(tmp_path):
+    rng = np.random.default_rng(2)
+    vectors = _vectors(rng, 400)
+    store = CompressedVectors(str(tmp_path), "int8")
+    store.add([f"c{i}" for i in range(400)], vectors)
+    store.save()
+    store.remove([f"c{i}" for i in range(200)])
+    store.save()
+    assert store.count == 200
+    assert np.allclose(store.vectors(["c250"])[0], vectors[250])
+    assert store.search(vectors[250], 1, 20, allowed=["c250", "c300"])[0][0] == "c250"
@@ -0,0 +1,63 @@
+# Retrieval ibrido: il BM25 fa passare un chunk sotto soglia densa solo con
+# una corrispondenza lessicale piena, non per una parola in comune.
+
+import hashlib
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+
+import rag
+from index_versions import IndexPaths
+
+CHUNKS = [
+    "Il tempo di risposta del sistema resta sotto i 200 ms con la cache attiva.",
+    "Il codice prodotto ZX-4471 identifica il modulo di acquisizione dati.",
+    "La pipeline di ingestion carica i PDF, li divide in chunk e li indicizza.",
+    "Il manifest registra hash, dimensione e data di ogni file indicizzato.",
+    "Le versioni dell'indice si attivano con uno swap atomico del puntatore.",
+    "La ricerca densa usa gli embedding di llama3 serviti da Ollama.",
+]
+
+
+class _Unrelated(Embeddings):
+    """Vettori casuali (per testo) quasi ortogonali: nessun chunk supera la soglia densa."""
+
+    def embed_documents(self, texts):
+        return [self.embed_query(t) for t in texts]
+
+    def embed_query(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).normal(size=256)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+
+@pytest.fixture
+def vectorstore(tmp_path, monkeypatch):
+    monkeypatch.setattr(rag, "VECTOR_BACKEND", "chroma")
+    monkeypatch.setattr(rag, "HYBRID_RETRIEVAL", True)
+    monkeypatch.setattr(rag, "RESULT_CACHE_ENTRIES", 0)
+    embedding = _Unrelated()
+    store = rag._open_collection(embedding, str(tmp_path / "db"))
+    store.index_paths = IndexPaths(str(tmp_path / "db"))
+    ids = [f"c{i}" for i in range(len(CHUNKS))]
+    store._collection.upsert(ids=ids, embeddings=embedding.embed_documents(CHUNKS),
+                             metadatas=[{"source_file": "manuale.pdf"}] * len(CHUNKS),
+                             documents=CHUNKS)
+    return store
+
+
+def test_off_topic_question_returns_nothing(vectorstore):
+    # "tempo" compare nel primo chunk (miglior punteggio BM25), "oggi" e "roma" in nessuno
+    assert rag.open_sparse_index(vectorstore).search("Che tempo fa oggi a Roma?", 5)
+    assert rag.retrieve_and_filter(vectorstore, "Che tempo fa oggi a Roma?") == []
+
+
+def test_cited_identifier_passes_on_bm25(vectorstore):
+    docs = rag.retrieve_and_filter(vectorstore, "A cosa serve il codice ZX-4471?")
+    assert [d.id for d in docs] == ["c1"]
+
+
+def test_all_selective_terms_pass_on_bm25(vectorstore):
+    docs = rag.retrieve_and_filter(vectorstore, "tempo di risposta del sistema")
+    assert [d.id for d in docs] == ["c0"]
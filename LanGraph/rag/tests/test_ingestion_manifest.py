@@ -0,0 +1,24 @@
+# Manifest di ingestion: un file caricato senza chunk resta registrato e viene saltato.
+
+from ingestion_manifest import IngestionManifest
+
+
+def test_file_without_chunks_is_skipped_next_time(tmp_path):
+    docs = tmp_path / "docs"
+    docs.mkdir()
+    (docs / "vuoto.txt").write_text("")
+    (docs / "pieno.txt").write_text("testo")
+    files = sorted(str(p) for p in docs.iterdir())
+
+    manifest = IngestionManifest(str(tmp_path / "manifest.json"))
+    manifest.plan(files)
+    assert sorted(manifest.pending) == ["pieno.txt", "vuoto.txt"]
+    # Come _finalize_sync: ogni file in attesa ha una voce, anche vuota
+    chunk_ids_by_file = {name: [] for name in manifest.pending}
+    chunk_ids_by_file["pieno.txt"] = ["c1"]
+    manifest.commit(chunk_ids_by_file)
+
+    reloaded = IngestionManifest.load(manifest.path)
+    assert reloaded.files["vuoto.txt"].chunk_ids == []
+    plan = reloaded.plan(files)
+    assert plan.to_load == [] and len(plan.unchanged) == 2
@@ -0,0 +1,46 @@
+# Catalogo dei file dal manifest: filtri sui file sorgente e near-duplicate.
+
+import pytest
+
+from ingestion_manifest import FileEntry, IngestionManifest
+from metadata_filter import MetadataCatalog, MetadataFilter
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    manifest = IngestionManifest(str(tmp_path / "manifest.json"))
+    manifest.files["nanotech1.pdf"] = FileEntry("nanotech1.pdf", 1, 1, "a", ["n1", "n2"])
+    # b.pdf: due chunk scartati come near-duplicate di chunk di nanotech1.pdf
+    manifest.files["b.pdf"] = FileEntry("b.pdf", 1, 1, "b", ["b1"],
+                                        duplicates={"b2": "n2", "b3": "n2"})
+    return MetadataCatalog(manifest)
+
+
+def test_near_duplicates_in_allowed_chunks(catalog):
+    assert catalog.allowed_chunk_ids(["b.pdf"]) == {"b1", "n2"}
+    assert catalog.allowed_chunk_ids(["nanotech1.pdf"]) == {"n1", "n2"}
+
+
+def test_near_duplicates_in_where(catalog):
+    where = catalog.where(MetadataFilter(sources=["b.pdf"]), ["b.pdf"])
+    assert where == {"source_file": {"$in": ["b.pdf", "nanotech1.pdf"]}}
+
+
+@pytest.fixture
+def short_names(tmp_path):
+    manifest = IngestionManifest(str(tmp_path / "manifest.json"))
+    for name in ("rag.pdf", "note.txt", "relazione.docx", "nanotech1.pdf"):
+        manifest.files[name] = FileEntry(name, 1, 1, name, [name + "#0"])
+    return MetadataCatalog(manifest)
+
+
+def test_common_words_are_not_file_names(short_names):
+    question = "Come funziona il RAG? Riassumi le note della relazione."
+    assert short_names.detect_sources(question) == []
+
+
+def test_explicit_or_quoted_names(short_names):
+    assert short_names.detect_sources("Riassumi rag.pdf") == ["rag.pdf"]
+    assert short_names.detect_sources('Cosa dice "note"?') == ["note.txt"]
+    assert short_names.detect_sources("Confronta «Relazione» e nanotech1") == \
+        ["relazione.docx", "nanotech1.pdf"]
@@ -0,0 +1,380 @@
+# ================================================================
+# TESTI DEI CHUNK  –  side store compresso, lettura solo dei top-k
+# ================================================================
+# Chroma salva il testo completo di ogni chunk nel file SQLite,
+# accanto a embedding e metadati: il DB cresce e ogni ricerca
+# attraversa più pagine del necessario. Con il side store:
+#
+#   vectorstore    ID, vettori e metadati (documento = "")
+#   frames.<g>.bin frame compressi (zstd, fallback zlib), ognuno
+#                  con FRAME_CHUNKS testi consecutivi: chunk dello
+#                  stesso file finiscono nello stesso frame
+#   index.json     codec, offset dei frame, ID -> (frame, posizione)
+#                  (scritto per ultimo con os.replace)
+#
+# Il retrieval (retrieve_and_filter) decomprime solo i frame dei
+# chunk finali. I frame nuovi vengono accodati al file della
+# generazione corrente; quando le righe cancellate superano metà
+# dello store si compatta in una nuova generazione.
+#
+# zstandard è opzionale (pip install zstandard): senza, si usa zlib.
+#
+# Benchmark disco/page cache (da LanGraph/rag):
+#   python text_store.py --chunks 100000
+# ================================================================
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import threading
+import zlib
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+INDEX_FILE = "index.json"
+FRAME_CHUNKS = 32          # testi per frame (rapporto di compressione vs byte decompressi per hit)
+COMPACT_RATIO = 0.5        # quota di righe cancellate oltre cui si riscrive lo store
+
+
+class _Zstd:
+    name = "zstd"
+
+    def __init__(self, level: int):
+        import zstandard
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        return self._decompressor.decompress(data)
+
+
+class _Zlib:
+    name = "zlib"
+
+    def __init__(self, level: int):
+        self.level = min(max(level, 1), 9)
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+
+def _make_codec(name: str, level: int, required: bool = False):
+    if name == "zstd":
+        try:
+            return _Zstd(level)
+        except ImportError as e:
+            if required:
+                raise ImportError("Lo store dei testi è compresso con zstd: pip install zstandard") from e
+            print("[WARN] zstandard non installato (pip install zstandard): testi compressi con zlib")
+    return _Zlib(level)
+
+
+def _encode_frame(texts: Sequence[str]) -> bytes:
+    encoded = [t.encode("utf-8") for t in texts]
+    return struct.pack(f"<I{len(encoded)}I", len(encoded), *map(len, encoded)) + b"".join(encoded)
+
+
+def _decode_frame(payload: bytes) -> List[str]:
+    (count,) = struct.unpack_from("<I", payload)
+    lengths = struct.unpack_from(f"<{count}I", payload, 4)
+    texts, pos = [], 4 + 4 * count
+    for length in lengths:
+        texts.append(payload[pos:pos + length].decode("utf-8"))
+        pos += length
+    return texts
+
+
+class ChunkTextStore:
+    """
+    Testi dei chunk compressi a frame. add/remove lavorano in RAM,
+    save() accoda i frame nuovi e riscrive l'indice; get() decomprime
+    ogni frame coinvolto una sola volta.
+    """
+
+    def __init__(self, directory: str, codec: str = "zstd", level: int = 3,
+                 frame_chunks: int = FRAME_CHUNKS):
+        self.directory = directory
+        self.frame_chunks = frame_chunks
+        self._lock = threading.RLock()
+        self._generation = 0
+        self._frames: List[Tuple[int, int]] = []          # (offset, lunghezza) nel file
+        self._rows: Dict[str, Tuple[int, int]] = {}       # ID -> (frame, posizione)
+        self._frame_rows: List[int] = []                  # righe per frame (comprese le cancellate)
+        self._pending: Dict[str, str] = {}
+        self._dead = 0
+        self._dirty = False
+        self._data = None
+
+        state = self._read_index()
+        if state is None:
+            self._codec = _make_codec(codec, level)
+        else:
+            self._codec = _make_codec(state["codec"], level, required=True)
+            self._generation = state["generation"]
+            self._frames = [tuple(f) for f in state["frames"]]
+            self._frame_rows = state["frame_rows"]
+            self._rows = {doc_id: tuple(pos) for doc_id, pos in state["rows"].items()}
+            self._dead = state["dead"]
+            self._map()
+
+    # --- File ---
+
+    def _frames_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"frames.{generation}.bin")
+
+    def _read_index(self) -> Optional[dict]:
+        path = os.path.join(self.directory, INDEX_FILE)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _map(self) -> None:
+        path = self._frames_path(self._generation)
+        end = self._frames[-1][0] + self._frames[-1][1] if self._frames else 0
+        self._data = None
+        if end:
+            with open(path, "rb") as f:
+                self._data = mmap.mmap(f.fileno(), end, access=mmap.ACCESS_READ)
+            if hasattr(self._data, "madvise"):
+                # Accessi sparsi: niente read-ahead, in page cache solo i frame letti
+                self._data.madvise(mmap.MADV_RANDOM)
+
+    @property
+    def nbytes(self) -> int:
+        """Byte compressi su disco (frame validi)."""
+        return sum(length for _, length in self._frames)
+
+    def __len__(self) -> int:
+        return len(self._rows) + len(self._pending)
+
+    def __contains__(self, doc_id: str) -> bool:
+        return doc_id in self._rows or doc_id in self._pending
+
+    # --- Modifiche ---
+
+    def add(self, ids: Sequence[str], texts: Sequence[str]) -> None:
+        with self._lock:
+            for doc_id, text in zip(ids, texts):
+                if self._rows.pop(doc_id, None) is not None:
+                    self._dead += 1
+                self._pending[doc_id] = text
+            self._dirty = True
+
+    def remove(self, ids: Sequence[str]) -> None:
+        with self._lock:
+            for doc_id in ids:
+                if self._rows.pop(doc_id, None) is not None:
+                    self._dead += 1
+                    self._dirty = True
+                elif self._pending.pop(doc_id, None) is not None:
+                    self._dirty = True
+
+    def clear(self) -> None:
+        with self._lock:
+            self._dead += len(self._rows)
+            self._rows = {}
+            self._pending = {}
+            self._dirty = True
+
+    # --- Lettura ---
+
+    def _frame_texts(self, frame: int) -> List[str]:
+        offset, length = self._frames[frame]
+        return _decode_frame(self._codec.decompress(self._data[offset:offset + length]))
+
+    def get(self, ids: Sequence[str]) -> List[Optional[str]]:
+        """Testi nell'ordine degli ID (None per gli ID sconosciuti)."""
+        with self._lock:
+            result: List[Optional[str]] = [None] * len(ids)
+            by_frame: Dict[int, List[Tuple[int, int]]] = {}
+            for i, doc_id in enumerate(ids):
+                if doc_id in self._pending:
+                    result[i] = self._pending[doc_id]
+                elif doc_id in self._rows:
+                    frame, slot = self._rows[doc_id]
+                    by_frame.setdefault(frame, []).append((i, slot))
+            for frame, wanted in by_frame.items():
+                texts = self._frame_texts(frame)
+                for i, slot in wanted:
+                    result[i] = texts[slot]
+            return result
+
+    # --- Persistenza ---
+
+    def save(self) -> None:
+        """
+        Accoda i frame dei testi nuovi e riscrive index.json (os.replace).
+        Oltre COMPACT_RATIO di righe cancellate riscrive tutto in una
+        nuova generazione.
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            total = sum(self._frame_rows) + len(self._pending)
+            old = None
+            if self._frames and self._dead > COMPACT_RATIO * total:
+                live = list(self._rows)
+                pending = dict(zip(live, self.get(live)))
+                pending.update(self._pending)
+                old = self._generation
+                self._generation += 1
+                self._frames, self._frame_rows, self._rows, self._dead = [], [], {}, 0
+                self._pending = pending
+
+            path = self._frames_path(self._generation)
+            end = self._frames[-1][0] + self._frames[-1][1] if self._frames else 0
+            items = list(self._pending.items())
+            with open(path, "r+b" if os.path.exists(path) else "wb") as f:
+                f.truncate(end)          # coda di un save interrotto
+                f.seek(end)
+                for start in range(0, len(items), self.frame_chunks):
+                    frame = items[start:start + self.frame_chunks]
+                    data = self._codec.compress(_encode_frame([text for _, text in frame]))
+                    for slot, (doc_id, _) in enumerate(frame):
+                        self._rows[doc_id] = (len(self._frames), slot)
+                    self._frames.append((f.tell(), len(data)))
+                    self._frame_rows.append(len(frame))
+                    f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+
+            tmp = os.path.join(self.directory, INDEX_FILE + ".tmp")
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"generation": self._generation, "codec": self._codec.name,
+                           "frames": self._frames, "frame_rows": self._frame_rows,
+                           "rows": self._rows, "dead": self._dead}, f)
+            os.replace(tmp, os.path.join(self.directory, INDEX_FILE))
+            self._pending = {}
+            self._dirty = False
+            self._map()
+            if old is not None:
+                try:
+                    os.remove(self._frames_path(old))
+                except OSError:
+                    pass
+
+
+# ================================================================
+# BENCHMARK: disco e page cache, testi in Chroma vs side store
+# ================================================================
+
+def _directory_files(path: str) -> List[str]:
+    return [os.path.join(root, name) for root, _, names in os.walk(path) for name in names]
+
+
+def _evict(paths: Sequence[str]) -> None:
+    """Toglie i file dalla page cache (Linux, posix_fadvise)."""
+    for path in paths:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fdatasync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def _resident_bytes(paths: Sequence[str]) -> int:
+    """Byte dei file presenti in page cache (mincore)."""
+    import ctypes
+
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.mmap.restype = ctypes.c_void_p
+    libc.mmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int, ctypes.c_int,
+                          ctypes.c_int, ctypes.c_long]
+    libc.munmap.argtypes = [ctypes.c_void_p, ctypes.c_size_t]
+    libc.mincore.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.POINTER(ctypes.c_ubyte)]
+    total = 0
+    for path in paths:
+        size = os.path.getsize(path)
+        if not size:
+            continue
+        fd = os.open(path, os.O_RDONLY)
+        addr = libc.mmap(None, size, mmap.PROT_READ, mmap.MAP_SHARED, fd, 0)
+        os.close(fd)
+        pages = (ctypes.c_ubyte * ((size + mmap.PAGESIZE - 1) // mmap.PAGESIZE))()
+        libc.mincore(addr, size, pages)
+        libc.munmap(addr, size)
+        total += sum(p & 1 for p in pages) * mmap.PAGESIZE
+    return total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Testi in Chroma vs side store compresso")
+    parser.add_argument("--chunks", type=int, default=100000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--words", type=int, default=150, help="parole per chunk")
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--k", type=int, default=20, help="candidati per query (testi letti: 5)")
+    parser.add_argument("--workdir", default=".", help="directory su disco (non tmpfs)")
+    args = parser.parse_args()
+
+    import shutil
+    import tempfile
+    import time
+
+    from langchain_chroma import Chroma
+
+    rng = np.random.default_rng(0)
+    vocab = np.array([f"termine{i}" for i in range(20000)])
+    words = vocab[np.minimum(rng.zipf(1.3, size=(args.chunks, args.words)), len(vocab)) - 1]
+    texts = [" ".join(row) for row in words]
+    vectors = rng.standard_normal((args.chunks, args.dim)).astype(np.float32)
+    ids = [f"c{i}" for i in range(args.chunks)]
+    metas = [{"source_file": f"doc{i // 200}.pdf", "page": (i // 10) % 50} for i in range(args.chunks)]
+    queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    raw = sum(len(t.encode("utf-8")) for t in texts)
+
+    workdir = tempfile.mkdtemp(dir=args.workdir)
+    try:
+        layouts = {}
+        for name in ("testi in Chroma", "side store"):
+            directory = os.path.join(workdir, name.replace(" ", "_"))
+            store = Chroma("bench", persist_directory=os.path.join(directory, "chroma"),
+                           collection_metadata={"hnsw:space": "cosine"})
+            side = ChunkTextStore(os.path.join(directory, "texts")) if name == "side store" else None
+            for s in range(0, args.chunks, 5000):
+                batch = texts[s:s + 5000]
+                if side is not None:
+                    side.add(ids[s:s + 5000], batch)
+                    batch = [""] * len(batch)
+                store._collection.upsert(ids=ids[s:s + 5000], embeddings=vectors[s:s + 5000],
+                                         metadatas=metas[s:s + 5000], documents=batch)
+            if side is not None:
+                side.save()
+            layouts[name] = (directory, store, side)
+
+        print(f"\n[BENCH] {args.chunks} chunk, {raw / 2**20:.1f} MB di testo, "
+              f"{args.queries} query (top-{args.k}, testi dei primi 5)")
+        print(f"  {'layout':<16} {'disco MB':>9} {'page cache MB':>14} {'p50 ms':>7}")
+        for name, (directory, store, side) in layouts.items():
+            files = _directory_files(directory)
+            disk = sum(os.path.getsize(p) for p in files)
+            _evict(files)
+            latencies = []
+            for q in queries:
+                start = time.perf_counter()
+                include = ["metadatas", "distances"] + (["documents"] if side is None else [])
+                hits = store._collection.query(query_embeddings=[q], n_results=args.k, include=include)
+                top = hits["ids"][0][:5]
+                found = hits["documents"][0][:5] if side is None else side.get(top)
+                assert all(found)
+                latencies.append((time.perf_counter() - start) * 1000)
+            latencies.sort()
+            print(f"  {name:<16} {disk / 2**20:>9.1f} {_resident_bytes(files) / 2**20:>14.1f} "
+                  f"{latencies[len(latencies) // 2]:>7.2f}")
+        side = layouts["side store"][2]
+        print(f"  side store: {side.nbytes / 2**20:.1f} MB compressi ({side._codec.name}), "
+              f"rapporto {raw / max(side.nbytes, 1):.1f}x")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
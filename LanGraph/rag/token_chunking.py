@@ -0,0 +1,207 @@
+# ================================================================
+# CHUNKING TOKENIZER-AWARE  –  token del modello target
+# ================================================================
+# Le dimensioni dei chunk vengono misurate con il tokenizer del
+# modello che userà il contesto (llama3), non con un'approssimazione:
+#
+#   "hf:<repo o path di tokenizer.json>"  -> HuggingFace tokenizers
+#   "tiktoken:<encoding>"                 -> tiktoken
+#
+# Il tokenizer si carica una sola volta per processo, i documenti
+# vengono tokenizzati in batch (in Rust, multi-thread) e ogni chunk
+# riceve metadata["token_count"], così il packing del contesto non
+# deve ri-tokenizzare.
+#
+# Benchmark (da LanGraph/rag):  python token_chunking.py
+# ================================================================
+
+import argparse
+import threading
+import time
+from itertools import accumulate
+from typing import Dict, List, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_text_splitters import TextSplitter
+
+# Llama 3 usa un BPE tiktoken da 128k token i cui primi 100k sono cl100k_base:
+# è il fallback più vicino se il tokenizer ufficiale (gated su HF) non è disponibile.
+FALLBACK_TOKENIZER = "tiktoken:cl100k_base"
+
+_TOKENIZERS: Dict[str, "TokenizerAdapter"] = {}
+_TOKENIZERS_LOCK = threading.Lock()
+
+
+class TokenizerAdapter:
+    """
+    Interfaccia minima comune: offset (in caratteri) dei token di un batch di testi.
+    """
+
+    def __init__(self, spec: str):
+        self.spec = spec
+        kind, _, name = spec.partition(":")
+        if kind == "hf":
+            from tokenizers import Tokenizer
+            self._hf = Tokenizer.from_file(name) if name.endswith(".json") else Tokenizer.from_pretrained(name)
+            self._tt = None
+        elif kind == "tiktoken":
+            import tiktoken
+            self._tt = tiktoken.get_encoding(name)
+            self._hf = None
+        else:
+            raise ValueError(f"Tokenizer non valido: '{spec}' (usa hf:<nome> o tiktoken:<encoding>)")
+
+    def offsets_batch(self, texts: Sequence[str]) -> List[List[Tuple[int, int]]]:
+        if self._hf is not None:
+            encodings = self._hf.encode_batch(list(texts), add_special_tokens=False)
+            return [enc.offsets for enc in encodings]
+
+        results = []
+        for text, tokens in zip(texts, self._tt.encode_ordinary_batch(list(texts))):
+            byte_ends = list(accumulate(len(b) for b in self._tt.decode_tokens_bytes(tokens)))
+            if len(text) != len(text.encode("utf-8")):
+                # Testo non ASCII: converte gli offset da byte a caratteri
+                char_at_byte = []
+                for i, ch in enumerate(text):
+                    char_at_byte.extend([i] * len(ch.encode("utf-8")))
+                char_at_byte.append(len(text))
+                byte_ends = [char_at_byte[min(b, len(char_at_byte) - 1)] for b in byte_ends]
+            starts = [0] + byte_ends[:-1]
+            results.append(list(zip(starts, byte_ends)))
+        return results
+
+    def count_batch(self, texts: Sequence[str]) -> List[int]:
+        if self._hf is not None:
+            return [len(enc.ids) for enc in self._hf.encode_batch(list(texts), add_special_tokens=False)]
+        return [len(tokens) for tokens in self._tt.encode_ordinary_batch(list(texts))]
+
+
+def get_tokenizer(spec: str) -> TokenizerAdapter:
+    """
+    Tokenizer condiviso per processo. Se quello richiesto non si carica
+    (modello gated, niente rete) si ripiega su FALLBACK_TOKENIZER.
+    """
+    with _TOKENIZERS_LOCK:
+        if spec not in _TOKENIZERS:
+            try:
+                _TOKENIZERS[spec] = TokenizerAdapter(spec)
+            except Exception as e:
+                if spec == FALLBACK_TOKENIZER:
+                    raise
+                print(f"[WARN] Tokenizer '{spec}' non disponibile ({type(e).__name__}): "
+                      f"uso {FALLBACK_TOKENIZER}")
+                _TOKENIZERS[spec] = TokenizerAdapter(FALLBACK_TOKENIZER)
+        return _TOKENIZERS[spec]
+
+
+class TokenAwareSplitter(TextSplitter):
+    """
+    Finestre di chunk_size token con chunk_overlap token di sovrapposizione,
+    misurate col tokenizer del modello. Il testo di ogni chunk è una fetta
+    esatta dell'originale (dagli offset), non una ri-decodifica.
+    """
+
+    def __init__(self, tokenizer: str, chunk_size: int = 800, chunk_overlap: int = 100, **kwargs):
+        super().__init__(chunk_size=chunk_size, chunk_overlap=chunk_overlap, **kwargs)
+        self.tokenizer = get_tokenizer(tokenizer)
+
+    def _windows(self, text: str, offsets: List[Tuple[int, int]]) -> List[Tuple[str, int]]:
+        step = self._chunk_size - self._chunk_overlap
+        windows = []
+        for start in range(0, len(offsets), step):
+            end = min(start + self._chunk_size, len(offsets))
+            piece = text[offsets[start][0]:offsets[end - 1][1]].strip()
+            if piece:
+                windows.append((piece, end - start))
+            if end == len(offsets):
+                break
+        return windows
+
+    def split_text(self, text: str) -> List[str]:
+        return [piece for piece, _ in self._windows(text, self.tokenizer.offsets_batch([text])[0])]
+
+    def split_documents(self, documents) -> List[Document]:
+        """
+        Tokenizza tutti i documenti in un'unica chiamata batch e salva
+        il numero di token di ogni chunk in metadata["token_count"].
+        """
+        documents = list(documents)
+        all_offsets = self.tokenizer.offsets_batch([d.page_content for d in documents])
+        chunks = []
+        for doc, offsets in zip(documents, all_offsets):
+            for piece, n_tokens in self._windows(doc.page_content, offsets):
+                chunks.append(Document(page_content=piece,
+                                       metadata={**doc.metadata, "token_count": n_tokens}))
+        return chunks
+
+
+class TokenCountingSplitter(TextSplitter):
+    """
+    Avvolge un altro splitter (es. content-defined) e aggiunge
+    metadata["token_count"] a tutti i chunk con un conteggio batch.
+    """
+
+    def __init__(self, inner: TextSplitter, tokenizer: str):
+        super().__init__(chunk_size=inner._chunk_size, chunk_overlap=inner._chunk_overlap)
+        self.inner = inner
+        self.tokenizer = get_tokenizer(tokenizer)
+
+    def split_text(self, text: str) -> List[str]:
+        return self.inner.split_text(text)
+
+    def split_documents(self, documents) -> List[Document]:
+        chunks = self.inner.split_documents(documents)
+        for chunk, n_tokens in zip(chunks, self.tokenizer.count_batch([c.page_content for c in chunks])):
+            chunk.metadata["token_count"] = n_tokens
+        return chunks
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput del chunking tokenizer-aware")
+    parser.add_argument("--tokenizer", default=FALLBACK_TOKENIZER,
+                        help="es. hf:/percorso/tokenizer.json per i token esatti di llama3")
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="Numero di documenti sintetici (0 = corpus di ./data)")
+    parser.add_argument("--chunk-size", type=int, default=800)
+    parser.add_argument("--overlap", type=int, default=100)
+    args = parser.parse_args()
+
+    if args.synthetic:
+        import random
+        rng = random.Random(0)
+        words = ["nanotecnologia", "materiale", "superficie", "particella", "è", "della", "più",
+                 "struttura", "analisi", "risultato", "cellula", "energia", "città", "perché"]
+        docs = [Document(page_content=" ".join(rng.choice(words) for _ in range(3000)),
+                         metadata={"source_file": f"doc{i}.txt"}) for i in range(args.synthetic)]
+    else:
+        import rag
+        docs = rag.load_all_documents()
+    if not docs:
+        raise SystemExit("[ERRORE] Nessun documento")
+
+    start = time.perf_counter()
+    splitter = TokenAwareSplitter(args.tokenizer, args.chunk_size, args.overlap)
+    load_time = time.perf_counter() - start
+    tok = splitter.tokenizer
+    texts = [d.page_content for d in docs]
+
+    start = time.perf_counter()
+    for text in texts:
+        tok.count_batch([text])
+    single = time.perf_counter() - start
+
+    start = time.perf_counter()
+    n_tokens = sum(tok.count_batch(texts))
+    batch = time.perf_counter() - start
+
+    start = time.perf_counter()
+    chunks = splitter.split_documents(docs)
+    chunking = time.perf_counter() - start
+
+    print(f"\n[BENCH] tokenizer={tok.spec}  caricamento={load_time:.2f}s (una volta per processo)")
+    print(f"  {len(docs)} documenti, {n_tokens} token")
+    print(f"  tokenizzazione documento per documento: {n_tokens / single:12.0f} token/s")
+    print(f"  tokenizzazione batch:                   {n_tokens / batch:12.0f} token/s")
+    print(f"  chunking completo ({len(chunks)} chunk):      {n_tokens / chunking:12.0f} token/s")
+    sizes = [c.metadata["token_count"] for c in chunks]
+    print(f"  token/chunk: min={min(sizes)} max={max(sizes)} media={sum(sizes) / len(sizes):.0f}")
@@ -0,0 +1,329 @@
+# ================================================================
+# COMPRESSIONE DEI VETTORI  –  riduzione + quantizzazione + rescoring
+# ================================================================
+# Gli embedding llama3 sono 4096 float32 (16 KB per chunk). Qui si
+# costruisce un indice compatto per la prima fase della ricerca:
+#
+#   spec "pca256-int8"   -> PCA a 256 dimensioni, int8 per componente
+#   spec "trunc1024-f16" -> prime 1024 dimensioni, float16
+#   spec "int8" / "f16"  -> dimensione piena, solo quantizzazione
+#
+#   query ──> scansione sui vettori compressi ──> top 'rescore' candidati
+#                                                      |
+#         vettori full-precision (solo dei candidati) <─┘ ──> top-k esatti
+#
+# La scansione lavora direttamente sui codici, a blocchi di
+# SCAN_BLOCK_ROWS righe: solo un blocco alla volta viene convertito a
+# float32 e le scale int8 si applicano ai prodotti scalari, mai
+# all'intera matrice.
+#
+# Questo modulo contiene il modello (riduzione, quantizzazione) e la
+# scansione. Codici e vettori full-precision sono righe di
+# CompressedVectors (compressed_store.py), su disco in mmap e fuori
+# dall'HNSW di Chroma: la collection tiene solo testi, metadati e un
+# segnaposto. Il report della dimensione riporta codici, vettori
+# completi e totale. Il benchmark qui sotto misura solo i codici.
+#
+# Benchmark dimensione/recall rispetto alla ricerca esatta:
+#   python vector_compression.py                    (collection di rag.py)
+#   python vector_compression.py --synthetic 20000 4096
+# ================================================================
+
+import argparse
+import re
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+DTYPES = ("f32", "f16", "int8")
+SCAN_BLOCK_ROWS = 16384            # righe di codici convertite a float32 per blocco
+
+
+# ================================================================
+# RIDUZIONE DI DIMENSIONALITÀ
+# ================================================================
+
+@dataclass
+class Reducer:
+    """Proiezione fittata sul corpus: 'none', 'trunc' o 'pca'"""
+    method: str
+    dim: int
+    mean: Optional[np.ndarray] = None
+    components: Optional[np.ndarray] = None     # (D, dim)
+
+    def transform(self, vectors) -> np.ndarray:
+        x = np.asarray(vectors, dtype=np.float32)
+        if x.ndim == 1:
+            x = x[None, :]
+        if self.method == "trunc":
+            return np.ascontiguousarray(x[:, :self.dim])
+        if self.method == "pca":
+            return (x - self.mean) @ self.components
+        return x
+
+
+def fit_reducer(vectors: np.ndarray, method: str, dim: int,
+                sample: int = 20000, seed: int = 0) -> Reducer:
+    """
+    Fitta la riduzione sul corpus. La PCA usa una SVD su un campione
+    di al più 'sample' vettori (costo indipendente dalla dimensione del corpus).
+    """
+    if method in ("none", "trunc"):
+        return Reducer(method, min(dim, vectors.shape[1]) if method == "trunc" else vectors.shape[1])
+
+    rng = np.random.default_rng(seed)
+    rows = vectors if len(vectors) <= sample else vectors[rng.choice(len(vectors), sample, replace=False)]
+    rows = np.asarray(rows, dtype=np.float32)
+    mean = rows.mean(axis=0)
+    _, _, vt = np.linalg.svd(rows - mean, full_matrices=False)
+    dim = min(dim, vt.shape[0])
+    return Reducer("pca", dim, mean.astype(np.float32), np.ascontiguousarray(vt[:dim].T, dtype=np.float32))
+
+
+# ================================================================
+# QUANTIZZAZIONE
+# ================================================================
+
+def quantize(x: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    f32/f16: cast diretto. int8: scala simmetrica per vettore (max|x| -> 127).
+    """
+    if dtype == "f32":
+        return x.astype(np.float32), None
+    if dtype == "f16":
+        return x.astype(np.float16), None
+    scales = np.abs(x).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(x / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def dequantize(codes: np.ndarray, scales: Optional[np.ndarray]) -> np.ndarray:
+    x = codes.astype(np.float32)
+    return x * scales[:, None] if scales is not None else x
+
+
+def parse_spec(spec: str) -> Tuple[str, int, str]:
+    """
+    "pca256-int8" -> ("pca", 256, "int8"); "f16" -> ("none", 0, "f16").
+    """
+    match = re.fullmatch(r"(?:(pca|trunc)(\d+)-)?(f32|f16|int8)", spec.strip().lower())
+    if not match:
+        raise ValueError(f"Spec di compressione non valida: '{spec}' (es. pca256-int8, trunc1024-f16, int8)")
+    method, dim, dtype = match.groups()
+    return method or "none", int(dim or 0), dtype
+
+
+def pairwise_distance(query: np.ndarray, vectors: np.ndarray, space: str,
+                      sq_norms: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Distanze con la stessa semantica di Chroma:
+    l2 = euclidea al quadrato, cosine = 1 - cos, ip = 1 - prodotto scalare.
+    """
+    dots = vectors @ query
+    if space == "l2":
+        if sq_norms is None:
+            sq_norms = np.einsum("ij,ij->i", vectors, vectors)
+        return sq_norms - 2.0 * dots + float(query @ query)
+    if space == "cosine":
+        norms = np.sqrt(sq_norms) if sq_norms is not None else np.linalg.norm(vectors, axis=1)
+        return 1.0 - dots / np.maximum(norms * np.linalg.norm(query), 1e-12)
+    return 1.0 - dots
+
+
+# ================================================================
+# INDICE COMPRESSO
+# ================================================================
+
+_CODE_DTYPES = {"f32": np.float32, "f16": np.float16, "int8": np.int8}
+
+
+class CompressedIndex:
+    """
+    Modello dell'indice piatto (riduzione + quantizzazione per riga) e
+    scansione a blocchi. I codici sono colonne di CompressedVectors
+    (compressed_store.py), una riga per vettore: "codes", "norms" e, per
+    int8, "scales". I vettori completi servono solo per il rescoring.
+    """
+
+    order_key = None                    # righe su disco in ordine di inserimento
+    train_rows = 20000                  # righe campionate per la PCA
+
+    def __init__(self, spec: str, space: str = "l2", reducer: Optional[Reducer] = None):
+        self.spec = spec
+        self.space = space
+        self.method, self.dim, self.dtype = parse_spec(spec)
+        self.reducer = reducer
+
+    @property
+    def trained(self) -> bool:
+        return self.reducer is not None
+
+    @property
+    def nbytes(self) -> int:
+        """Byte del modello in RAM (matrice PCA e media)."""
+        if self.reducer is None or self.reducer.components is None:
+            return 0
+        return self.reducer.components.nbytes + self.reducer.mean.nbytes
+
+    def columns(self, dim: int) -> Dict[str, Tuple[type, int]]:
+        columns = {"codes": (_CODE_DTYPES[self.dtype], self.reducer.dim), "norms": (np.float32, 1)}
+        if self.dtype == "int8":
+            columns["scales"] = (np.float32, 1)
+        return columns
+
+    def _prepare(self, vectors) -> np.ndarray:
+        x = np.asarray(vectors, dtype=np.float32)
+        if x.ndim == 1:
+            x = x[None, :]
+        if self.space == "cosine":
+            x = x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+        return x
+
+    def train(self, sample: np.ndarray, total: int) -> None:
+        """Fitta la riduzione su un campione di righe (total non serve: niente liste)."""
+        self.reducer = fit_reducer(self._prepare(sample), self.method, self.dim, sample=self.train_rows)
+
+    def encode(self, vectors) -> Dict[str, np.ndarray]:
+        """Codici, scale e norme al quadrato dei vettori approssimati, riga per riga."""
+        codes, scales = quantize(self.reducer.transform(self._prepare(vectors)), self.dtype)
+        approx = codes.astype(np.float32)
+        norms = np.einsum("ij,ij->i", approx, approx)
+        columns = {"codes": codes}
+        if scales is not None:
+            norms *= scales ** 2
+            columns["scales"] = scales[:, None]
+        columns["norms"] = norms[:, None]
+        return columns
+
+    def _dots(self, q: np.ndarray, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        Prodotti scalari query-codici a blocchi di SCAN_BLOCK_ROWS righe:
+        solo un blocco alla volta diventa float32, le scale int8 si
+        applicano ai prodotti (una moltiplicazione per riga).
+        """
+        codes = columns["codes"]
+        dots = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCAN_BLOCK_ROWS):
+            block = np.asarray(codes[start:start + SCAN_BLOCK_ROWS])
+            dots[start:start + len(block)] = block.astype(np.float32) @ q
+        if "scales" in columns:
+            dots *= np.asarray(columns["scales"]).reshape(-1)
+        return dots
+
+    def candidates(self, query_vector, n: int, columns: Dict[str, np.ndarray], alive: np.ndarray,
+                   exhaustive: bool = False) -> np.ndarray:
+        """Righe dei primi n candidati (tra le righe 'alive') secondo la distanza approssimata."""
+        valid = int(alive.sum())
+        n = min(n, valid)
+        if n <= 0:
+            return np.empty(0, dtype=np.int64)
+        q = self.reducer.transform(self._prepare(query_vector))[0]
+        dots = self._dots(q, columns)
+        if self.space == "ip":
+            dist = 1.0 - dots
+        else:
+            dist = np.asarray(columns["norms"]).reshape(-1) - 2.0 * dots + float(q @ q)
+        dist[~alive] = np.inf
+        top = np.argpartition(dist, n - 1)[:n]
+        return top[np.argsort(dist[top])]
+
+    # --- Persistenza del modello ---
+
+    def model_arrays(self) -> Dict[str, np.ndarray]:
+        arrays = {"dim": np.asarray(self.reducer.dim)}
+        if self.reducer.components is not None:
+            arrays["mean"] = self.reducer.mean
+            arrays["components"] = self.reducer.components
+        return arrays
+
+    def load_model(self, arrays) -> None:
+        self.reducer = Reducer(self.method, int(arrays["dim"]),
+                               arrays["mean"] if "mean" in arrays else None,
+                               arrays["components"] if "components" in arrays else None)
+
+
+def chroma_space(vectorstore) -> str:
+    """Metrica della collection Chroma ('l2' se non configurata)."""
+    collection = vectorstore._collection
+    try:
+        space = (collection.configuration.get("hnsw") or {}).get("space")
+    except Exception:
+        space = None
+    return space or (collection.metadata or {}).get("hnsw:space", "l2")
+
+
+# ================================================================
+# VALUTAZIONE: dimensione e recall rispetto alla ricerca esatta
+# ================================================================
+
+def evaluate_compression(vectors: np.ndarray, queries: np.ndarray, specs: Sequence[str],
+                         k: int = 5, rescore: int = 50, space: str = "l2") -> List[Dict]:
+    exact = [set(np.argsort(pairwise_distance(q, vectors, space))[:k]) for q in queries]
+    rows = [{"spec": "baseline f32", "bytes": vectors.nbytes, "ratio": 1.0,
+             "recall_approx": 1.0, "recall_rescored": 1.0, "ms_query": 0.0}]
+    alive = np.ones(len(vectors), dtype=bool)
+    rng = np.random.default_rng(0)
+
+    for spec in specs:
+        index = CompressedIndex(spec, space)
+        sample = rng.choice(len(vectors), min(len(vectors), index.train_rows), replace=False)
+        index.train(vectors[np.sort(sample)], len(vectors))
+        columns = index.encode(vectors)
+        nbytes = sum(c.nbytes for c in columns.values()) + index.nbytes
+        approx_hits = rescored_hits = 0
+        start = time.perf_counter()
+        for q, truth in zip(queries, exact):
+            approx_hits += len(truth & set(index.candidates(q, k, columns, alive).tolist()))
+            shortlist = index.candidates(q, max(k, rescore), columns, alive)
+            dist = pairwise_distance(q, vectors[shortlist], space)
+            rescored_hits += len(truth & set(shortlist[np.argsort(dist)[:k]].tolist()))
+        elapsed = time.perf_counter() - start
+        total = k * len(queries)
+        rows.append({"spec": spec, "bytes": nbytes, "ratio": vectors.nbytes / nbytes,
+                     "recall_approx": approx_hits / total, "recall_rescored": rescored_hits / total,
+                     "ms_query": 1000 * elapsed / len(queries)})
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Dimensione e recall dei vettori compressi")
+    parser.add_argument("--persist", default="./chroma_db")
+    parser.add_argument("--collection", default="aggregatore_docs")
+    parser.add_argument("--synthetic", type=int, nargs=2, metavar=("N", "DIM"),
+                        help="Usa N vettori casuali di dimensione DIM invece della collection")
+    parser.add_argument("--specs", nargs="+", default=["f16", "int8", "pca512-f16", "pca256-int8", "trunc1024-int8"])
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--rescore", type=int, default=50)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.synthetic:
+        n, dim = args.synthetic
+        # Dati con struttura a bassa dimensionalità, come gli embedding reali
+        basis = rng.standard_normal((64, dim)).astype(np.float32)
+        vectors = rng.standard_normal((n, 64)).astype(np.float32) @ basis
+        vectors += 0.1 * rng.standard_normal((n, dim)).astype(np.float32)
+    else:
+        import chromadb
+        collection = chromadb.PersistentClient(path=args.persist).get_collection(args.collection)
+        data = collection.get(include=["embeddings"])
+        vectors = np.asarray(data["embeddings"], dtype=np.float32)
+    if len(vectors) == 0:
+        raise SystemExit("[ERRORE] Nessun vettore da valutare")
+
+    # Query: vettori del corpus perturbati (simulano domande vicine ai chunk)
+    picks = rng.choice(len(vectors), min(args.queries, len(vectors)), replace=False)
+    noise = rng.standard_normal((len(picks), vectors.shape[1])).astype(np.float32)
+    queries = vectors[picks] + 0.05 * np.linalg.norm(vectors[picks], axis=1, keepdims=True) \
+        * noise / np.sqrt(vectors.shape[1])
+
+    print(f"\n[BENCH] {len(vectors)} vettori x {vectors.shape[1]} dim, "
+          f"{len(queries)} query, k={args.k}, rescore={args.rescore}")
+    print(f"  {'spec':<16} {'MB codici':>9} {'x':>6} {'recall@k':>9} {'+rescore':>9} {'ms/q':>7}")
+    for row in evaluate_compression(vectors, queries, args.specs, args.k, args.rescore):
+        print(f"  {row['spec']:<16} {row['bytes'] / 2**20:9.2f} {row['ratio']:6.1f} "
+              f"{row['recall_approx']:9.3f} {row['recall_rescored']:9.3f} {row['ms_query']:7.2f}")
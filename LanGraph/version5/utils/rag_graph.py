@@ -4,12 +4,21 @@ Decide automaticamente se usare RAG o risposta diretta
 """
 
 from typing import TypedDict, Literal
-from langchain_ollama import ChatOllama, OllamaEmbeddings
+from langchain_ollama import ChatOllama
 from langchain_community.vectorstores import Chroma
 from langchain_text_splitters import RecursiveCharacterTextSplitter 
 from langchain_core.documents import Document
 from langgraph.graph import StateGraph, END
 import re
+import sys
+from pathlib import Path
+
+# Moduli condivisi con l'aggregatore documentale (LanGraph/rag)
+sys.path.append(str(Path(__file__).resolve().parents[2] / "rag"))
+from embedding_backends import build_embeddings
+from numpy_store import NumpyVectorStore
+from query_cache import shared_query_cache
+from result_cache import RetrievalCache
 
 # ============================================
 # DEFINIZIONE DELLO STATE
@@ -35,15 +44,32 @@ llm = ChatOllama(
     temperature=0.7
 )
 
-# Embeddings per la ricerca semantica
-embeddings = OllamaEmbeddings(
-    model="llama3",
-    base_url="http://localhost:11434"
+# Embeddings per la ricerca semantica (cache su disco condivisa con rag.py)
+# "llama3" via Ollama oppure un modello locale, es. "st:all-MiniLM-L6-v2"
+EMBEDDING_MODEL = "llama3"
+
+# Cache delle domande in memoria, condivisa tra le sessioni Streamlit del processo
+QUERY_CACHE_ENTRIES = 1024
+QUERY_CACHE_TTL_S = 3600
+
+embeddings = build_embeddings(
+    EMBEDDING_MODEL,
+    base_url="http://localhost:11434",
+    query_cache=shared_query_cache(QUERY_CACHE_ENTRIES, QUERY_CACHE_TTL_S)
 )
 
+# Vector store: "chroma" oppure "numpy" (ricerca esatta in-process, niente round trip verso Chroma)
+VECTOR_BACKEND = "chroma"
+
 # Vector store globale (verrà popolato dall'app)
 vectorstore = None
 
+# Risultati delle ricerche, condivisi tra le sessioni: initialize_vectorstore
+# passa a una nuova generazione, quindi non restano mai risultati vecchi
+RETRIEVAL_K = 3
+RESULT_CACHE_ENTRIES = 256
+retrieval_cache = RetrievalCache(max_entries=RESULT_CACHE_ENTRIES)
+
 
 # ============================================
 # FUNZIONI DEI NODI
@@ -104,12 +130,18 @@ def retrieve_documents(state: GraphState) -> GraphState:
         state["path_taken"] += " ⚠️ (Nessun documento caricato)"
         return state
     
-    # Ricerca semantica
+    # Ricerca semantica (in cache finché il vector store non viene reinizializzato)
     try:
-        docs = vectorstore.similarity_search(question, k=3)
+        key = retrieval_cache.key(question, RETRIEVAL_K)
+        docs = retrieval_cache.get(key)
+        if docs is None:
+            docs = vectorstore.similarity_search(question, k=RETRIEVAL_K)
+            retrieval_cache.put(key, docs)
         state["retrieved_docs"] = docs
         
         print(f"📚 Retrieved {len(docs)} documents")
+        print(f"   Cache domande: {embeddings.query_cache}")
+        print(f"   Cache risultati: {retrieval_cache}")
         for i, doc in enumerate(docs, 1):
             print(f"   Doc {i}: {doc.page_content[:100]}...")
             
@@ -235,6 +267,7 @@ def initialize_vectorstore(documents: list[str]) -> Chroma:
     
     if not documents:
         vectorstore = None
+        retrieval_cache.bump()
         return None
     
     # Crea oggetti Document
@@ -248,11 +281,14 @@ def initialize_vectorstore(documents: list[str]) -> Chroma:
     splits = text_splitter.split_documents(docs)
     
     # Crea vector store
-    vectorstore = Chroma.from_documents(
+    store_cls = NumpyVectorStore if VECTOR_BACKEND == "numpy" else Chroma
+    vectorstore = store_cls.from_documents(
         documents=splits,
         embedding=embeddings,
         collection_name="rag_collection"
     )
+    # Dopo lo scambio: le ricerche sul vector store precedente non entrano in cache
+    retrieval_cache.bump()
     
     print(f"✅ Vector store inizializzato con {len(splits)} chunks")
     return vectorstore